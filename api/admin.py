@@ -1,15 +1,176 @@
-from django.contrib import admin
-from api.models import Order, OrderItem, User, Product
+from django import forms
+from django.contrib import admin, messages
+from django.core.paginator import Paginator
+from django.db import connections
+from django.utils.functional import cached_property
+from api.models import Order, OrderItem, User, Product, StockMovement
+from api.inventory import delete_orders, record_stock_movements
+from api.model_validators import BusinessLogicValidator
+from api.product_cache import product_cache
+from api.order_cache import invalidate_user_orders
+from api.order_status import transition_orders
+
+
+class EstimatedCountPaginator(Paginator):
+    """Paginator that uses the planner's row estimate instead of COUNT(*) on large tables"""
+    # Below this many rows the exact count is cheap enough to run
+    estimate_threshold = 100000
+
+    @cached_property
+    def count(self):
+        queryset = self.object_list
+        query = getattr(queryset, 'query', None)
+        # Only an unfiltered changelist can be answered from table statistics
+        if query is not None and not query.where:
+            estimate = self._estimated_rows(queryset)
+            if estimate is not None and estimate > self.estimate_threshold:
+                return estimate
+        return super().count
+
+    def _estimated_rows(self, queryset):
+        connection = connections[queryset.db]
+        if connection.vendor != 'postgresql':
+            return None
+        # A partitioned table has no rows of its own, so add up its partitions'
+        # estimates; reltuples is -1 for tables that were never analyzed
+        with connection.cursor() as cursor:
+            cursor.execute(
+                "SELECT SUM(GREATEST(reltuples, 0))::bigint FROM pg_class "
+                "WHERE oid = to_regclass(%s) "
+                "OR oid IN (SELECT inhrelid FROM pg_inherits WHERE inhparent = to_regclass(%s))",
+                [queryset.model._meta.db_table] * 2
+            )
+            row = cursor.fetchone()
+        return row[0] if row else None
+
+
+class ScalableModelAdmin(admin.ModelAdmin):
+    """Base admin for tables that are too big for naive changelists"""
+    paginator = EstimatedCountPaginator
+    # Skip the second unfiltered COUNT(*) behind the "N total" link
+    show_full_result_count = False
+    list_per_page = 50
+
 
-# Register your models here.
 class OrderItemInline(admin.TabularInline):
+    """Read-only: item changes go through the API, which reserves and releases their stock"""
     model = OrderItem
+    extra = 0
+    fields = ('product', 'quantity', 'unit_price')
+    readonly_fields = fields
+    can_delete = False
+
+    def has_add_permission(self, request, obj=None):
+        return False
 
-class OrderAdmin(admin.ModelAdmin):
+    def get_queryset(self, request):
+        return super().get_queryset(request).select_related('product')
+
+
+class OrderAdminForm(forms.ModelForm):
+    class Meta:
+        model = Order
+        fields = '__all__'
+
+    def clean_status(self):
+        status = self.cleaned_data['status']
+        if self.instance._state.adding:
+            if status != Order.StatusChoices.PENDING:
+                raise forms.ValidationError('New orders start as Pending.')
+        elif status != self.instance.status:
+            BusinessLogicValidator.validate_order_status_transition(self.instance.status, status)
+        return status
+
+
+class OrderAdmin(ScalableModelAdmin):
+    form = OrderAdminForm
+    list_display = ('order_id', 'user', 'status', 'created_at')
+    list_select_related = ('user',)
+    list_filter = ('status', 'created_at')
+    ordering = ('-created_at',)
+    raw_id_fields = ('user',)
     inlines = [
         OrderItemInline
     ]
 
+    def get_queryset(self, request):
+        return super().get_queryset(request).select_related('user')
+
+    def save_model(self, request, obj, form, change):
+        new_status = obj.status
+        if change:
+            # The status moves through transition_orders, which releases stock and writes history
+            obj.status = form.initial['status']
+        super().save_model(request, obj, form, change)
+        if obj.status != new_status:
+            updated, rejected = transition_orders(
+                [obj.pk], new_status, changed_by=request.user, reason='Changed in the admin'
+            )
+            if updated:
+                obj.status = new_status
+            else:
+                self.message_user(request, rejected[obj.pk], messages.ERROR)
+
+    def save_related(self, request, form, formsets, change):
+        super().save_related(request, form, formsets, change)
+        # After the inline items are saved too; covers the previous owner if the order was reassigned
+        invalidate_user_orders([form.instance.user_id, form.initial.get('user')])
+
+    def get_deleted_objects(self, objs, request):
+        deleted_objects, model_count, perms_needed, protected = super().get_deleted_objects(objs, request)
+        # Items cannot be deleted on their own, but go with their order, which puts their stock back
+        perms_needed.discard(OrderItem._meta.verbose_name)
+        return deleted_objects, model_count, perms_needed, protected
+
+    def delete_model(self, request, obj):
+        delete_orders(Order.objects.filter(pk=obj.pk))
+        invalidate_user_orders([obj.user_id])
+
+    def delete_queryset(self, request, queryset):
+        user_ids = list(queryset.values_list('user_id', flat=True).distinct())
+        delete_orders(queryset)
+        invalidate_user_orders(user_ids)
+
+
+class OrderItemAdmin(ScalableModelAdmin):
+    """View-only, like the order's inline items"""
+    list_display = ('id', 'order', 'product', 'quantity')
+    list_select_related = ('order__user', 'product')
+
+    def has_add_permission(self, request):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
+
+    def has_delete_permission(self, request, obj=None):
+        return False
+
+
+class ProductAdmin(ScalableModelAdmin):
+    list_display = ('name', 'price', 'stock')
+    search_fields = ('name',)
+    ordering = ('name',)
+
+    def save_model(self, request, obj, form, change):
+        old_stock = form.initial.get('stock', 0) if change else 0
+        super().save_model(request, obj, form, change)
+        kind = StockMovement.KindChoices.ADJUSTMENT if change else StockMovement.KindChoices.OPENING
+        record_stock_movements([(obj.id, obj.stock - old_stock)], kind)
+        product_cache.invalidate([obj.id], names=not change or 'name' in form.changed_data)
+
+    def delete_model(self, request, obj):
+        product_id = obj.id
+        super().delete_model(request, obj)
+        product_cache.invalidate([product_id], names=True)
+
+    def delete_queryset(self, request, queryset):
+        product_ids = list(queryset.values_list('id', flat=True))
+        super().delete_queryset(request, queryset)
+        product_cache.invalidate(product_ids, names=True)
+
+
 admin.site.register(Order, OrderAdmin)
+admin.site.register(OrderItem, OrderItemAdmin)
 admin.site.register(User)
-admin.site.register(Product)
\ No newline at end of file
+admin.site.register(Product, ProductAdmin)
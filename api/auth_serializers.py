@@ -3,6 +3,7 @@ from django.contrib.auth import authenticate
 from django.contrib.auth.password_validation import validate_password
 from django.core.exceptions import ValidationError
 from .models import User
+from .tokens import password_reset_tokens
 
 
 class UserRegistrationSerializer(serializers.ModelSerializer):
@@ -52,8 +53,7 @@ class PasswordResetRequestSerializer(serializers.Serializer):
 
 
 class PasswordResetSerializer(serializers.Serializer):
-    email = serializers.EmailField()
-    recovery_answer = serializers.CharField(max_length=200)
+    token = serializers.CharField(max_length=64)
     new_password = serializers.CharField(validators=[validate_password])
     new_password_confirm = serializers.CharField()
 
@@ -61,12 +61,10 @@ class PasswordResetSerializer(serializers.Serializer):
         if attrs['new_password'] != attrs['new_password_confirm']:
             raise serializers.ValidationError("Passwords don't match.")
         
-        try:
-            user = User.objects.get(email=attrs['email'])
-            if not user.recovery_answer or user.recovery_answer.lower() != attrs['recovery_answer'].lower():
-                raise serializers.ValidationError("Invalid recovery answer.")
-        except User.DoesNotExist:
-            raise serializers.ValidationError("User with this email does not exist.")
+        # The recovery answer was checked when the token was issued
+        user = User.objects.filter(pk=password_reset_tokens.get_user_id(attrs['token'])).first()
+        if user is None or password_reset_tokens.check_token(attrs['token'], user.password) != user.pk:
+            raise serializers.ValidationError("Invalid or expired reset token.")
         
         attrs['user'] = user
         return attrs
@@ -75,10 +73,11 @@ class PasswordResetSerializer(serializers.Serializer):
         user = self.validated_data['user']
         user.set_password(self.validated_data['new_password'])
         user.save()
+        password_reset_tokens.revoke(self.validated_data['token'])
         return user
 
 
 class EmailVerificationSerializer(serializers.Serializer):
     email = serializers.EmailField()
-    verification_code = serializers.CharField(max_length=6)
+    verification_code = serializers.CharField(max_length=64)
 
@@ -5,10 +5,9 @@ from rest_framework.response import Response
 from django.contrib.auth import authenticate
 from django.core.mail import send_mail
 from django.conf import settings
-from django.utils.crypto import get_random_string
-from django.core.cache import cache
 from rest_framework_simplejwt.tokens import RefreshToken
 from .models import User
+from .tokens import email_verification_tokens, password_reset_tokens
 from .auth_serializers import (
     UserRegistrationSerializer,
     PasswordResetRequestSerializer,
@@ -28,8 +27,7 @@ class UserRegistrationView(generics.CreateAPIView):
         user = serializer.save()
         
         # Send email verification
-        verification_code = get_random_string(length=6, allowed_chars='0123456789')
-        cache.set(f'email_verification_{user.email}', verification_code, timeout=300)  # 5 minutes
+        verification_code = email_verification_tokens.make_token(user.id, user.email)
         
         send_mail(
             'Email Verification',
@@ -53,16 +51,12 @@ def verify_email(request):
         email = serializer.validated_data['email']
         verification_code = serializer.validated_data['verification_code']
         
-        cached_code = cache.get(f'email_verification_{email}')
-        if cached_code and cached_code == verification_code:
-            try:
-                user = User.objects.get(email=email)
-                user.is_email_verified = True
-                user.save()
-                cache.delete(f'email_verification_{email}')
+        user_id = email_verification_tokens.check_token(verification_code, email)
+        if user_id is not None:
+            if User.objects.filter(pk=user_id, email=email).update(is_email_verified=True):
+                email_verification_tokens.revoke(verification_code)
                 return Response({'message': 'Email verified successfully'}, status=status.HTTP_200_OK)
-            except User.DoesNotExist:
-                return Response({'error': 'User not found'}, status=status.HTTP_404_NOT_FOUND)
+            return Response({'error': 'User not found'}, status=status.HTTP_404_NOT_FOUND)
         else:
             return Response({'error': 'Invalid verification code'}, status=status.HTTP_400_BAD_REQUEST)
     return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
@@ -80,8 +74,7 @@ def resend_verification(request):
         if user.is_email_verified:
             return Response({'message': 'Email already verified'}, status=status.HTTP_200_OK)
         
-        verification_code = get_random_string(length=6, allowed_chars='0123456789')
-        cache.set(f'email_verification_{email}', verification_code, timeout=300)
+        verification_code = email_verification_tokens.make_token(user.id, email)
         
         send_mail(
             'Email Verification',
@@ -103,9 +96,8 @@ def password_reset_request(request):
     if serializer.is_valid():
         user = serializer.validated_data['user']
         
-        # Generate reset token
-        reset_token = get_random_string(length=32)
-        cache.set(f'password_reset_{reset_token}', user.id, timeout=600)  # 10 minutes
+        # Bound to the current password hash, so the token stops working once used
+        reset_token = password_reset_tokens.make_token(user.id, user.password)
         
         send_mail(
             'Password Reset',
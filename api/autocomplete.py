@@ -0,0 +1,312 @@
+import heapq
+import re
+import threading
+import time
+from array import array
+from bisect import bisect_left, insort
+from itertools import chain, islice
+from django.conf import settings
+from django.db import connection
+from api.models import Product
+from api.product_cache import product_cache
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+_SEPARATORS = re.compile(r'\W+')
+
+
+def words_of(text):
+    return _SEPARATORS.sub(' ', text.casefold()).split()
+
+
+def trigrams(word, prefix=False):
+    """Trigrams of the word padded as a whole word, or only at the start when it is a prefix still being typed"""
+    padded = f'  {word}' if prefix else f'  {word} '
+    return {padded[index:index + 3] for index in range(len(padded) - 2)}
+
+
+def one_edit_apart(a, b):
+    """Whether a and b differ by at most one inserted, deleted or replaced character, or two swapped ones"""
+    if a == b:
+        return True
+    if abs(len(a) - len(b)) > 1:
+        return False
+    if len(a) > len(b):
+        a, b = b, a
+    index = 0
+    while index < len(a) and a[index] == b[index]:
+        index += 1
+    if len(a) < len(b):
+        return a[index:] == b[index + 1:]
+    return a[index + 1:] == b[index + 1:] or (
+        a[index:index + 2] == b[index + 1:index + 2] + b[index:index + 1] and a[index + 2:] == b[index + 2:]
+    )
+
+
+def _term_matcher(term, prefix, similar):
+    """Whether a casefolded name has a word that the term, or one of the similar words, matches"""
+    alternatives = [re.escape(term) + ('' if prefix else r'(?!\w)')]
+    alternatives += [re.escape(word) + r'(?!\w)' for word in similar]
+    search = re.compile(r'(?<!\w)(?:' + '|'.join(alternatives) + ')').search
+    needles = (term, *similar)
+    # A plain substring test rules most names out before the regex runs
+    return lambda name: any(needle in name for needle in needles) and search(name) is not None
+
+
+def _unique(sorted_slots):
+    previous = None
+    for slot in sorted_slots:
+        if slot != previous:
+            yield slot
+            previous = slot
+
+
+class AutocompleteIndex:
+    """Product names by word, for search as you type.
+
+    Every distinct word of every name has a posting list: an array of 32-bit
+    slots of the names containing it, in product id order. The last word of a
+    query matches as a prefix, through a sorted list of the distinct words, and
+    words of TYPO_MIN_LENGTH or more characters also match words one typo away,
+    found through a trigram index over the distinct words rather than over the
+    names. Results come in product id order, names matching without a typo first.
+
+    Each process builds its index from one streaming query on first use, then
+    replays created, deleted and renamed products from the product_names change
+    feed at most every SYNC_INTERVAL seconds. If those records were lost, a
+    fresh index is built on a background thread and swapped in, while searches
+    keep using the current one.
+    """
+
+    def __init__(self, options=None):
+        options = options or settings.AUTOCOMPLETE
+        self.typo_min_length = options['TYPO_MIN_LENGTH']
+        self.sync_interval = options['SYNC_INTERVAL']
+        self.chunk_size = options['CHUNK_SIZE']
+        # Held while searching or changing the index, but not while a whole new one is read in
+        self._lock = threading.Lock()
+        # Makes concurrent first searches wait for one build
+        self._build_lock = threading.Lock()
+        self._rebuilding = False
+        self._generation = None
+        self._next_sync = 0
+        self._swap(None, self._empty())
+
+    @staticmethod
+    def _empty():
+        return {
+            # Slot -> product id, ascending, and slot -> name (None once deleted)
+            'ids': array('q'),
+            'names': [],
+            'postings': {},
+            'words': [],
+            # Trigram -> distinct words containing it; words whose postings emptied are skipped on read
+            'trigrams': {},
+        }
+
+    def _swap(self, generation, index):
+        # Called with the lock held once the index is in use, so searches see one index or the other
+        self.__dict__.update(index)
+        self._generation = generation
+        self._next_sync = 0
+
+    def clear(self):
+        """Drop the index; the next search builds it again"""
+        with self._lock:
+            self._swap(None, self._empty())
+
+    def search(self, query, limit):
+        """Up to limit (product id, name) pairs matching every word of the query"""
+        if self._generation is None:
+            self._build_first()
+        with self._lock:
+            self._sync()
+            terms = words_of(query)
+            if not terms:
+                return []
+            # The last word is still being typed unless the query ends with a separator
+            typing = [False] * (len(terms) - 1) + [bool(re.search(r'\w$', query))]
+
+            exact = [
+                (self._matching_words(term, prefix), term, prefix, ())
+                for term, prefix in zip(terms, typing)
+            ]
+            found = self._intersect(exact, limit)
+            if len(found) < limit and any(len(term) >= self.typo_min_length for term in terms):
+                with_typos = []
+                for words, term, prefix, _ in exact:
+                    similar = self._similar_words(term, prefix) - words
+                    with_typos.append((words | similar, term, prefix, similar))
+                seen = set(found)
+                more = self._intersect(with_typos, limit + len(found))
+                found += [slot for slot in more if slot not in seen][:limit - len(found)]
+            return [(self.ids[slot], self.names[slot]) for slot in found]
+
+    def _matching_words(self, term, prefix):
+        if not prefix:
+            return {term} if term in self.postings else set()
+        words = set()
+        for word in islice(self.words, bisect_left(self.words, term), None):
+            if not word.startswith(term):
+                break
+            words.add(word)
+        return words
+
+    def _similar_words(self, term, prefix):
+        if len(term) < self.typo_min_length:
+            return set()
+        # One typo breaks at most four of the term's trigrams (two swapped letters), so a
+        # word one typo away shares at least one of any five of them. Trigrams no word has
+        # are among the broken ones, so the five rarest of the others suffice
+        lists = sorted(filter(None, (self.trigrams.get(gram) for gram in trigrams(term, prefix))), key=len)[:5]
+        if prefix:
+            lengths = (len(term) - 1, len(term), len(term) + 1)
+            matches = lambda word: any(one_edit_apart(term, word[:length]) for length in lengths)
+        else:
+            matches = lambda word: one_edit_apart(term, word)
+        return {word for word in set(chain.from_iterable(lists)) if word in self.postings and matches(word)}
+
+    def _intersect(self, terms, limit):
+        """The lowest limit slots whose name has one of the words matched by every term.
+
+        terms are (matched words, term, prefix, similar words) tuples.
+        """
+        if not all(words for words, _, _, _ in terms):
+            return []
+        groups = sorted(
+            (([self.postings[word] for word in words], term) for words, *term in terms),
+            key=lambda group: sum(map(len, group[0]))
+        )
+        postings, _ = groups[0]
+        if len(groups) == 1:
+            return list(islice(_unique(heapq.merge(*postings)), limit))
+
+        slots = set(chain.from_iterable(postings))
+        checks = []
+        for postings, term in groups[1:]:
+            if sum(map(len, postings)) <= 40 * len(slots):
+                # Scanning the postings runs in C, about 40 times faster per entry than matching a name
+                slots = slots.intersection(chain.from_iterable(postings))
+            else:
+                checks.append(_term_matcher(*term))
+        if not checks:
+            return heapq.nsmallest(limit, slots)
+
+        # Terms with long postings are checked against the names, lowest slot first, until enough match
+        found = []
+        for slot in sorted(slots):
+            name = self.names[slot].casefold()
+            if all(check(name) for check in checks):
+                found.append(slot)
+                if len(found) == limit:
+                    break
+        return found
+
+    def _sync(self):
+        now = time.monotonic()
+        if self._generation is None or now < self._next_sync:
+            return
+        self._next_sync = now + self.sync_interval
+
+        generation, changed = product_cache.names.changes_since(self._generation)
+        if changed:
+            names = dict(Product.objects.filter(id__in=set(changed)).values_list('id', 'name'))
+            for product_id in sorted(set(changed)):
+                if not self._update(product_id, names.get(product_id)):
+                    changed = None
+                    break
+        if changed is None:
+            # Until the new index is swapped in, searches miss the writes that could not be replayed
+            if not self._rebuilding:
+                self._rebuilding = True
+                threading.Thread(target=self._rebuild_in_background, name='autocomplete-rebuild', daemon=True).start()
+            return
+        self._generation = generation
+
+    def _build_first(self):
+        # With no index to serve yet, the first searches wait for it
+        with self._build_lock:
+            if self._generation is None:
+                generation, index = self._build()
+                with self._lock:
+                    self._swap(generation, index)
+
+    def _rebuild_in_background(self):
+        try:
+            self._rebuild()
+        except Exception as e:
+            logger.error(f"Failed to rebuild the autocomplete index: {e}")
+        finally:
+            connection.close()
+
+    def _rebuild(self):
+        try:
+            generation, index = self._build()
+            with self._lock:
+                self._swap(generation, index)
+        finally:
+            self._rebuilding = False
+
+    def _build(self):
+        """(names feed generation, fresh index) from one streaming query, built without the lock"""
+        start = time.perf_counter()
+        # Read before the names, so writes made during the build are replayed afterwards
+        generation = product_cache.names.current_generation()
+        index = self._empty()
+        ids, slot_names, postings, grams = index['ids'], index['names'], index['postings'], index['trigrams']
+        names = Product.objects.order_by('id').values_list('id', 'name').iterator(chunk_size=self.chunk_size)
+        for product_id, name in names:
+            slot = len(slot_names)
+            ids.append(product_id)
+            slot_names.append(name)
+            for word in set(words_of(name)):
+                posting = postings.get(word)
+                if posting is None:
+                    posting = postings[word] = array('I')
+                posting.append(slot)
+        index['words'] = sorted(postings)
+        for word in index['words']:
+            for gram in trigrams(word):
+                grams.setdefault(gram, []).append(word)
+        logger.info(f"Built autocomplete index of {len(slot_names)} names in {time.perf_counter() - start:.2f}s")
+        return generation, index
+
+    def _index_word(self, word):
+        for gram in trigrams(word):
+            self.trigrams.setdefault(gram, []).append(word)
+
+    def _update(self, product_id, name):
+        """Apply a product's current name (None once deleted); False if the index must be rebuilt instead"""
+        slot = bisect_left(self.ids, product_id)
+        if slot == len(self.ids):
+            if name is not None:
+                self.ids.append(product_id)
+                self.names.append(None)
+        elif self.ids[slot] != product_id:
+            # Slots follow id order, so a new id below the highest one cannot be placed
+            return name is None
+        old = self.names[slot] if slot < len(self.names) else None
+        if old == name:
+            return True
+        if old is not None:
+            for word in set(words_of(old)):
+                posting = self.postings[word]
+                posting.remove(slot)
+                if not posting:
+                    del self.postings[word]
+                    del self.words[bisect_left(self.words, word)]
+        self.names[slot] = name
+        if name is not None:
+            for word in set(words_of(name)):
+                posting = self.postings.get(word)
+                if posting is None:
+                    posting = self.postings[word] = array('I')
+                    insort(self.words, word)
+                    self._index_word(word)
+                insort(posting, slot)
+        return True
+
+
+autocomplete_index = AutocompleteIndex()
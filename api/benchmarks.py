@@ -0,0 +1,705 @@
+import asyncio
+from itertools import accumulate
+import random
+import tracemalloc
+import uuid
+from datetime import timedelta
+import statistics
+import time
+from contextlib import contextmanager
+from decimal import Decimal
+from django.conf import settings
+from django.db import transaction
+from django.db.models import F, Sum
+from django.core.cache import cache
+from django.core.cache.backends.locmem import LocMemCache
+from django.db import connection
+from django.http import HttpResponse
+from django.urls import resolve
+from django.test import Client, override_settings
+from django.utils import timezone
+from rest_framework.test import APIRequestFactory, force_authenticate
+from api.inventory import reconcile_range, record_stock_movements
+from api.pricing import build_quote, sign_quote
+from api.tokens import email_verification_tokens
+from api.product_cache import MISSING, ProductCache
+from api.serializers import OrderSerializer, ProductSerializer
+from api.renderers import FastJSONRenderer
+from api.metrics import MetricsMiddleware, count_query, registry as metrics_registry
+from api.cache_backends import InstrumentedLocMemCache
+from api.cache_batch import CacheBatch
+from rest_framework.renderers import JSONRenderer
+from api.views import UserOrderListAPIView
+from api.partitions import month_id_range, month_start, uuid7
+from api.events import OrderEventHub
+from api.models import Order, OrderItem, Product, RelatedProduct, StockMovement, User
+from api.schema import generate_schema, render_schema_yaml, schema_cache
+from api.tasks import scan_low_stock
+from api.recommendations import rebuild_related_products, update_related_products
+from api.order_status import release_expired_holds
+from api.autocomplete import AutocompleteIndex
+
+
+BENCHMARKS = {}
+
+
+def benchmark(name):
+    """Register a function for `manage.py benchmark <name>`"""
+    def decorator(func):
+        BENCHMARKS[name] = func
+        return func
+    return decorator
+
+
+def time_calls(func, iterations):
+    """Call func repeatedly and return its latency distribution in milliseconds"""
+    samples = []
+    for _ in range(iterations):
+        start = time.perf_counter()
+        func()
+        samples.append((time.perf_counter() - start) * 1000)
+    samples.sort()
+    return {
+        'iterations': iterations,
+        'mean_ms': round(statistics.mean(samples), 3),
+        'p50_ms': round(samples[len(samples) // 2], 3),
+        'p95_ms': round(samples[min(len(samples) - 1, int(len(samples) * 0.95))], 3),
+        'max_ms': round(samples[-1], 3),
+    }
+
+
+def throughput(func, iterations):
+    """Calls per second over a run of iterations"""
+    start = time.perf_counter()
+    for _ in range(iterations):
+        func()
+    return round(iterations / (time.perf_counter() - start))
+
+
+@contextmanager
+def rolled_back():
+    """Run the block in a transaction that is always rolled back"""
+    with transaction.atomic():
+        yield
+        transaction.set_rollback(True)
+
+
+def create_products(count, **fields):
+    defaults = {'description': 'Benchmark product', 'price': Decimal('9.99'), 'stock': 100}
+    defaults.update(fields)
+    return Product.objects.bulk_create(
+        [Product(name=f'Benchmark product {i}', **defaults) for i in range(count)],
+        batch_size=5000
+    )
+
+
+def benchmark_client():
+    return Client(HTTP_HOST='localhost')
+
+
+@benchmark('schema')
+def schema_endpoint(iterations):
+    """Uncached generation vs the cached /api/schema/ view and its 304 path"""
+    client = benchmark_client()
+    schema_cache.clear()
+    first = time_calls(lambda: client.get('/api/schema/'), 1)
+    etag = client.get('/api/schema/')['ETag']
+    return {
+        'generate_per_request': time_calls(lambda: render_schema_yaml(generate_schema()), max(1, iterations // 10)),
+        'cached_first_request': first,
+        'cached': time_calls(lambda: client.get('/api/schema/'), iterations),
+        'not_modified': time_calls(lambda: client.get('/api/schema/', HTTP_IF_NONE_MATCH=etag), iterations),
+    }
+
+
+@benchmark('low_stock')
+def low_stock_scan(iterations):
+    """Product save cost and one scanner run over 100k products, 1% of them low on stock"""
+    with rolled_back():
+        create_products(99000)
+        create_products(1000, stock=1)
+        product = Product.objects.first()
+
+        def save_product():
+            product.stock += 1
+            product.save()
+
+        return {
+            'product_save': time_calls(save_product, iterations),
+            'scan': time_calls(scan_low_stock, 1),
+            'rescan_deduped': time_calls(scan_low_stock, 1),
+        }
+
+
+@benchmark('reconcile')
+def stock_reconciliation(iterations):
+    """Reconcile 100k products with ledger entries in 10k-id chunks"""
+    with rolled_back():
+        products = create_products(100000)
+        record_stock_movements([(product.id, product.stock) for product in products], StockMovement.KindChoices.OPENING)
+        low, high = products[0].id, products[-1].id + 1
+        chunks = [(start, start + 10000) for start in range(low, high, 10000)]
+        return {
+            'products': len(products),
+            'chunk': time_calls(lambda: reconcile_range(*chunks[0]), max(1, iterations // 10)),
+            'full_pass': time_calls(lambda: [reconcile_range(*chunk) for chunk in chunks], 1),
+        }
+
+
+@benchmark('quote')
+def cart_quote(iterations):
+    """Pricing a 1,000-line cart in one query vs one query per line"""
+    with rolled_back():
+        products = create_products(1000)
+        items = [(product.id, 2) for product in products]
+
+        def per_line():
+            return sum(Product.objects.get(pk=product_id).price * quantity for product_id, quantity in items)
+
+        client = benchmark_client()
+        payload = {'items': [{'product_id': product_id, 'quantity': quantity} for product_id, quantity in items]}
+        return {
+            'per_line_queries': time_calls(per_line, max(1, iterations // 10)),
+            'build_quote': time_calls(lambda: build_quote(items), iterations),
+            'build_and_sign': time_calls(lambda: sign_quote(build_quote(items)), iterations),
+            'endpoint': time_calls(
+                lambda: client.post('/quote/', payload, content_type='application/json'),
+                max(1, iterations // 10)
+            ),
+        }
+
+
+@benchmark('tokens')
+def verification_tokens(iterations):
+    """Issuing and checking verification tokens, and the /auth/verify-email/ endpoint"""
+    iterations = max(iterations, 1000)
+    token = email_verification_tokens.make_token(1, 'bench@example.com')
+    issue = time_calls(lambda: email_verification_tokens.make_token(1, 'bench@example.com'), iterations)
+    check = time_calls(lambda: email_verification_tokens.check_token(token, 'bench@example.com'), iterations)
+    check_per_second = throughput(lambda: email_verification_tokens.check_token(token, 'bench@example.com'), iterations)
+    with rolled_back():
+        user = User.objects.create_user(username='bench', email='bench@example.com', password='bench')
+        token = email_verification_tokens.make_token(user.id, user.email)
+        client = benchmark_client()
+        payload = {'email': user.email, 'verification_code': token}
+        endpoint = time_calls(lambda: client.post('/auth/verify-email/', payload), iterations // 10)
+        endpoint_per_second = throughput(lambda: client.post('/auth/verify-email/', payload), iterations // 10)
+    return {
+        'issue': issue,
+        'check': check,
+        'check_per_second': check_per_second,
+        'verify_endpoint': endpoint,
+        'verify_endpoint_per_second': endpoint_per_second,
+    }
+
+
+@benchmark('product_cache')
+def product_cache_tiers(iterations):
+    """Random lookups over a hot set of 10k products: database, shared cache only, and both tiers"""
+    iterations = max(iterations, 10000)
+    with rolled_back():
+        product_ids = [product.id for product in create_products(10000)]
+        lookups = [random.choice(product_ids) for _ in range(iterations)]
+
+        def load(product_id):
+            return ProductSerializer(Product.objects.get(pk=product_id)).data
+
+        def run(lookup):
+            position = iter(lookups)
+            return time_calls(lambda: lookup(next(position)), iterations)
+
+        shared_only = ProductCache(dict(settings.PRODUCT_CACHE, MAX_ENTRIES=0))
+        two_tier = ProductCache()
+        for product_id in product_ids:
+            two_tier.get(product_id, lambda: load(product_id))
+        results = {
+            'database': run(load),
+            'shared_only': run(lambda product_id: shared_only.get(product_id, lambda: load(product_id))),
+            'two_tier': run(lambda product_id: two_tier.get(product_id, lambda: load(product_id))),
+        }
+        results['two_tier_stats'] = two_tier.stats()
+        return results
+
+
+@benchmark('user_orders')
+def user_order_polling(iterations):
+    """/user-orders/ polling across 100k users: cold, cached, and conditional GETs"""
+    iterations = max(iterations, 10000)
+    view = UserOrderListAPIView.as_view()
+    factory = APIRequestFactory()
+
+    def poll(user, **headers):
+        request = factory.get('/api/user-orders/', HTTP_HOST='localhost', **headers)
+        force_authenticate(request, user=user)
+        return view(request)
+
+    with rolled_back():
+        users = User.objects.bulk_create(
+            [User(username=f'poller{i}', email=f'poller{i}@example.com') for i in range(100000)],
+            batch_size=5000
+        )
+        orders = Order.objects.bulk_create([Order(user=user) for user in users], batch_size=5000)
+        product = create_products(1)[0]
+        OrderItem.objects.bulk_create(
+            [OrderItem(order=order, product=product, quantity=2) for order in orders], batch_size=5000
+        )
+        cache.clear()
+
+        cold = iter(users)
+        results = {'cold_per_second': throughput(lambda: poll(next(cold)), iterations)}
+        warm = users[:iterations]
+        etags = {user.id: poll(user)['ETag'] for user in warm}
+        results['cached_per_second'] = throughput(lambda: poll(random.choice(warm)), iterations)
+
+        def conditional():
+            user = random.choice(warm)
+            poll(user, HTTP_IF_NONE_MATCH=etags[user.id])
+        results['not_modified_per_second'] = throughput(conditional, iterations)
+        return results
+
+
+@benchmark('order_ids')
+def order_id_locality(iterations):
+    """Order inserts with uuid4 vs UUIDv7 ids on top of 200k orders, and a this-month query by id range"""
+    user = User.objects.first() or User.objects.create_user(username='benchmark', email='benchmark@example.com')
+    now = timezone.now()
+    results = {}
+    for kind, make_id in (('uuid4', lambda ms: uuid.uuid4()), ('uuid7', uuid7)):
+        with rolled_back():
+            start_ms = int((now - timedelta(days=730)).timestamp() * 1000)
+            step_ms = 730 * 24 * 3600 * 1000 // 200000
+            Order.objects.bulk_create(
+                [Order(order_id=make_id(start_ms + i * step_ms), user=user) for i in range(200000)],
+                batch_size=5000
+            )
+            now_ms = int(now.timestamp() * 1000)
+            start = time.perf_counter()
+            for batch in range(50):
+                Order.objects.bulk_create(
+                    [Order(order_id=make_id(now_ms + batch * 1000 + i), user=user) for i in range(1000)]
+                )
+            results[f'{kind}_inserts_per_second'] = round(50000 / (time.perf_counter() - start))
+
+            if kind == 'uuid7':
+                lower, upper = month_id_range(month_start(now))
+                results['recent_by_id_range'] = time_calls(
+                    lambda: list(Order.objects.filter(order_id__gte=lower, order_id__lt=upper).order_by('-order_id')[:50]),
+                    iterations
+                )
+    return results
+
+
+@benchmark('order_events')
+def order_event_fanout(iterations):
+    """10k idle event streams in one event loop, then one status event per stream published from another thread"""
+    connections = 10000
+
+    async def run():
+        hub = OrderEventHub()
+        tracemalloc.start()
+        before = tracemalloc.get_traced_memory()[0]
+        queues = [hub.subscribe(user_id) for user_id in range(connections)]
+        latencies = []
+
+        async def stream(queue):
+            event = await queue.get()
+            latencies.append((time.perf_counter() - event['published_at']) * 1000)
+
+        tasks = [asyncio.create_task(stream(queue)) for queue in queues]
+        await asyncio.sleep(0)
+        held_bytes = tracemalloc.get_traced_memory()[0] - before
+        tracemalloc.stop()
+
+        def publish():
+            for user_id in range(connections):
+                hub.dispatch([{'user_id': user_id, 'new_status': 'Shipped', 'published_at': time.perf_counter()}])
+
+        start = time.perf_counter()
+        await asyncio.to_thread(publish)
+        await asyncio.gather(*tasks)
+        elapsed = time.perf_counter() - start
+        latencies.sort()
+        return {
+            'connections': hub.connection_count(),
+            'bytes_per_connection': held_bytes // connections,
+            'events_per_second': round(connections / elapsed),
+            'fanout_p50_ms': round(latencies[len(latencies) // 2], 3),
+            'fanout_p95_ms': round(latencies[int(len(latencies) * 0.95)], 3),
+            'fanout_max_ms': round(latencies[-1], 3),
+        }
+
+    with override_settings(ORDER_EVENTS={**settings.ORDER_EVENTS, 'BROKER': 'local'}):
+        return asyncio.run(run())
+
+
+@benchmark('facets')
+def product_facet_counts(iterations):
+    """Facet counts over 1M products: one COUNT(*) per facet value vs the single aggregate, cold and cached"""
+    client = benchmark_client()
+    with rolled_back():
+        for start in range(0, 1000000, 100000):
+            Product.objects.bulk_create([
+                Product(
+                    name=f'Facet product {i}',
+                    description='Benchmark product',
+                    price=Decimal(i % 1000),
+                    stock=i % 20
+                )
+                for i in range(start, start + 100000)
+            ], batch_size=10000)
+        edges = settings.PRODUCT_FACETS['PRICE_BUCKETS']
+
+        def separate_counts():
+            for low, high in zip(edges, edges[1:] + [None]):
+                params = {'price__gt': low}
+                if high is not None:
+                    params['price__lt'] = high
+                client.get('/products/', params)
+            Product.objects.filter(stock=0).count()
+            Product.objects.filter(stock__gt=0, stock__lte=F('low_stock_threshold')).count()
+
+        def faceted():
+            cache.clear()
+            client.get('/products/', {'facets': 'true'})
+
+        iterations = min(iterations, 10)
+        return {
+            'separate_requests': time_calls(separate_counts, iterations),
+            'single_aggregate': time_calls(faceted, iterations),
+            'cached': time_calls(lambda: client.get('/products/', {'facets': 'true'}), iterations),
+        }
+
+
+@benchmark('json_rendering')
+def json_rendering(iterations):
+    """JSONRenderer vs FastJSONRenderer, and buffered vs streamed /products/info/ and /products/?limit=20000 over 100k products"""
+    client = benchmark_client()
+
+    def fetch(path, params=None):
+        response = client.get(path, params)
+        chunks = response.streaming_content if response.streaming else [response.content]
+        return sum(len(chunk) for chunk in chunks)
+
+    def peak_memory(func):
+        tracemalloc.start()
+        func()
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+        return round(peak / 2 ** 20, 1)
+
+    with rolled_back():
+        products = create_products(100000)
+        user = User.objects.create_user(username='render-bench', password='bench')
+        orders = Order.objects.bulk_create([Order(user=user) for _ in range(500)])
+        OrderItem.objects.bulk_create([
+            OrderItem(order=order, product=product, quantity=2, unit_price=product.price)
+            for order in orders for product in products[:5]
+        ])
+        product_data = ProductSerializer(products[:10000], many=True).data
+        order_data = OrderSerializer(Order.objects.prefetch_related('items__product'), many=True).data
+
+        results = {}
+        for name, renderer in (('json_renderer', JSONRenderer()), ('fast_renderer', FastJSONRenderer())):
+            results[name] = {
+                'products_per_second': throughput(lambda: renderer.render(product_data), iterations) * len(product_data),
+                'orders_per_second': throughput(lambda: renderer.render(order_data), iterations) * len(order_data),
+            }
+        for mode, enabled in (('buffered', False), ('streamed', True)):
+            with override_settings(STREAMING_JSON=dict(settings.STREAMING_JSON, ENABLED=enabled)):
+                for name, path, params in (
+                    ('product_info', '/products/info/', None),
+                    ('product_page', '/products/', {'limit': 20000}),
+                ):
+                    results[f'{name}_{mode}'] = dict(
+                        time_calls(lambda: fetch(path, params), max(1, iterations // 10)),
+                        peak_mb=peak_memory(lambda: fetch(path, params)),
+                    )
+        return results
+
+
+@benchmark('metrics')
+def metrics_overhead(iterations):
+    """Per-request cost of MetricsMiddleware, per-query cost of the query counter and per-lookup cost of cache counting"""
+    factory = APIRequestFactory()
+    request = factory.get('/products/')
+    request.resolver_match = resolve('/products/')
+    response = HttpResponse()
+    middleware = MetricsMiddleware(lambda request: response)
+    iterations = iterations * 1000
+
+    def per_call_us(func):
+        # Best of five runs, in microseconds per call
+        runs = []
+        for _ in range(5):
+            start = time.perf_counter()
+            for _ in range(iterations):
+                func()
+            runs.append((time.perf_counter() - start) / iterations * 1e6)
+        return round(min(runs), 3)
+
+    def query():
+        with connection.cursor() as cursor:
+            cursor.execute('SELECT 1')
+
+    plain_cache, instrumented_cache = LocMemCache('bench-plain', {}), InstrumentedLocMemCache('bench-metrics', {})
+    plain_cache.set('key', 1)
+    instrumented_cache.set('key', 1)
+
+    wrappers = connection.execute_wrappers
+    connection.execute_wrappers = [wrapper for wrapper in wrappers if wrapper is not count_query]
+    try:
+        query_plain = per_call_us(query)
+        connection.execute_wrappers.append(count_query)
+        query_counted = per_call_us(query)
+    finally:
+        connection.execute_wrappers = wrappers
+
+    middleware_us = per_call_us(lambda: middleware(request)) - per_call_us(lambda: response)
+    results = {
+        'middleware_overhead_us': round(middleware_us, 3),
+        'query_counter_overhead_us': round(query_counted - query_plain, 3),
+        'cache_get_overhead_us': round(per_call_us(lambda: instrumented_cache.get('key')) - per_call_us(lambda: plain_cache.get('key')), 3),
+        'render_ms': time_calls(metrics_registry.render, 100),
+    }
+    metrics_registry.clear()
+    return results
+
+
+class RoundTripCache(LocMemCache):
+    """LocMemCache that waits `delay` seconds per call, like a network round trip to Redis"""
+
+    def __init__(self, delay):
+        super().__init__('bench-round-trip', {'OPTIONS': {'MAX_ENTRIES': 1000000}})
+        self.delay = delay
+
+    def get(self, *args, **kwargs):
+        time.sleep(self.delay)
+        return super().get(*args, **kwargs)
+
+    def get_many(self, keys, version=None):
+        time.sleep(self.delay)
+        values = ((key, LocMemCache.get(self, key, MISSING, version)) for key in keys)
+        return {key: value for key, value in values if value is not MISSING}
+
+    def set_many(self, data, timeout=None, version=None):
+        time.sleep(self.delay)
+        for key, value in data.items():
+            self.set(key, value, timeout, version)
+        return []
+
+
+@benchmark('cache_batch')
+def cache_batching(iterations):
+    """Per-key get vs one pipelined get_many for 1,000-key pages at a simulated 200us round trip, plus an order page end to end"""
+    backend = RoundTripCache(0.0002)
+    keys = [f'product:{index}' for index in range(1000)]
+    backend.set_many({key: {'name': key, 'price': '9.99'} for key in keys[:900]})
+    iterations = max(1, iterations // 10)
+
+    def per_key():
+        return {key: value for key in keys if (value := backend.get(key)) is not None}
+
+    def batched():
+        return CacheBatch(backend).get_many(keys)
+
+    results = {
+        'per_key_page': time_calls(per_key, iterations),
+        'pipelined_page': time_calls(batched, iterations),
+    }
+
+    with rolled_back():
+        products = create_products(50)
+        user = User.objects.create_user(username='batch-bench', password='bench')
+        orders = Order.objects.bulk_create([Order(user=user) for _ in range(20)])
+        OrderItem.objects.bulk_create([
+            OrderItem(order=order, product=product, quantity=1)
+            for order in orders for product in products
+        ])
+        queryset = Order.objects.filter(user=user).prefetch_related('items')
+
+        def product_join():
+            OrderSerializer(Order.objects.filter(user=user).prefetch_related('items__product'), many=True).data
+
+        def product_cache_page():
+            OrderSerializer(queryset.all(), many=True).data
+
+        cache.clear()
+        product_cache_page()
+        results['order_page_joined_products'] = time_calls(product_join, iterations)
+        results['order_page_cached_products'] = time_calls(product_cache_page, iterations)
+    return results
+
+
+@benchmark('related_products')
+def related_product_build(iterations):
+    """Full "bought together" build over 10M order items (2M orders of 5 of 100k products), then incremental updates"""
+    rng = random.Random(47)
+    with rolled_back():
+        user = User.objects.create_user(username='related-bench', email='related-bench@example.com')
+        product_ids = [product.id for product in create_products(100000)]
+        # A popular head, so neighbour lists are more than ties
+        weights = list(accumulate(1 / (rank + 1) ** 0.8 for rank in range(len(product_ids))))
+        start = time.perf_counter()
+        for _ in range(20):
+            orders = Order.objects.bulk_create(
+                [Order(user=user, status=Order.StatusChoices.DELIVERED) for _ in range(100000)],
+                batch_size=5000
+            )
+            OrderItem.objects.bulk_create(
+                [
+                    OrderItem(order=order, product_id=product_id, quantity=1)
+                    for order in orders
+                    for product_id in set(rng.choices(product_ids, cum_weights=weights, k=5))
+                ],
+                batch_size=5000
+            )
+        results = {
+            'order_items': OrderItem.objects.count(),
+            'load_seconds': round(time.perf_counter() - start, 1),
+            'full_build': time_calls(rebuild_related_products, 1),
+            'stored_neighbours': RelatedProduct.objects.count(),
+        }
+
+        def confirm_batch():
+            orders = Order.objects.bulk_create([Order(user=user) for _ in range(100)])
+            OrderItem.objects.bulk_create([
+                OrderItem(order=order, product_id=product_id, quantity=1)
+                for order in orders
+                for product_id in set(rng.choices(product_ids, cum_weights=weights, k=5))
+            ])
+            Order.objects.filter(order_id__in=[order.order_id for order in orders]).update(status=Order.StatusChoices.CONFIRMED)
+            update_related_products([order.order_id for order in orders])
+        results['update_per_100_orders'] = time_calls(confirm_batch, max(1, iterations // 10))
+    return results
+
+
+@benchmark('autocomplete')
+def autocomplete_latency(iterations):
+    """/products/autocomplete/ over 1M generated product names: index build and memory, then per-query latency"""
+    rng = random.Random(48)
+    iterations = max(iterations, 1000)
+    syllables = ['ka', 'lo', 'mi', 'ren', 'tas', 'vo', 'qui', 'zen', 'bar', 'tel', 'son', 'fi', 'dra', 'mor', 'pex']
+
+    def word(parts):
+        return ''.join(rng.choice(syllables) for _ in range(parts))
+
+    brands = [word(3).capitalize() for _ in range(2000)]
+    adjectives = [word(2) for _ in range(300)]
+    nouns = [word(rng.randint(2, 4)) for _ in range(1000)]
+    names = [
+        f'{rng.choice(brands)} {rng.choice(adjectives)} {rng.choice(nouns)} {rng.choice("xz")}{rng.randint(1, 9999)}'
+        for _ in range(1000000)
+    ]
+
+    def typo(text):
+        position = rng.randrange(1, len(text) - 1)
+        return text[:position] + text[position + 1:]
+
+    sample = rng.sample(names, 1000)
+    queries = {
+        'prefix': [name.split()[0][:4] for name in sample],
+        'two_words': [f'{name.split()[0]} {name.split()[2][:3]}' for name in sample],
+        'typo': [f'{typo(name.split()[0])} {name.split()[2]}' for name in sample],
+        'no_match': [word(3) + 'qq' for _ in sample],
+    }
+
+    with rolled_back():
+        defaults = {'description': 'Benchmark product', 'price': Decimal('9.99'), 'stock': 100}
+        for start in range(0, len(names), 100000):
+            Product.objects.bulk_create([Product(name=name, **defaults) for name in names[start:start + 100000]], batch_size=5000)
+        del names
+
+        index = AutocompleteIndex()
+        results = {'build': time_calls(lambda: (index.clear(), index.search('warm', 1)), 1)}
+        tracemalloc.start()
+        measured = AutocompleteIndex()
+        measured.search('warm', 1)
+        results['index_mb'] = round(tracemalloc.get_traced_memory()[0] / 1024 / 1024, 1)
+        tracemalloc.stop()
+        del measured
+
+        for kind, texts in queries.items():
+            position = iter(range(iterations))
+            results[kind] = time_calls(lambda: index.search(texts[next(position) % len(texts)], 10), iterations)
+            results[f'{kind}_hit_rate'] = round(sum(bool(index.search(text, 10)) for text in texts) / len(texts), 3)
+
+        client = benchmark_client()
+        client.get('/products/autocomplete/', {'q': 'warm'})
+        position = iter(range(iterations))
+        results['endpoint_two_words'] = time_calls(
+            lambda: client.get('/products/autocomplete/', {'q': queries['two_words'][next(position) % 1000]}),
+            iterations
+        )
+    return results
+
+
+@benchmark('product_batch')
+def product_batch_fetch(iterations):
+    """A 20-product cart over 10k products: 20 /products/<id>/ requests vs one /products/batch/, cold and warm caches"""
+    # Each cold run gets carts nobody fetched before, so the caches need no clearing
+    iterations = min(max(1, iterations // 10), 250)
+    client = benchmark_client()
+    with rolled_back():
+        product_ids = [product.id for product in create_products(10000)]
+        random.Random(49).shuffle(product_ids)
+        carts = [product_ids[start:start + 20] for start in range(0, iterations * 40, 20)]
+
+        def singles(cart):
+            for product_id in cart:
+                client.get(f'/products/{product_id}/')
+
+        def batch(cart):
+            client.get('/products/batch/', {'ids': ','.join(map(str, cart))})
+
+        def run(fetch, carts):
+            position = iter(carts)
+            return time_calls(lambda: fetch(next(position)), len(carts))
+
+        results = {
+            'singles_cold': run(singles, carts[:iterations]),
+            'batch_cold': run(batch, carts[iterations:]),
+        }
+        for cart in carts[iterations:]:
+            singles(cart)
+        results['singles_warm'] = run(singles, carts)
+        results['batch_warm'] = run(batch, carts)
+        return results
+
+
+@benchmark('stock_holds')
+def stock_hold_expiry(iterations):
+    """Expiring 1M pending-order holds (2M items over 10k products) next to 100k live ones, a batch per transaction"""
+    rng = random.Random(50)
+    batch_size = settings.STOCK_HOLDS['BATCH_SIZE']
+    with rolled_back():
+        # Without an email address the cancellation notices have no recipients
+        user = User.objects.create_user(username='hold-bench', email='')
+        product_ids = [product.id for product in create_products(10000, stock=0)]
+        # One hold runs out per second, so each deadline below takes exactly one batch
+        first = timezone.now() - timedelta(days=30)
+        start = time.perf_counter()
+        for offset in range(0, 1100000, 100000):
+            orders = Order.objects.bulk_create(
+                [Order(user=user, expires_at=first + timedelta(seconds=index)) for index in range(offset, offset + 100000)],
+                batch_size=5000
+            )
+            OrderItem.objects.bulk_create(
+                [
+                    OrderItem(order=order, product_id=product_id, quantity=1)
+                    for order in orders
+                    for product_id in rng.sample(product_ids, 2)
+                ],
+                batch_size=5000
+            )
+        results = {'load_seconds': round(time.perf_counter() - start, 1)}
+
+        deadlines = iter(first + timedelta(seconds=end - 1) for end in range(batch_size, 1000001, batch_size))
+        start = time.perf_counter()
+        results['per_batch'] = time_calls(lambda: release_expired_holds(batch_size, now=next(deadlines)), 1000000 // batch_size)
+        results['expire_seconds'] = round(time.perf_counter() - start, 1)
+        results['holds_per_second'] = round(1000000 / results['expire_seconds'])
+        results['released_stock'] = Product.objects.filter(id__in=product_ids).aggregate(total=Sum('stock'))['total']
+        results['still_pending'] = Order.objects.filter(user=user, status=Order.StatusChoices.PENDING).count()
+        # With nothing due, a beat run is one index probe
+        results['idle_scan'] = time_calls(lambda: release_expired_holds(batch_size, now=first + timedelta(seconds=999999)), iterations)
+    return results
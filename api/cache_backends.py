@@ -0,0 +1,228 @@
+import os
+import threading
+import time
+import redis
+from django.core.cache.backends.base import DEFAULT_TIMEOUT
+from django.core.cache.backends.locmem import LocMemCache
+from django.core.cache.backends.redis import RedisCache
+from api.metrics import registry
+from api.product_cache import LRUCache, MISSING
+import logging
+
+logger = logging.getLogger(__name__)
+
+_MISS = object()
+
+
+class CacheMetricsMixin:
+    """Counts lookups as hits or misses in cache_requests_total"""
+
+    def get(self, key, default=None, version=None):
+        value = super().get(key, _MISS, version)
+        if value is _MISS:
+            registry.inc('cache_requests_total', ('miss',))
+            return default
+        registry.inc('cache_requests_total', ('hit',))
+        return value
+
+
+class InstrumentedRedisCache(CacheMetricsMixin, RedisCache):
+    def get_many(self, keys, version=None):
+        # One MGET rather than a get() per key, so it is counted here
+        keys = list(keys)
+        found = super().get_many(keys, version)
+        if found:
+            registry.inc('cache_requests_total', ('hit',), len(found))
+        if len(keys) > len(found):
+            registry.inc('cache_requests_total', ('miss',), len(keys) - len(found))
+        return found
+
+
+class InstrumentedLocMemCache(CacheMetricsMixin, LocMemCache):
+    pass
+
+
+class CircuitBreaker:
+    """Fails fast after FAILURE_THRESHOLD consecutive errors.
+
+    Once open, calls are refused until RESET_TIMEOUT has passed; then a single
+    trial call is let through (half-open) and its outcome closes or reopens it.
+    """
+    CLOSED, OPEN, HALF_OPEN = 'closed', 'open', 'half_open'
+    STATE_VALUES = {CLOSED: 0, OPEN: 1, HALF_OPEN: 2}
+
+    def __init__(self, failure_threshold, reset_timeout):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = self.CLOSED
+        self.failures = 0
+        self._opened_at = 0.0
+        self._lock = threading.Lock()
+
+    def allow(self):
+        if self.state == self.CLOSED:
+            return True
+        with self._lock:
+            if self.state == self.OPEN and time.monotonic() >= self._opened_at + self.reset_timeout:
+                self._transition(self.HALF_OPEN)
+                return True
+            return self.state == self.CLOSED
+
+    def record_success(self):
+        if self.state != self.CLOSED or self.failures:
+            with self._lock:
+                self.failures = 0
+                if self.state != self.CLOSED:
+                    self._transition(self.CLOSED)
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            if self.state == self.HALF_OPEN or (self.state == self.CLOSED and self.failures >= self.failure_threshold):
+                self._opened_at = time.monotonic()
+                self._transition(self.OPEN)
+
+    def _transition(self, state):
+        logger.warning(f"Cache circuit breaker {self.state} -> {state} ({self.failures} consecutive failures)")
+        self.state = state
+        registry.inc('cache_circuit_transitions_total', (state,))
+        registry.set('cache_circuit_state', self.STATE_VALUES[state], (str(os.getpid()),))
+
+
+class ResilientRedisCache(InstrumentedRedisCache):
+    """Redis cache that degrades instead of blocking when Redis is slow or down.
+
+    Set socket_connect_timeout and socket_timeout in OPTIONS to bound each
+    call. Failed calls, and every call while the breaker is open, are answered
+    locally: reads come from a bounded in-process copy of the serialized values
+    recently read (a miss if absent), writes and deletes are dropped, and add() reports
+    success so that callers using it as a lock go ahead rather than wait.
+    Entries deleted during an outage may therefore be served stale from Redis
+    until they expire.
+
+    Configured with a CIRCUIT_BREAKER dict next to OPTIONS: FAILURE_THRESHOLD,
+    RESET_TIMEOUT (seconds), and FALLBACK_MAX_ENTRIES, FALLBACK_MAX_BYTES and
+    FALLBACK_TTL for the local copy.
+    """
+    errors = (redis.RedisError, OSError)
+
+    def __init__(self, server, params):
+        super().__init__(server, params)
+        options = params.get('CIRCUIT_BREAKER', {})
+        self.breaker = CircuitBreaker(options.get('FAILURE_THRESHOLD', 5), options.get('RESET_TIMEOUT', 10))
+        self.fallback = LRUCache(
+            options.get('FALLBACK_MAX_ENTRIES', 1000),
+            options.get('FALLBACK_MAX_BYTES', 8 * 1024 * 1024),
+            options.get('FALLBACK_TTL', 300),
+        )
+
+    def _guard(self, operation, call, degraded):
+        if not self.breaker.allow():
+            registry.inc('cache_degraded_total', (operation, 'open'))
+            return degraded()
+        try:
+            result = call()
+        except self.errors as e:
+            self.breaker.record_failure()
+            registry.inc('cache_degraded_total', (operation, 'error'))
+            logger.debug(f"Cache {operation} failed: {e}")
+            return degraded()
+        except Exception:
+            # Redis answered; the error is about the call itself (e.g. incr() of a missing key)
+            self.breaker.record_success()
+            raise
+        self.breaker.record_success()
+        return result
+
+    def get(self, key, default=None, version=None):
+        cache_key = self.make_and_validate_key(key, version)
+
+        def call():
+            raw = self._cache.get_client(cache_key).get(cache_key)
+            registry.inc('cache_requests_total', ('miss' if raw is None else 'hit',))
+            if raw is None:
+                return MISSING
+            self._mirror(cache_key, raw)
+            return self._cache._serializer.loads(raw)
+
+        value = self._guard('get', call, lambda: self._read_fallback(cache_key))
+        return default if value is MISSING else value
+
+    def get_many(self, keys, version=None):
+        keys = {self.make_and_validate_key(key, version): key for key in keys}
+
+        def call():
+            raws = self._cache.get_client(None).mget(list(keys)) if keys else []
+            found = {}
+            for (cache_key, key), raw in zip(keys.items(), raws):
+                if raw is not None:
+                    self._mirror(cache_key, raw)
+                    found[key] = self._cache._serializer.loads(raw)
+            if found:
+                registry.inc('cache_requests_total', ('hit',), len(found))
+            if len(keys) > len(found):
+                registry.inc('cache_requests_total', ('miss',), len(keys) - len(found))
+            return found
+
+        def degraded():
+            values = ((key, self._read_fallback(cache_key)) for cache_key, key in keys.items())
+            return {key: value for key, value in values if value is not MISSING}
+
+        return self._guard('get_many', call, degraded)
+
+    def _mirror(self, cache_key, raw):
+        # The copy is kept serialized, so it is sized by its length and only rewritten when Redis has a new value
+        if self.fallback.get(cache_key) != raw:
+            self.fallback.set(cache_key, raw, size=len(raw))
+
+    def _read_fallback(self, cache_key):
+        raw = self.fallback.get(cache_key)
+        return raw if raw is MISSING else self._cache._serializer.loads(raw)
+
+    def has_key(self, key, version=None):
+        parent = super()
+        cache_key = self.make_and_validate_key(key, version)
+        return self._guard(
+            'has_key', lambda: parent.has_key(key, version),
+            lambda: self.fallback.get(cache_key) is not MISSING
+        )
+
+    def add(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        parent = super()
+        return self._guard('add', lambda: parent.add(key, value, timeout, version), lambda: True)
+
+    def set(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        parent = super()
+        return self._guard('set', lambda: parent.set(key, value, timeout, version), lambda: None)
+
+    def set_many(self, data, timeout=DEFAULT_TIMEOUT, version=None):
+        parent = super()
+        return self._guard('set_many', lambda: parent.set_many(data, timeout, version), lambda: [])
+
+    def touch(self, key, timeout=DEFAULT_TIMEOUT, version=None):
+        parent = super()
+        return self._guard('touch', lambda: parent.touch(key, timeout, version), lambda: False)
+
+    def incr(self, key, delta=1, version=None):
+        parent = super()
+
+        def degraded():
+            raise ValueError(f"Key '{key}' not found.")
+        return self._guard('incr', lambda: parent.incr(key, delta, version), degraded)
+
+    def delete(self, key, version=None):
+        parent = super()
+        self.fallback.delete(self.make_and_validate_key(key, version))
+        return self._guard('delete', lambda: parent.delete(key, version), lambda: False)
+
+    def delete_many(self, keys, version=None):
+        parent = super()
+        keys = list(keys)
+        for key in keys:
+            self.fallback.delete(self.make_and_validate_key(key, version))
+        return self._guard('delete_many', lambda: parent.delete_many(keys, version), lambda: None)
+
+    def clear(self):
+        parent = super()
+        self.fallback.clear()
+        return self._guard('clear', lambda: parent.clear(), lambda: False)
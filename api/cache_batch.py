@@ -0,0 +1,63 @@
+from django.core.cache import cache
+from django.core.cache.backends.base import DEFAULT_TIMEOUT
+from api.product_cache import MISSING
+
+
+class CacheBatch:
+    """Page-at-a-time access to the shared cache, memoized for one request.
+
+    get_many() is one MGET and set_many() one pipeline on Redis, whatever the
+    number of keys. Keys already looked up in this batch, hits and misses
+    alike, are answered from the memo, so nested serializers that ask for the
+    same keys again cost nothing.
+    """
+
+    def __init__(self, backend=None):
+        self.backend = backend or cache
+        self.round_trips = 0
+        self._memo = {}
+
+    def get_many(self, keys):
+        keys = list(keys)
+        missing = [key for key in dict.fromkeys(keys) if key not in self._memo]
+        if missing:
+            self.round_trips += 1
+            found = self.backend.get_many(missing)
+            for key in missing:
+                self._memo[key] = found.get(key, MISSING)
+        return {key: self._memo[key] for key in keys if self._memo[key] is not MISSING}
+
+    def set_many(self, values, timeout=DEFAULT_TIMEOUT):
+        if values:
+            self.round_trips += 1
+            self.backend.set_many(values, timeout)
+            self._memo.update(values)
+
+    def get_or_load_many(self, keys, load, timeout=DEFAULT_TIMEOUT, generation=None):
+        """Values for keys, calling load(missing keys) -> {key: value} once for the misses and storing its result.
+
+        generation is a callable reading a counter that writers bump after
+        deleting the keys; when it moves while loading, the loaded values may
+        predate the write and are returned without being stored.
+        """
+        keys = list(keys)
+        found = self.get_many(keys)
+        missing = [key for key in keys if key not in found]
+        if missing:
+            before = generation() if generation else None
+            loaded = load(missing)
+            if generation is None or generation() == before:
+                self.set_many(loaded, timeout)
+            found.update(loaded)
+        return found
+
+
+def cache_batch(context):
+    """The CacheBatch of the request in a serializer context; a fresh one outside a request"""
+    request = context.get('request')
+    if request is None:
+        return CacheBatch()
+    batch = getattr(request, '_cache_batch', None)
+    if batch is None:
+        batch = request._cache_batch = CacheBatch()
+    return batch
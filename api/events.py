@@ -0,0 +1,128 @@
+import asyncio
+import json
+import threading
+from collections import defaultdict
+import redis
+import redis.asyncio
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+class OrderEventHub:
+    """Fans order events out to the event streams open in this process.
+
+    Each stream owns a bounded asyncio.Queue on its event loop. Events arrive
+    either straight from publish() (local broker) or from a single Redis
+    pattern subscription per process, so idle streams cost one queue each and
+    no Redis connection.
+    """
+
+    def __init__(self):
+        self._subscribers = defaultdict(set)
+        self._lock = threading.Lock()
+        self._listeners = {}
+
+    def subscribe(self, user_id):
+        """A queue of the user's events, bound to the running loop; call it from the coroutine that reads it"""
+        loop = asyncio.get_running_loop()
+        queue = asyncio.Queue(maxsize=settings.ORDER_EVENTS['QUEUE_SIZE'])
+        with self._lock:
+            self._subscribers[user_id].add((loop, queue))
+        if settings.ORDER_EVENTS['BROKER'] == 'redis':
+            self._ensure_listener(loop)
+        return queue
+
+    def unsubscribe(self, user_id, queue):
+        with self._lock:
+            streams = self._subscribers.get(user_id, set())
+            streams.difference_update({stream for stream in streams if stream[1] is queue})
+            if not streams:
+                self._subscribers.pop(user_id, None)
+
+    def dispatch(self, events):
+        """Queue each event on every stream of its user; safe to call from any thread"""
+        for event in events:
+            with self._lock:
+                streams = list(self._subscribers.get(event['user_id'], ()))
+            for loop, queue in streams:
+                try:
+                    loop.call_soon_threadsafe(self._put, queue, event)
+                except RuntimeError:
+                    # The stream's event loop has shut down
+                    self.unsubscribe(event['user_id'], queue)
+
+    def connection_count(self):
+        with self._lock:
+            return sum(len(streams) for streams in self._subscribers.values())
+
+    @staticmethod
+    def _put(queue, event):
+        # A client that stops reading loses its oldest events rather than growing the queue
+        if queue.full():
+            queue.get_nowait()
+        queue.put_nowait(event)
+
+    def _ensure_listener(self, loop):
+        # Forget loops that have shut down, along with their finished listeners
+        for closed in [other for other in self._listeners if other.is_closed()]:
+            del self._listeners[closed]
+        listener = self._listeners.get(loop)
+        if listener is None or listener.done():
+            self._listeners[loop] = loop.create_task(self._listen())
+
+    async def _listen(self):
+        prefix = settings.ORDER_EVENTS['CHANNEL_PREFIX']
+        while True:
+            try:
+                client = redis.asyncio.from_url(settings.ORDER_EVENTS['REDIS_URL'])
+                async with client.pubsub() as pubsub:
+                    await pubsub.psubscribe(f'{prefix}*')
+                    async for message in pubsub.listen():
+                        if message['type'] == 'pmessage':
+                            self.dispatch([json.loads(message['data'])])
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Order event subscription failed, retrying: {e}")
+                await asyncio.sleep(1)
+
+
+order_event_hub = OrderEventHub()
+_redis_client = None
+
+
+def publish_order_events(events):
+    """Send order status events to every process serving the users' streams"""
+    if not events:
+        return
+    if settings.ORDER_EVENTS['BROKER'] != 'redis':
+        order_event_hub.dispatch(events)
+        return
+
+    global _redis_client
+    try:
+        if _redis_client is None:
+            _redis_client = redis.Redis.from_url(settings.ORDER_EVENTS['REDIS_URL'])
+        pipeline = _redis_client.pipeline(transaction=False)
+        for event in events:
+            pipeline.publish(
+                f"{settings.ORDER_EVENTS['CHANNEL_PREFIX']}{event['user_id']}",
+                json.dumps(event, cls=DjangoJSONEncoder)
+            )
+        pipeline.execute()
+    except redis.RedisError as e:
+        # Streams are a convenience on top of polling; never fail the write because of them
+        logger.error(f"Failed to publish {len(events)} order events: {e}")
+
+
+def order_event(order_id, user_id, old_status, new_status, changed_at):
+    return {
+        'order_id': str(order_id),
+        'user_id': user_id,
+        'old_status': old_status,
+        'new_status': new_status,
+        'changed_at': changed_at.isoformat(),
+    }
@@ -0,0 +1,104 @@
+import hashlib
+from decimal import Decimal, InvalidOperation
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import Count, F, Q
+from rest_framework import serializers
+from rest_framework.pagination import LimitOffsetPagination
+from api.product_cache import product_cache
+
+
+IN_STOCK = Q(stock__gt=0)
+
+
+class FacetedLimitOffsetPagination(LimitOffsetPagination):
+    """Takes the total from the facet query instead of running its own COUNT(*).
+
+    With `lazy` set, the page is returned as an unevaluated queryset slice so
+    that a streaming response can iterate it.
+    """
+    known_count = None
+    lazy = False
+
+    def get_count(self, queryset):
+        if self.known_count is not None:
+            return self.known_count
+        return super().get_count(queryset)
+
+    def paginate_queryset(self, queryset, request, view=None):
+        if not self.lazy:
+            return super().paginate_queryset(queryset, request, view)
+        self.request = request
+        self.limit = self.get_limit(request)
+        if self.limit is None:
+            return None
+        self.count = self.get_count(queryset)
+        self.offset = self.get_offset(request)
+        if self.count == 0 or self.offset > self.count:
+            return queryset.none()
+        return queryset[self.offset:self.offset + self.limit]
+
+
+def parse_price_buckets(value):
+    """Bucket edges from `?price_buckets=0,10,50`, or the configured default"""
+    if not value:
+        return settings.PRODUCT_FACETS['PRICE_BUCKETS']
+    try:
+        edges = [Decimal(edge) for edge in value.split(',')]
+    except InvalidOperation:
+        edges = None
+    # Decimal also parses NaN and Infinity, which cannot bound a bucket (sNaN cannot even be compared)
+    if edges is None or not all(edge.is_finite() for edge in edges):
+        raise serializers.ValidationError({'price_buckets': 'Expected comma-separated numbers.'})
+    if len(edges) > settings.PRODUCT_FACETS['MAX_PRICE_BUCKETS'] or edges != sorted(set(edges)):
+        raise serializers.ValidationError({
+            'price_buckets': f"Expected at most {settings.PRODUCT_FACETS['MAX_PRICE_BUCKETS']} increasing numbers."
+        })
+    return edges
+
+
+def product_facets(queryset, price_buckets, signature):
+    """Count products by availability, stock status and price bucket with one aggregate query.
+
+    queryset is the filtered product list before the in-stock filter; price
+    buckets and the returned total only count products that are in stock.
+    Results are cached per filter signature until the next catalog change.
+    """
+    buckets = list(zip(price_buckets, list(price_buckets[1:]) + [None]))
+    key = 'product_facets:' + hashlib.sha256(
+        f'{product_cache.current_generation()}:{signature}:{price_buckets}'.encode()
+    ).hexdigest()
+    facets = cache.get(key)
+    if facets is not None:
+        return facets
+
+    aggregates = {
+        'total': Count('pk', filter=IN_STOCK),
+        'out_of_stock': Count('pk', filter=~IN_STOCK),
+        'low_stock': Count('pk', filter=IN_STOCK & Q(stock__lte=F('low_stock_threshold'))),
+    }
+    for index, (low, high) in enumerate(buckets):
+        condition = IN_STOCK & Q(price__gte=low)
+        if high is not None:
+            condition &= Q(price__lt=high)
+        aggregates[f'price_{index}'] = Count('pk', filter=condition)
+    counts = queryset.order_by().aggregate(**aggregates)
+
+    facets = {
+        'total': counts['total'],
+        'availability': {
+            'in_stock': counts['total'],
+            'out_of_stock': counts['out_of_stock'],
+        },
+        'stock_status': {
+            'normal': counts['total'] - counts['low_stock'],
+            'low': counts['low_stock'],
+            'out': counts['out_of_stock'],
+        },
+        'price': [
+            {'min': str(low), 'max': None if high is None else str(high), 'count': counts[f'price_{index}']}
+            for index, (low, high) in enumerate(buckets)
+        ],
+    }
+    cache.set(key, facets, timeout=settings.PRODUCT_FACETS['TIMEOUT'])
+    return facets
@@ -0,0 +1,95 @@
+import hashlib
+import json
+from django.conf import settings
+from django.core.cache import cache
+from rest_framework import status
+from rest_framework.response import Response
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+UNSAFE_METHODS = ('POST', 'PUT', 'PATCH', 'DELETE')
+
+
+class IdempotentReplay(Exception):
+    """Raised from initial() to short-circuit the handler with a stored response"""
+    def __init__(self, response):
+        self.response = response
+
+
+# Replays the stored response for a repeated `Idempotency-Key` instead of re-executing.
+# The first request with a key takes a lock in the cache; duplicates that arrive while
+# it runs get 409 Conflict at once, so no worker is tied up waiting, and retry later.
+# Not a docstring: drf-spectacular would use it as every view's description.
+class IdempotentMixin:
+    idempotency_header = 'Idempotency-Key'
+    # Seconds a client is told to wait before retrying a request that is in flight
+    idempotency_retry_after = 1
+
+    def initial(self, request, *args, **kwargs):
+        super().initial(request, *args, **kwargs)
+        self._idempotency_keys = None
+        key = request.headers.get(self.idempotency_header)
+        if request.method not in UNSAFE_METHODS or not key:
+            return
+
+        base = f'idempotency:{request.user.pk}:{request.method}:{request.path}:{key}'
+        keys = (f'{base}:result', f'{base}:lock')
+        fingerprint = hashlib.sha256(
+            json.dumps(request.data, sort_keys=True, default=str).encode()
+        ).hexdigest()
+
+        stored = cache.get(keys[0])
+        if stored is not None:
+            logger.info(f"Replaying stored response for {request.method} {request.path} ({key})")
+            raise IdempotentReplay(self.replay(stored, fingerprint))
+        # The lock's timeout only matters if the process dies before releasing it
+        if not cache.add(keys[1], fingerprint, timeout=settings.IDEMPOTENCY_LOCK_TIMEOUT):
+            response = Response(
+                {'detail': 'A request with this Idempotency-Key is still in progress.'},
+                status=status.HTTP_409_CONFLICT
+            )
+            response['Retry-After'] = str(self.idempotency_retry_after)
+            raise IdempotentReplay(response)
+        self._idempotency_keys = keys
+        self._idempotency_fingerprint = fingerprint
+
+    def replay(self, stored, fingerprint):
+        if stored['fingerprint'] != fingerprint:
+            return Response(
+                {'detail': 'Idempotency-Key was already used with a different request body.'},
+                status=status.HTTP_422_UNPROCESSABLE_ENTITY
+            )
+        response = Response(stored['data'], status=stored['status'])
+        response['Idempotent-Replayed'] = 'true'
+        return response
+
+    def handle_exception(self, exc):
+        if isinstance(exc, IdempotentReplay):
+            return exc.response
+        try:
+            return super().handle_exception(exc)
+        except Exception:
+            # finalize_response() never runs for an unhandled error; free the key for a retry
+            self._release_idempotency_lock()
+            raise
+
+    def finalize_response(self, request, response, *args, **kwargs):
+        keys = getattr(self, '_idempotency_keys', None)
+        if keys:
+            # Server errors are not stored so the client can retry them
+            if response.status_code < 500:
+                cache.set(keys[0], {
+                    'fingerprint': self._idempotency_fingerprint,
+                    'status': response.status_code,
+                    'data': getattr(response, 'data', None),
+                }, timeout=settings.IDEMPOTENCY_KEY_TTL)
+        self._release_idempotency_lock()
+        return super().finalize_response(request, response, *args, **kwargs)
+
+    def _release_idempotency_lock(self):
+        keys = getattr(self, '_idempotency_keys', None)
+        if keys:
+            cache.delete(keys[1])
+            self._idempotency_keys = None
@@ -0,0 +1,145 @@
+from collections import defaultdict, namedtuple
+from datetime import timedelta
+from django.conf import settings
+from django.core.exceptions import ValidationError
+from django.db import transaction
+from django.db.models import Case, F, PositiveIntegerField, Sum, Value, When
+from django.utils import timezone
+from django.utils.translation import gettext_lazy as _
+from api.models import Product, Order, OrderItem, StockMovement
+from api.product_cache import product_cache
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+# Items on these orders no longer hold stock
+RELEASED_ORDER_STATUSES = [Order.StatusChoices.CANCELLED, Order.StatusChoices.REFUNDED]
+
+StockDrift = namedtuple('StockDrift', ['product_id', 'stock', 'expected'])
+
+
+def record_stock_movements(changes, kind):
+    """Append (product_id, quantity) changes to the ledger in one INSERT per batch"""
+    movements = [
+        StockMovement(product_id=product_id, quantity=quantity, kind=kind)
+        for product_id, quantity in changes
+        if quantity
+    ]
+    return StockMovement.objects.bulk_create(movements, batch_size=1000)
+
+
+def ledger_totals(**filters):
+    """Net ledger quantity per product, as one grouped aggregate"""
+    return dict(
+        StockMovement.objects.filter(**filters)
+        .values('product_id')
+        .annotate(total=Sum('quantity'))
+        .values_list('product_id', 'total')
+    )
+
+
+def reserved_totals(**filters):
+    """Quantity held by active orders per product, as one grouped aggregate over OrderItem"""
+    return dict(
+        OrderItem.objects.filter(**filters)
+        .exclude(order__status__in=RELEASED_ORDER_STATUSES)
+        .values('product_id')
+        .annotate(total=Sum('quantity'))
+        .values_list('product_id', 'total')
+    )
+
+
+def reconcile_range(start_id, end_id, fix=False):
+    """Compare Product.stock with the ledger for products with start_id <= id < end_id"""
+    id_range = {'product_id__gte': start_id, 'product_id__lt': end_id}
+    stock = dict(
+        Product.objects.filter(id__gte=start_id, id__lt=end_id).values_list('id', 'stock')
+    )
+    received = ledger_totals(**id_range)
+    reserved = reserved_totals(**id_range)
+
+    drift = []
+    for product_id, current in stock.items():
+        expected = received.get(product_id, 0) - reserved.get(product_id, 0)
+        if current != expected:
+            drift.append(StockDrift(product_id, current, expected))
+
+    if fix and drift:
+        # One UPDATE for the range; rows that changed since they were read keep their
+        # stock, and the next run picks them up
+        Product.objects.filter(id__in=[item.product_id for item in drift]).update(stock=Case(
+            *[When(id=item.product_id, stock=item.stock, then=Value(max(item.expected, 0))) for item in drift],
+            default=F('stock'),
+            output_field=PositiveIntegerField()
+        ))
+        product_cache.invalidate(item.product_id for item in drift)
+        logger.warning(f"Corrected stock drift on {len(drift)} products in [{start_id}, {end_id})")
+    return drift
+
+
+def reserve_stock(quantities):
+    """Take {product_id: quantity} out of stock with one UPDATE, or nothing if any product is short.
+
+    Negative quantities put stock back.
+    """
+    with transaction.atomic():
+        stock = dict(
+            Product.objects.select_for_update()
+            .filter(id__in=quantities)
+            .values_list('id', 'stock')
+        )
+        short = [product_id for product_id, quantity in quantities.items() if stock.get(product_id, 0) < quantity]
+        if short:
+            raise ValidationError(
+                _('Insufficient stock for products: %(products)s'),
+                params={'products': ', '.join(str(product_id) for product_id in short)}
+            )
+        Product.objects.filter(id__in=quantities).update(stock=Case(
+            *[When(id=product_id, then=F('stock') - quantity) for product_id, quantity in quantities.items()],
+            default=F('stock'),
+            output_field=PositiveIntegerField()
+        ))
+        transaction.on_commit(lambda: product_cache.invalidate(quantities))
+
+
+def release_stock(order_ids):
+    """Put the items of these orders back in stock.
+
+    One grouped aggregate, then one UPDATE per distinct quantity: a batch of
+    orders returns a few units each of many products, and a CASE with a branch
+    per product costs more to build than to run.
+    """
+    quantities = dict(
+        OrderItem.objects.filter(order_id__in=order_ids)
+        .values('product_id')
+        .annotate(total=Sum('quantity'))
+        .values_list('product_id', 'total')
+    )
+    by_quantity = defaultdict(list)
+    for product_id, total in quantities.items():
+        by_quantity[total].append(product_id)
+    for total, product_ids in by_quantity.items():
+        Product.objects.filter(id__in=product_ids).update(stock=F('stock') + total)
+    if quantities:
+        transaction.on_commit(lambda: product_cache.invalidate(quantities))
+    return quantities
+
+
+def delete_orders(orders):
+    """Delete the orders of a queryset, putting back the stock their items still hold"""
+    order_ids = list(orders.values_list('pk', flat=True))
+    with transaction.atomic():
+        # Locked by id (admin querysets may be distinct) so that a concurrent
+        # cancellation cannot release the same items again
+        held = list(
+            Order.objects.select_for_update().filter(pk__in=order_ids)
+            .exclude(status__in=RELEASED_ORDER_STATUSES).values_list('pk', flat=True)
+        )
+        release_stock(held)
+        Order.objects.filter(pk__in=order_ids).delete()
+
+
+def hold_expiry():
+    """When a stock hold taken now runs out"""
+    return timezone.now() + timedelta(seconds=settings.STOCK_HOLDS['TTL'])
@@ -0,0 +1,163 @@
+import http.client
+import json
+import random
+import statistics
+import time
+from urllib.parse import quote, urlsplit
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+# Relative weight of each scenario in the request mix
+SCENARIO_WEIGHTS = {
+    'browse_products': 40,
+    'search_products': 20,
+    'list_orders': 20,
+    'create_order': 10,
+    'add_items': 10,
+}
+
+
+class LoadTestClient:
+    """One keep-alive HTTP connection to the server under test"""
+
+    def __init__(self, base_url, timeout=30):
+        parts = urlsplit(base_url)
+        self.host = parts.hostname
+        self.port = parts.port or 80
+        self.prefix = parts.path.rstrip('/')
+        self.timeout = timeout
+        self.connection = None
+        self.token = None
+
+    def request(self, method, path, body=None):
+        """Return (status, parsed JSON body or None); status 0 means the request never completed"""
+        headers = {'Accept': 'application/json'}
+        if self.token:
+            headers['Authorization'] = f'Bearer {self.token}'
+        if body is not None:
+            body = json.dumps(body)
+            headers['Content-Type'] = 'application/json'
+        try:
+            if self.connection is None:
+                self.connection = http.client.HTTPConnection(self.host, self.port, timeout=self.timeout)
+            self.connection.request(method, self.prefix + path, body=body, headers=headers)
+            response = self.connection.getresponse()
+            content = response.read()
+        except (OSError, http.client.HTTPException) as e:
+            logger.debug(f"{method} {path} failed: {e}")
+            self.close()
+            return 0, None
+        try:
+            return response.status, json.loads(content) if content else None
+        except ValueError:
+            return response.status, None
+
+    def close(self):
+        if self.connection is not None:
+            self.connection.close()
+            self.connection = None
+
+
+class Scenarios:
+    """The user journeys in the mix; each returns the response status"""
+
+    def __init__(self, client, rng, product_ids):
+        self.client = client
+        self.rng = rng
+        self.product_ids = product_ids
+        self.pending_orders = []
+
+    def browse_products(self):
+        offset = self.rng.randrange(0, max(len(self.product_ids) - 20, 1))
+        return self.client.request('GET', f'/products/?limit=20&offset={offset}')[0]
+
+    def search_products(self):
+        term = quote(f'Loadtest product {self.rng.randrange(len(self.product_ids))}')
+        return self.client.request('GET', f'/products/?search={term}&limit=20')[0]
+
+    def list_orders(self):
+        return self.client.request('GET', '/user-orders/')[0]
+
+    def create_order(self):
+        status, data = self.client.request('POST', '/orders/create/', {})
+        if status == 201:
+            self.pending_orders.append(data['order_id'])
+        return status
+
+    def add_items(self):
+        if not self.pending_orders:
+            return self.create_order()
+        order_id = self.rng.choice(self.pending_orders)
+        operations = [
+            {'op': 'add', 'product_id': product_id, 'quantity': self.rng.randint(1, 3)}
+            for product_id in self.rng.sample(self.product_ids, min(3, len(self.product_ids)))
+        ]
+        return self.client.request('PATCH', f'/orders/{order_id}/items/', {'operations': operations})[0]
+
+
+def run_worker(base_url, worker, seed, credentials, product_ids, requests, weights):
+    """Log in and replay `requests` scenarios; returns [(scenario, milliseconds, status)].
+
+    The scenario sequence depends only on the seed and worker number, so runs
+    against different commits replay the same traffic.
+    """
+    rng = random.Random(f'{seed}-{worker}')
+    client = LoadTestClient(base_url)
+    samples = []
+
+    username, password = credentials[worker % len(credentials)]
+    start = time.perf_counter()
+    status, data = client.request('POST', '/api/token/', {'username': username, 'password': password})
+    samples.append(('login', (time.perf_counter() - start) * 1000, status))
+    if status != 200:
+        return samples
+    client.token = data['access']
+
+    scenarios = Scenarios(client, rng, product_ids)
+    names = list(weights)
+    for name in rng.choices(names, weights=[weights[name] for name in names], k=requests):
+        start = time.perf_counter()
+        status = getattr(scenarios, name)()
+        samples.append((name, (time.perf_counter() - start) * 1000, status))
+    client.close()
+    return samples
+
+
+def summarize(samples, elapsed):
+    """Throughput, latency percentiles and error rate, overall and per scenario"""
+    def stats(latencies, errors):
+        latencies = sorted(latencies)
+
+        def percentile(fraction):
+            return round(latencies[min(len(latencies) - 1, int(len(latencies) * fraction))], 3)
+
+        return {
+            'requests': len(latencies),
+            'errors': errors,
+            'error_rate': round(errors / len(latencies), 4),
+            'mean_ms': round(statistics.mean(latencies), 3),
+            'p50_ms': percentile(0.50),
+            'p95_ms': percentile(0.95),
+            'p99_ms': percentile(0.99),
+            'max_ms': round(latencies[-1], 3),
+        }
+
+    by_scenario = {}
+    for name, latency, status in samples:
+        latencies, errors = by_scenario.setdefault(name, ([], [0]))
+        latencies.append(latency)
+        if not 200 <= status < 400:
+            errors[0] += 1
+
+    overall = stats(
+        [latency for _, latency, _ in samples],
+        sum(errors[0] for _, errors in by_scenario.values())
+    )
+    overall['elapsed_s'] = round(elapsed, 3)
+    overall['requests_per_second'] = round(len(samples) / elapsed, 1)
+    overall['scenarios'] = {
+        name: stats(latencies, errors[0]) for name, (latencies, errors) in sorted(by_scenario.items())
+    }
+    return overall
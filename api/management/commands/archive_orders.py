@@ -0,0 +1,118 @@
+import gzip
+import json
+from datetime import datetime, timezone as dt_timezone
+from pathlib import Path
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import connection, transaction
+from django.utils import timezone
+from api.inventory import record_stock_movements, reserved_totals
+from api.models import Order, OrderHistory, OrderItem, StockMovement
+from api.partitions import (
+    add_months,
+    drop_order_partition,
+    is_partitioned,
+    month_id_range,
+    month_start,
+    order_partitions,
+)
+
+
+class Command(BaseCommand):
+    help = 'Exports orders from months before a cutoff to gzipped JSON lines, then removes them'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--before',
+            help='First month to keep, as YYYY-MM (default: ORDER_RETENTION_MONTHS before this month)'
+        )
+        parser.add_argument('--output-dir', default=settings.ORDER_ARCHIVE_DIR)
+        parser.add_argument('--dry-run', action='store_true', help='Export without removing anything')
+
+    def handle(self, *args, **options):
+        if options['before']:
+            try:
+                cutoff = datetime.strptime(options['before'], '%Y-%m').replace(tzinfo=dt_timezone.utc)
+            except ValueError:
+                raise CommandError('--before must look like YYYY-MM')
+        else:
+            cutoff = add_months(month_start(timezone.now()), -settings.ORDER_RETENTION_MONTHS)
+
+        output_dir = Path(options['output_dir'])
+        output_dir.mkdir(parents=True, exist_ok=True)
+        partitioned = is_partitioned(connection)
+        if partitioned:
+            months = [month for month in order_partitions(connection) if month < cutoff]
+        else:
+            months = [
+                month_start(month)
+                for month in Order.objects.filter(created_at__lt=cutoff).datetimes('created_at', 'month')
+            ]
+
+        for month in months:
+            if partitioned:
+                lower, upper = month_id_range(month)
+                orders = Order.objects.filter(order_id__gte=lower, order_id__lt=upper)
+                if orders.filter(created_at__gte=cutoff).exists():
+                    # Only possible for pre-UUIDv7 ids that happen to fall in the range
+                    self.stderr.write(f'Skipping {month:%Y-%m}: its partition holds orders newer than the cutoff')
+                    continue
+            else:
+                orders = Order.objects.filter(created_at__gte=month, created_at__lt=add_months(month, 1))
+
+            path = output_dir / f'orders-{month:%Y-%m}.jsonl.gz'
+            count = self.export(orders, path)
+            if not options['dry_run']:
+                self.remove(orders, month, partitioned)
+            action = 'Exported' if options['dry_run'] else 'Archived'
+            self.stdout.write(f'{action} {count} orders from {month:%Y-%m} to {path}')
+
+    def export(self, orders, path):
+        count = 0
+        with gzip.open(path, 'wt') as archive:
+            for order in orders.prefetch_related('items', 'history').order_by('pk').iterator(chunk_size=2000):
+                archive.write(json.dumps({
+                    'order_id': order.order_id,
+                    'user_id': order.user_id,
+                    'created_at': order.created_at,
+                    'status': order.status,
+                    'items': [
+                        {'product_id': item.product_id, 'quantity': item.quantity, 'unit_price': item.unit_price}
+                        for item in order.items.all()
+                    ],
+                    'history': [
+                        {
+                            'old_status': entry.old_status,
+                            'new_status': entry.new_status,
+                            'changed_by_id': entry.changed_by_id,
+                            'changed_at': entry.changed_at,
+                            'reason': entry.reason,
+                        }
+                        for entry in order.history.all()
+                    ],
+                }, cls=DjangoJSONEncoder) + '\n')
+                count += 1
+        return count
+
+    def remove(self, orders, month, partitioned):
+        with transaction.atomic():
+            if partitioned:
+                # UUIDv7 ids make the month one contiguous range in the items and history indexes
+                lower, upper = month_id_range(month)
+                self.record_archived_items(order_id__gte=lower, order_id__lt=upper)
+                OrderItem.objects.filter(order_id__gte=lower, order_id__lt=upper).delete()
+                OrderHistory.objects.filter(order_id__gte=lower, order_id__lt=upper).delete()
+                drop_order_partition(month, connection)
+            else:
+                self.record_archived_items(order__in=orders)
+                orders.delete()
+
+    def record_archived_items(self, **filters):
+        # Reconciliation counts the held stock from the order items, so the ledger takes over what they held
+        archived = reserved_totals(**filters)
+        record_stock_movements(
+            ((product_id, -quantity) for product_id, quantity in archived.items()),
+            StockMovement.KindChoices.ARCHIVED
+        )
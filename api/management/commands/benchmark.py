@@ -0,0 +1,24 @@
+import json
+
+from django.core.management.base import BaseCommand, CommandError
+from django.test.utils import override_settings
+from api.benchmarks import BENCHMARKS
+
+
+class Command(BaseCommand):
+    help = 'Runs micro-benchmarks and prints the results as JSON'
+
+    def add_arguments(self, parser):
+        parser.add_argument('names', nargs='*', help=f'Benchmarks to run: {", ".join(sorted(BENCHMARKS))}')
+        parser.add_argument('--iterations', type=int, default=100)
+
+    def handle(self, *args, **options):
+        names = options['names'] or sorted(BENCHMARKS)
+        unknown = [name for name in names if name not in BENCHMARKS]
+        if unknown:
+            raise CommandError(f'Unknown benchmark(s): {", ".join(unknown)}')
+
+        # Benchmarks must never reach a real mail server
+        with override_settings(EMAIL_BACKEND='django.core.mail.backends.locmem.EmailBackend'):
+            results = {name: BENCHMARKS[name](options['iterations']) for name in names}
+        self.stdout.write(json.dumps(results, indent=2))
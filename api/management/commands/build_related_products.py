@@ -0,0 +1,17 @@
+import time
+
+from django.core.management.base import BaseCommand
+from django.conf import settings
+from api.recommendations import rebuild_related_products
+
+
+class Command(BaseCommand):
+    help = 'Rebuilds the "frequently bought together" neighbours of every product from the order history'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--chunk-size', type=int, default=settings.RELATED_PRODUCTS['CHUNK_SIZE'])
+
+    def handle(self, *args, **options):
+        start = time.perf_counter()
+        refreshed = rebuild_related_products(options['chunk_size'])
+        self.stdout.write(f'Stored neighbours for {refreshed} products in {time.perf_counter() - start:.1f}s')
@@ -0,0 +1,34 @@
+import difflib
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from api.schema import generate_schema, render_schema_yaml
+
+
+class Command(BaseCommand):
+    help = 'Fails when the checked-in OpenAPI schema no longer matches the code'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--write', action='store_true', help='Regenerate the schema file instead of checking it')
+
+    def handle(self, *args, **options):
+        schema_file = settings.API_SCHEMA_FILE
+        generated = render_schema_yaml(generate_schema()).decode()
+
+        if options['write']:
+            schema_file.write_text(generated)
+            self.stdout.write(self.style.SUCCESS(f'Wrote {schema_file}'))
+            return
+
+        current = schema_file.read_text() if schema_file.exists() else ''
+        if current != generated:
+            diff = difflib.unified_diff(
+                current.splitlines(keepends=True),
+                generated.splitlines(keepends=True),
+                fromfile=str(schema_file),
+                tofile='generated'
+            )
+            self.stdout.write(''.join(diff))
+            raise CommandError(f'{schema_file.name} is out of date, run `manage.py check_schema --write`')
+
+        self.stdout.write(self.style.SUCCESS(f'{schema_file.name} is up to date'))
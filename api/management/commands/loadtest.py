@@ -0,0 +1,150 @@
+import json
+import os
+import socket
+import subprocess
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+from decimal import Decimal
+from urllib.error import URLError
+from urllib.request import urlopen
+
+from django.conf import settings
+from django.contrib.auth.hashers import make_password
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from api.inventory import record_stock_movements
+from api.loadtest import SCENARIO_WEIGHTS, run_worker, summarize
+from api.models import Order, Product, StockMovement, User
+from api.product_cache import product_cache
+
+
+class Command(BaseCommand):
+    help = 'Replays a weighted mix of API scenarios from many processes and prints the results as JSON'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--url', help='Server to test; by default a runserver is started on a free port')
+        parser.add_argument('--workers', type=int, default=4, help='Client processes')
+        parser.add_argument('--requests', type=int, default=200, help='Requests per worker')
+        parser.add_argument('--users', type=int, default=20, help='Synthetic users to seed and log in as')
+        parser.add_argument('--products', type=int, default=1000, help='Products to seed')
+        parser.add_argument('--seed', type=int, default=0, help='Seed for the scenario sequence')
+        parser.add_argument(
+            '--keep-data',
+            action='store_true',
+            help='Leave the seeded users and products, and the orders placed during the run, in the database'
+        )
+        parser.add_argument(
+            '--weights',
+            type=json.loads,
+            default=SCENARIO_WEIGHTS,
+            help=f'Scenario weights as JSON, default {json.dumps(SCENARIO_WEIGHTS)}'
+        )
+
+    def handle(self, *args, **options):
+        unknown = set(options['weights']) - set(SCENARIO_WEIGHTS)
+        if unknown:
+            raise CommandError(f'Unknown scenario(s): {", ".join(sorted(unknown))}')
+
+        credentials = self.seed_users(options['users'])
+        product_ids = self.seed_products(options['products'])
+        try:
+            samples, elapsed = self.run(options, credentials, product_ids)
+        finally:
+            if not options['keep_data']:
+                self.remove_seeded_data()
+
+        results = summarize(samples, elapsed)
+        results['config'] = {
+            key: options[key] for key in ('workers', 'requests', 'users', 'products', 'seed', 'weights')
+        }
+        self.stdout.write(json.dumps(results, indent=2))
+
+    def run(self, options, credentials, product_ids):
+        """(samples of every worker, elapsed seconds)"""
+        server = None
+        base_url = options['url']
+        if not base_url:
+            server, base_url = self.start_server()
+        try:
+            start = time.perf_counter()
+            with ProcessPoolExecutor(max_workers=options['workers']) as executor:
+                futures = [
+                    executor.submit(
+                        run_worker, base_url, worker, options['seed'], credentials,
+                        product_ids, options['requests'], options['weights']
+                    )
+                    for worker in range(options['workers'])
+                ]
+                samples = [sample for future in futures for sample in future.result()]
+            return samples, time.perf_counter() - start
+        finally:
+            if server is not None:
+                server.terminate()
+                server.wait()
+
+    def seed_users(self, count):
+        password = 'loadtest-password'
+        existing = set(User.objects.filter(username__startswith='loadtest-').values_list('username', flat=True))
+        # One hash for every synthetic user keeps seeding fast
+        password_hash = make_password(password)
+        User.objects.bulk_create([
+            User(username=f'loadtest-{i}', email=f'loadtest-{i}@example.com', password=password_hash)
+            for i in range(count) if f'loadtest-{i}' not in existing
+        ])
+        return [(f'loadtest-{i}', password) for i in range(count)]
+
+    @transaction.atomic
+    def seed_products(self, count):
+        existing = Product.objects.filter(name__startswith='Loadtest product ').count()
+        created = Product.objects.bulk_create([
+            Product(
+                name=f'Loadtest product {i}',
+                description='Load test product',
+                price=Decimal('9.99'),
+                stock=10 ** 9
+            )
+            for i in range(existing, count)
+        ], batch_size=5000)
+        # Opening ledger rows keep reconcile_stock clean on the seeded products
+        record_stock_movements(
+            [(product.id, product.stock) for product in created],
+            StockMovement.KindChoices.OPENING
+        )
+        return list(
+            Product.objects.filter(name__startswith='Loadtest product ').order_by('pk').values_list('id', flat=True)
+        )
+
+    @transaction.atomic
+    def remove_seeded_data(self):
+        """Delete the synthetic users and products; their orders, items and ledger rows go with them"""
+        product_ids = list(
+            Product.objects.filter(name__startswith='Loadtest product ').values_list('id', flat=True)
+        )
+        Order.objects.filter(user__username__startswith='loadtest-').delete()
+        Product.objects.filter(id__in=product_ids).delete()
+        User.objects.filter(username__startswith='loadtest-').delete()
+        transaction.on_commit(lambda: product_cache.invalidate(product_ids, names=True))
+
+    def start_server(self):
+        with socket.socket() as probe:
+            probe.bind(('127.0.0.1', 0))
+            port = probe.getsockname()[1]
+        base_url = f'http://127.0.0.1:{port}'
+        server = subprocess.Popen(
+            [sys.executable, str(settings.BASE_DIR / 'manage.py'), 'runserver', '--noreload', f'127.0.0.1:{port}'],
+            env={**os.environ, 'DJANGO_SETTINGS_MODULE': os.environ.get('DJANGO_SETTINGS_MODULE', settings.SETTINGS_MODULE)},
+            stdout=subprocess.DEVNULL,
+            stderr=subprocess.DEVNULL,
+        )
+        deadline = time.monotonic() + 30
+        while time.monotonic() < deadline:
+            try:
+                urlopen(f'{base_url}/products/?limit=1', timeout=1).close()
+                return server, base_url
+            except (URLError, OSError):
+                if server.poll() is not None:
+                    break
+                time.sleep(0.2)
+        server.terminate()
+        raise CommandError('The test server did not start')
@@ -3,7 +3,8 @@ from decimal import Decimal
 
 from django.core.management.base import BaseCommand
 from django.utils import lorem_ipsum
-from api.models import User, Product, Order, OrderItem
+from api.models import User, Product, Order, OrderItem, StockMovement
+from api.inventory import record_stock_movements, reserve_stock
 
 class Command(BaseCommand):
     help = 'Creates application data'
@@ -27,13 +28,23 @@ class Command(BaseCommand):
         # create products & re-fetch from DB
         Product.objects.bulk_create(products)
         products = Product.objects.all()
+        record_stock_movements(
+            [(product.id, product.stock) for product in products],
+            StockMovement.KindChoices.OPENING
+        )
 
 
-        # create some dummy orders tied to the superuser
+        # create some dummy orders tied to the superuser, taking their items out of stock
+        remaining = {product.id: product.stock for product in products}
         for _ in range(3):
             # create an Order with 2 order items
             order = Order.objects.create(user=user)
-            for product in random.sample(list(products), 2):
-                OrderItem.objects.create(
-                    order=order, product=product, quantity=random.randint(1,3)
-                )
\ No newline at end of file
+            in_stock = [product for product in products if remaining[product.id] > 0]
+            quantities = {
+                product.id: random.randint(1, min(3, remaining[product.id]))
+                for product in random.sample(in_stock, 2)
+            }
+            reserve_stock(quantities)
+            for product_id, quantity in quantities.items():
+                remaining[product_id] -= quantity
+                OrderItem.objects.create(order=order, product_id=product_id, quantity=quantity)
@@ -0,0 +1,57 @@
+from concurrent.futures import ThreadPoolExecutor
+
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.db.models import Max, Min
+from api.inventory import reconcile_range
+from api.models import Product
+
+
+class Command(BaseCommand):
+    help = 'Compares Product.stock with the inventory ledger and active orders, optionally correcting drift'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--fix', action='store_true', help='Set drifted products to their expected stock')
+        parser.add_argument('--chunk-size', type=int, default=10000)
+        parser.add_argument('--workers', type=int, default=4)
+
+    def handle(self, *args, **options):
+        bounds = Product.objects.aggregate(low=Min('id'), high=Max('id'))
+        if bounds['low'] is None:
+            self.stdout.write('No products to reconcile')
+            return
+
+        chunk_size = options['chunk_size']
+        ranges = [
+            (start, start + chunk_size)
+            for start in range(bounds['low'], bounds['high'] + 1, chunk_size)
+        ]
+
+        def run(id_range):
+            try:
+                return reconcile_range(*id_range, fix=options['fix'])
+            finally:
+                # Each worker thread opens its own connection
+                if options['workers'] > 1:
+                    connection.close()
+
+        drifted = 0
+        if options['workers'] > 1:
+            with ThreadPoolExecutor(max_workers=options['workers']) as executor:
+                results = executor.map(run, ranges)
+                for drift in results:
+                    drifted += self.report(drift)
+        else:
+            for id_range in ranges:
+                drifted += self.report(run(id_range))
+
+        action = 'Corrected' if options['fix'] else 'Found'
+        self.stdout.write(f'{action} stock drift on {drifted} products')
+
+    def report(self, drift):
+        for item in drift:
+            self.stdout.write(
+                f'product {item.product_id}: stock {item.stock}, expected {item.expected} '
+                f'({item.stock - item.expected:+d})'
+            )
+        return len(drift)
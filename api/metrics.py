@@ -0,0 +1,325 @@
+import atexit
+import json
+import os
+import socket
+import tempfile
+import threading
+import time
+import uuid
+from bisect import bisect_left
+from collections import defaultdict
+from asgiref.local import Local
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.core.mail import get_connection
+from django.core.mail.backends.base import BaseEmailBackend
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+TASK_BUCKETS = (0.01, 0.05, 0.1, 0.5, 1.0, 5.0, 10.0, 30.0, 60.0, 300.0)
+
+# name -> (type, label names, help, histogram buckets)
+DEFINITIONS = {
+    'http_requests_total': ('counter', ('route', 'method', 'status'), 'Requests by URL name, method and status', None),
+    'http_request_duration_seconds': ('histogram', ('route', 'method'), 'Time until the response is returned', LATENCY_BUCKETS),
+    'db_queries_total': ('counter', ('scope',), 'ORM queries by URL name or Celery task', None),
+    'cache_requests_total': ('counter', ('result',), 'Cache lookups by hit or miss', None),
+    'cache_circuit_state': ('gauge', ('pid',), 'Cache circuit breaker per process: 0 closed, 1 open, 2 half-open', None),
+    'cache_circuit_transitions_total': ('counter', ('state',), 'Cache circuit breaker state changes', None),
+    'cache_degraded_total': ('counter', ('operation', 'reason'), 'Cache calls answered without Redis', None),
+    'celery_task_duration_seconds': ('histogram', ('task', 'state'), 'Celery task run time', TASK_BUCKETS),
+    'email_send_duration_seconds': ('histogram', ('result',), 'Time to hand a batch of emails to the mail backend', TASK_BUCKETS),
+    'emails_sent_total': ('counter', (), 'Emails accepted by the mail backend', None),
+}
+
+
+# A snapshot that missed this many flushes belongs to an idle or dead process, so its gauges are dropped
+STALE_FLUSHES = 3
+
+
+class MetricsRegistry:
+    """Counters and histograms for this process.
+
+    With a DIRECTORY configured, each process writes a snapshot there at most
+    every FLUSH_INTERVAL seconds (and at exit); render() merges every snapshot
+    so one scrape covers all preforked workers and Celery processes.
+
+    Snapshots of processes that died on this host, and of any process that
+    has not flushed for max_age seconds, are deleted when collected.
+    """
+
+    def __init__(self, directory=None, flush_interval=5.0, max_age=3600):
+        self._counters = defaultdict(float)
+        self._gauges = {}
+        self._histograms = {}
+        self._lock = threading.Lock()
+        self.directory = directory
+        self.flush_interval = flush_interval
+        self.max_age = max_age
+        self._next_flush = 0.0
+        self._path = None
+        self._pid = None
+
+    def inc(self, name, labels=(), amount=1):
+        with self._lock:
+            self._counters[name, labels] += amount
+        self._maybe_flush()
+
+    def set(self, name, value, labels=()):
+        with self._lock:
+            self._gauges[name, labels] = value
+        self._maybe_flush()
+
+    def observe(self, name, value, labels=()):
+        buckets = DEFINITIONS[name][3]
+        with self._lock:
+            series = self._histograms.get((name, labels))
+            if series is None:
+                # One count per bucket plus +Inf, then sum and count
+                series = self._histograms[name, labels] = [0] * (len(buckets) + 3)
+            series[bisect_left(buckets, value)] += 1
+            series[-2] += value
+            series[-1] += 1
+        self._maybe_flush()
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                'counters': [[name, list(labels), value] for (name, labels), value in self._counters.items()],
+                'gauges': [[name, list(labels), value] for (name, labels), value in self._gauges.items()],
+                'histograms': [[name, list(labels), list(series)] for (name, labels), series in self._histograms.items()],
+            }
+
+    def clear(self):
+        with self._lock:
+            self._counters.clear()
+            self._gauges.clear()
+            self._histograms.clear()
+
+    def _maybe_flush(self):
+        if self.directory and time.monotonic() >= self._next_flush:
+            self.flush()
+
+    def flush(self):
+        """Write this process's snapshot to the shared directory"""
+        if not self.directory:
+            return
+        self._next_flush = time.monotonic() + self.flush_interval
+        if self._pid != os.getpid():
+            # A forked worker must not overwrite its parent's file
+            self._pid = os.getpid()
+            self._path = os.path.join(self.directory, f'{socket.gethostname()}-{self._pid}-{uuid.uuid4().hex[:8]}.json')
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+            handle, temp_path = tempfile.mkstemp(dir=self.directory, suffix='.tmp')
+            with os.fdopen(handle, 'w') as file:
+                json.dump(self.snapshot(), file)
+            os.replace(temp_path, self._path)
+        except OSError as e:
+            logger.error(f"Failed to write metrics snapshot to {self.directory}: {e}")
+
+    def collect(self):
+        """Merged counters and gauges, and histograms, of this process and every snapshot in the directory.
+
+        Series are summed across processes; gauges are labelled by pid so that
+        each process keeps its own series.
+        """
+        snapshots = [self.snapshot()]
+        if self.directory and os.path.isdir(self.directory):
+            now = time.time()
+            for entry in os.scandir(self.directory):
+                if entry.path == self._path:
+                    continue
+                try:
+                    age = now - entry.stat().st_mtime
+                    if self._is_abandoned(entry.name, age):
+                        os.remove(entry.path)
+                        continue
+                    if not entry.name.endswith('.json'):
+                        continue
+                    with open(entry.path) as file:
+                        snapshot = json.load(file)
+                except (OSError, ValueError):
+                    # Removed or half-written by a process that is going away
+                    continue
+                if age > self.flush_interval * STALE_FLUSHES:
+                    snapshot['gauges'] = []
+                snapshots.append(snapshot)
+
+        counters = defaultdict(float)
+        histograms = {}
+        for snapshot in snapshots:
+            for name, labels, value in snapshot['counters'] + snapshot.get('gauges', []):
+                counters[name, tuple(labels)] += value
+            for name, labels, series in snapshot['histograms']:
+                merged = histograms.setdefault((name, tuple(labels)), [0] * len(series))
+                for index, value in enumerate(series):
+                    merged[index] += value
+        return counters, histograms
+
+    def _is_abandoned(self, name, age):
+        if age > self.max_age:
+            return True
+        if not name.endswith('.json'):
+            # A temporary file left behind by a process killed while writing
+            return age > self.flush_interval * STALE_FLUSHES
+        host, pid, _ = name.rsplit('-', 2)
+        # Processes on other hosts cannot be checked, only aged out
+        return host == socket.gethostname() and pid.isdigit() and not _pid_alive(int(pid))
+
+    def render(self):
+        """Prometheus text exposition format, version 0.0.4"""
+        counters, histograms = self.collect()
+        lines = []
+        for name, (kind, label_names, help_text, buckets) in DEFINITIONS.items():
+            lines.append(f'# HELP {name} {help_text}')
+            lines.append(f'# TYPE {name} {kind}')
+            if kind in ('counter', 'gauge'):
+                for (series_name, labels), value in sorted(counters.items()):
+                    if series_name == name:
+                        lines.append(f'{name}{_labels(label_names, labels)} {_number(value)}')
+                continue
+            for (series_name, labels), series in sorted(histograms.items()):
+                if series_name != name:
+                    continue
+                cumulative = 0
+                for bound, count in zip(buckets + ('+Inf',), series):
+                    cumulative += count
+                    le = bound if bound == '+Inf' else _number(bound)
+                    lines.append(f'{name}_bucket{_labels(label_names + ("le",), labels + (le,))} {cumulative}')
+                lines.append(f'{name}_sum{_labels(label_names, labels)} {_number(series[-2])}')
+                lines.append(f'{name}_count{_labels(label_names, labels)} {series[-1]}')
+        return '\n'.join(lines) + '\n'
+
+
+def _pid_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        # Alive, but run by another user
+        pass
+    return True
+
+
+def _labels(names, values):
+    if not names:
+        return ''
+    escaped = (
+        str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+        for value in values
+    )
+    return '{' + ','.join(f'{name}="{value}"' for name, value in zip(names, escaped)) + '}'
+
+
+def _number(value):
+    return repr(float(value)) if value != int(value) else str(int(value))
+
+
+registry = MetricsRegistry(
+    settings.METRICS['DIRECTORY'], settings.METRICS['FLUSH_INTERVAL'], settings.METRICS['MAX_SNAPSHOT_AGE']
+)
+atexit.register(registry.flush)
+
+# What ORM queries are attributed to: the URL name being served or the Celery task being run.
+# Unlike a threading.local, it follows an ASGI request across the threads its sync code runs on.
+_scope = Local()
+
+
+class MetricsMiddleware:
+    """Counts and times every request by URL name. Must be the first middleware."""
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        if not settings.METRICS['ENABLED']:
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        start = time.perf_counter()
+        try:
+            response = self.get_response(request)
+        finally:
+            _scope.name = None
+        self._record(request, response, time.perf_counter() - start)
+        return response
+
+    async def __acall__(self, request):
+        start = time.perf_counter()
+        try:
+            response = await self.get_response(request)
+        finally:
+            _scope.name = None
+        self._record(request, response, time.perf_counter() - start)
+        return response
+
+    def _record(self, request, response, duration):
+        match = request.resolver_match
+        route = match.url_name if match is not None and match.url_name else 'unmatched'
+        registry.inc('http_requests_total', (route, request.method, str(response.status_code)))
+        registry.observe('http_request_duration_seconds', duration, (route, request.method))
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        _scope.name = request.resolver_match.url_name
+        return None
+
+
+def count_query(execute, sql, params, many, context):
+    registry.inc('db_queries_total', (getattr(_scope, 'name', None) or 'other',))
+    return execute(sql, params, many, context)
+
+
+def instrument_connection(sender, connection, **kwargs):
+    """connection_created receiver; the same wrapper object reconnects, so only add the counter once"""
+    if settings.METRICS['ENABLED'] and count_query not in connection.execute_wrappers:
+        connection.execute_wrappers.append(count_query)
+
+
+_task_starts = {}
+
+
+def task_started(task_id=None, task=None, **kwargs):
+    _scope.name = task.name
+    _task_starts[task_id] = time.perf_counter()
+
+
+def task_finished(task_id=None, task=None, state=None, **kwargs):
+    _scope.name = None
+    start = _task_starts.pop(task_id, None)
+    if start is not None:
+        registry.observe('celery_task_duration_seconds', time.perf_counter() - start, (task.name, state or 'UNKNOWN'))
+
+
+class TimedEmailBackend(BaseEmailBackend):
+    """Times the mail backend configured as METRICS['EMAIL_BACKEND']"""
+
+    def __init__(self, fail_silently=False, **kwargs):
+        super().__init__(fail_silently=fail_silently)
+        self.backend = get_connection(settings.METRICS['EMAIL_BACKEND'], fail_silently=fail_silently, **kwargs)
+
+    def open(self):
+        return self.backend.open()
+
+    def close(self):
+        return self.backend.close()
+
+    def send_messages(self, email_messages):
+        start = time.perf_counter()
+        sent = 0
+        try:
+            sent = self.backend.send_messages(email_messages) or 0
+            return sent
+        finally:
+            result = 'sent' if sent else 'failed'
+            registry.observe('email_send_duration_seconds', time.perf_counter() - start, (result,))
+            registry.inc('emails_sent_total', amount=sent)
@@ -0,0 +1,27 @@
+# Generated by Django 5.1.1 on 2026-10-19 02:26
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0004_product_low_stock'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='StockMovement',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('quantity', models.IntegerField()),
+                ('kind', models.CharField(choices=[('Opening', 'Opening'), ('Restock', 'Restock'), ('Adjustment', 'Adjustment')], max_length=10)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('product', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='stock_movements', to='api.product')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['product', 'created_at'], name='api_stockmo_product_594dde_idx')],
+            },
+        ),
+    ]
@@ -0,0 +1,38 @@
+# Generated by Django 5.1.1 on 2026-10-19 02:26
+
+from django.db import migrations
+from django.db.models import Sum
+
+
+def create_opening_balances(apps, schema_editor):
+    """Seed the ledger so existing stock plus quantities held by orders reconciles to zero drift"""
+    Product = apps.get_model('api', 'Product')
+    OrderItem = apps.get_model('api', 'OrderItem')
+    StockMovement = apps.get_model('api', 'StockMovement')
+
+    reserved = dict(
+        OrderItem.objects.exclude(order__status__in=['Cancelled', 'Refunded'])
+        .values('product_id')
+        .annotate(total=Sum('quantity'))
+        .values_list('product_id', 'total')
+    )
+    batch = []
+    for product_id, stock in Product.objects.values_list('id', 'stock').iterator(chunk_size=10000):
+        quantity = stock + reserved.get(product_id, 0)
+        if quantity:
+            batch.append(StockMovement(product_id=product_id, quantity=quantity, kind='Opening'))
+        if len(batch) >= 10000:
+            StockMovement.objects.bulk_create(batch)
+            batch = []
+    StockMovement.objects.bulk_create(batch)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0005_stock_movement'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_opening_balances, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,123 @@
+# Generated by Django 5.1.1 on 2026-10-19 02:49
+
+import api.partitions
+import uuid
+from datetime import datetime, timezone as dt_timezone
+from django.db import migrations, models
+
+
+# The partitioning is spelled out here rather than imported from api.partitions,
+# so later changes to that module cannot change what this migration does.
+ORDER_TABLE = 'api_order'
+DEFAULT_PARTITION = f'{ORDER_TABLE}_default'
+MONTHS_AHEAD = 3
+
+
+def is_partitioned(cursor):
+    cursor.execute(
+        "SELECT EXISTS (SELECT 1 FROM pg_partitioned_table WHERE partrelid = to_regclass(%s))",
+        [ORDER_TABLE]
+    )
+    return cursor.fetchone()[0]
+
+
+def partition_order_table(cursor, quote):
+    """Turn the existing orders table into the default partition of a partitioned one"""
+    # Foreign keys have to reference the new parent table, not the old one
+    cursor.execute(
+        "SELECT conrelid::regclass::text, conname, pg_get_constraintdef(oid) FROM pg_constraint "
+        "WHERE contype = 'f' AND confrelid = to_regclass(%s)",
+        [ORDER_TABLE]
+    )
+    incoming = cursor.fetchall()
+    cursor.execute(
+        "SELECT conname, pg_get_constraintdef(oid) FROM pg_constraint "
+        "WHERE contype = 'f' AND conrelid = to_regclass(%s)",
+        [ORDER_TABLE]
+    )
+    outgoing = cursor.fetchall()
+    cursor.execute(
+        "SELECT indexname, indexdef FROM pg_indexes WHERE tablename = %s AND indexname <> %s",
+        [ORDER_TABLE, f'{ORDER_TABLE}_pkey']
+    )
+    indexes = cursor.fetchall()
+
+    for table, name, _ in incoming:
+        cursor.execute(f"ALTER TABLE {table} DROP CONSTRAINT {quote(name)}")
+    cursor.execute(f"ALTER TABLE {ORDER_TABLE} RENAME TO {DEFAULT_PARTITION}")
+    cursor.execute(
+        f"ALTER TABLE {DEFAULT_PARTITION} RENAME CONSTRAINT {ORDER_TABLE}_pkey TO {DEFAULT_PARTITION}_pkey"
+    )
+    for name, _ in indexes:
+        cursor.execute(f"ALTER INDEX {quote(name)} RENAME TO {quote(f'{name[:55]}_default')}")
+
+    cursor.execute(
+        f"CREATE TABLE {ORDER_TABLE} (LIKE {DEFAULT_PARTITION} INCLUDING DEFAULTS INCLUDING CONSTRAINTS) "
+        f"PARTITION BY RANGE (order_id)"
+    )
+    cursor.execute(f"ALTER TABLE {ORDER_TABLE} ADD CONSTRAINT {ORDER_TABLE}_pkey PRIMARY KEY (order_id)")
+    for _, definition in indexes:
+        cursor.execute(definition)
+    for name, definition in outgoing:
+        cursor.execute(f"ALTER TABLE {ORDER_TABLE} ADD CONSTRAINT {quote(name)} {definition}")
+    # Matching indexes and constraints on the old table are adopted rather than rebuilt
+    cursor.execute(f"ALTER TABLE {ORDER_TABLE} ATTACH PARTITION {DEFAULT_PARTITION} DEFAULT")
+    for table, name, definition in incoming:
+        cursor.execute(f"ALTER TABLE {table} ADD CONSTRAINT {quote(name)} {definition}")
+
+
+def month_start(index):
+    """First moment of month number `index`, counted as year * 12 + month - 1"""
+    return datetime(index // 12, index % 12 + 1, 1, tzinfo=dt_timezone.utc)
+
+
+def create_month_partition(cursor, index):
+    """Partition for the UUIDv7 ids of one month, moving legacy ids in its range out of the default one"""
+    def bound(moment):
+        return uuid.UUID(int=int(moment.timestamp() * 1000) << 80)
+
+    month = month_start(index)
+    lower, upper = bound(month), bound(month_start(index + 1))
+    name = f'{ORDER_TABLE}_{month:%Y_%m}'
+    cursor.execute(
+        f"CREATE TEMPORARY TABLE {name}_moved ON COMMIT DROP AS "
+        f"SELECT * FROM {DEFAULT_PARTITION} WHERE order_id >= %s AND order_id < %s",
+        [lower, upper]
+    )
+    cursor.execute(f"DELETE FROM {DEFAULT_PARTITION} WHERE order_id >= %s AND order_id < %s", [lower, upper])
+    cursor.execute(
+        f"CREATE TABLE {name} PARTITION OF {ORDER_TABLE} FOR VALUES FROM (%s) TO (%s)",
+        [lower, upper]
+    )
+    cursor.execute(f"INSERT INTO {ORDER_TABLE} SELECT * FROM {name}_moved")
+
+
+def partition_orders(apps, schema_editor):
+    """Postgres only; other databases keep a single orders table"""
+    connection = schema_editor.connection
+    if connection.vendor != 'postgresql':
+        return
+    with connection.cursor() as cursor:
+        if is_partitioned(cursor):
+            return
+        partition_order_table(cursor, connection.ops.quote_name)
+        # This month and the next few; ensure_order_partitions keeps creating them afterwards
+        now = datetime.now(dt_timezone.utc)
+        for offset in range(MONTHS_AHEAD + 1):
+            create_month_partition(cursor, now.year * 12 + now.month - 1 + offset)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0007_order_item_unit_price'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='order',
+            name='order_id',
+            field=models.UUIDField(default=api.partitions.uuid7, primary_key=True, serialize=False),
+        ),
+        migrations.RunPython(partition_orders, migrations.RunPython.noop),
+    ]
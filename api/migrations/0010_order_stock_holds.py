@@ -0,0 +1,22 @@
+# Generated by Django 5.1.1 on 2026-10-19 05:26
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0009_related_products'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='order',
+            name='expires_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddIndex(
+            model_name='order',
+            index=models.Index(fields=['status', 'expires_at'], name='api_order_status_46d37e_idx'),
+        ),
+    ]
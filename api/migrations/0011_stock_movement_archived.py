@@ -0,0 +1,18 @@
+# Generated by Django 5.1.1 on 2026-10-19 08:06
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0010_order_stock_holds'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='stockmovement',
+            name='kind',
+            field=models.CharField(choices=[('Opening', 'Opening'), ('Restock', 'Restock'), ('Adjustment', 'Adjustment'), ('Archived', 'Archived')], max_length=10),
+        ),
+    ]
@@ -60,18 +60,21 @@ class BusinessLogicValidator:
                 params={'available': product.stock, 'requested': quantity}
             )
     
+    # Order state machine: current status -> statuses it may move to
+    ORDER_STATUS_TRANSITIONS = {
+        'Pending': ['Confirmed', 'Cancelled'],
+        'Confirmed': ['Processing', 'Cancelled'],
+        'Processing': ['Shipped', 'Cancelled'],
+        'Shipped': ['Delivered'],
+        'Delivered': ['Refunded'],
+        'Cancelled': [],
+        'Refunded': []
+    }
+
     @staticmethod
     def validate_order_status_transition(current_status, new_status):
         """Validate order status transitions"""
-        valid_transitions = {
-            'pending': ['confirmed', 'cancelled'],
-            'confirmed': ['processing', 'cancelled'],
-            'processing': ['shipped', 'cancelled'],
-            'shipped': ['delivered'],
-            'delivered': ['refunded'],
-            'cancelled': [],
-            'refunded': []
-        }
+        valid_transitions = BusinessLogicValidator.ORDER_STATUS_TRANSITIONS
         
         if new_status not in valid_transitions.get(current_status, []):
             raise ValidationError(
@@ -79,6 +82,15 @@ class BusinessLogicValidator:
                 params={'current': current_status, 'new': new_status}
             )
     
+    @staticmethod
+    def order_statuses_leading_to(new_status):
+        """Return the statuses an order may be in to move to new_status"""
+        return [
+            current_status
+            for current_status, targets in BusinessLogicValidator.ORDER_STATUS_TRANSITIONS.items()
+            if new_status in targets
+        ]
+    
     @staticmethod
     def validate_price_range(price):
         """Validate price is within reasonable range"""
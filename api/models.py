@@ -1,6 +1,6 @@
-import uuid
 from django.db import models
 from django.contrib.auth.models import AbstractUser
+from api.partitions import uuid7
 
 
 class User(AbstractUser):
@@ -17,11 +17,33 @@ class Product(models.Model):
     description = models.TextField()
     price = models.DecimalField(max_digits=10, decimal_places=2)
     stock = models.PositiveIntegerField()
+    low_stock_threshold = models.PositiveIntegerField(default=5)
+    low_stock_alerted_at = models.DateTimeField(null=True, blank=True)
     image = models.ImageField(upload_to='products/', blank=True, null=True)
 
+    class Meta:
+        indexes = [
+            models.Index(fields=['name']),
+            # Partial indexes keep the low-stock scanner off the full table
+            models.Index(
+                fields=['id'],
+                condition=models.Q(stock__lte=models.F('low_stock_threshold')),
+                name='product_low_stock_idx'
+            ),
+            models.Index(
+                fields=['id'],
+                condition=models.Q(low_stock_alerted_at__isnull=False),
+                name='product_low_stock_alerted_idx'
+            ),
+        ]
+
     @property
     def in_stock(self):
         return self.stock > 0
+
+    @property
+    def is_low_stock(self):
+        return self.stock <= self.low_stock_threshold
     
     def __str__(self):
         return self.name
@@ -31,9 +53,13 @@ class Order(models.Model):
     class StatusChoices(models.TextChoices):
         PENDING = 'Pending'
         CONFIRMED = 'Confirmed'
+        PROCESSING = 'Processing'
+        SHIPPED = 'Shipped'
+        DELIVERED = 'Delivered'
         CANCELLED = 'Cancelled'
+        REFUNDED = 'Refunded'
 
-    order_id = models.UUIDField(primary_key=True, default=uuid.uuid4)
+    order_id = models.UUIDField(primary_key=True, default=uuid7)
     user = models.ForeignKey(User, on_delete=models.CASCADE)
     created_at = models.DateTimeField(auto_now_add=True)
     status = models.CharField(
@@ -41,9 +67,19 @@ class Order(models.Model):
         choices=StatusChoices.choices,
         default=StatusChoices.PENDING
     )
+    # When the stock held by a pending order is released and the order cancelled
+    expires_at = models.DateTimeField(null=True, blank=True)
 
     products = models.ManyToManyField(Product, through="OrderItem", related_name='orders')
 
+    class Meta:
+        indexes = [
+            models.Index(fields=['created_at']),
+            models.Index(fields=['status', 'created_at']),
+            # The expiry scan reads pending orders in expiry order straight off this index
+            models.Index(fields=['status', 'expires_at']),
+        ]
+
     def __str__(self):
         return f"Order {self.order_id } by {self.user.username}"
 
@@ -56,10 +92,62 @@ class OrderItem(models.Model):
     )
     product = models.ForeignKey(Product, on_delete=models.CASCADE)
     quantity = models.PositiveIntegerField()
+    # Price locked at checkout; items added before quoting fall back to the live price
+    unit_price = models.DecimalField(max_digits=10, decimal_places=2, null=True, blank=True)
 
     @property
     def item_subtotal(self):
+        if self.unit_price is not None:
+            return self.unit_price * self.quantity
         return self.product.price * self.quantity
     
     def __str__(self):
-        return f"{self.quantity} x {self.product.name} in Order {self.order.order_id}"
+        return f"{self.quantity} x {self.product.name} in Order {self.order_id}"
+
+
+class OrderHistory(models.Model):
+    """Audit trail for order status changes"""
+    order = models.ForeignKey(Order, on_delete=models.CASCADE, related_name='history')
+    changed_by = models.ForeignKey(User, on_delete=models.SET_NULL, null=True)
+    old_status = models.CharField(max_length=10, blank=True)
+    new_status = models.CharField(max_length=10)
+    changed_at = models.DateTimeField(auto_now_add=True)
+    reason = models.TextField(blank=True)
+
+    class Meta:
+        ordering = ['-changed_at']
+
+
+class StockMovement(models.Model):
+    """Append-only ledger of stock changes that do not come from order items"""
+    class KindChoices(models.TextChoices):
+        OPENING = 'Opening'
+        RESTOCK = 'Restock'
+        ADJUSTMENT = 'Adjustment'
+        # Items of archived orders, which leave the reservation totals
+        ARCHIVED = 'Archived'
+
+    product = models.ForeignKey(Product, on_delete=models.CASCADE, related_name='stock_movements')
+    quantity = models.IntegerField()
+    kind = models.CharField(max_length=10, choices=KindChoices.choices)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['product', 'created_at']),
+        ]
+
+
+class RelatedProduct(models.Model):
+    """A product's top co-purchased products, written by api.recommendations"""
+    # The (product, rank) constraint is the index the related-products lookup reads
+    product = models.ForeignKey(Product, on_delete=models.CASCADE, related_name='related_products', db_index=False)
+    related = models.ForeignKey(Product, on_delete=models.CASCADE, related_name='+')
+    rank = models.PositiveSmallIntegerField()
+    # Counted orders that contain both products
+    score = models.PositiveIntegerField()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['product', 'rank'], name='related_product_rank_unique'),
+        ]
@@ -0,0 +1,56 @@
+import hashlib
+import json
+from uuid import uuid4
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.utils.http import quote_etag
+from rest_framework.utils.encoders import JSONEncoder
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+def version_key(user_id):
+    return f'user_orders_version:{user_id}'
+
+
+def pages_key(user_id, version):
+    return f'user_orders:{user_id}:{version}'
+
+
+def get_user_order_pages(user_id):
+    """Return (version, {page url: (etag, data)}) for the user's cached order list pages"""
+    version = cache.get_or_set(version_key(user_id), lambda: uuid4().hex, timeout=None)
+    return version, cache.get(pages_key(user_id, version), {})
+
+
+def store_user_order_page(user_id, version, pages, url, data):
+    """Cache one page of the user's order list and return its ETag.
+
+    Pages are kept oldest first and dropped from the front once the user's
+    entry would exceed MAX_BYTES, so a user paging through a long history
+    cannot grow the cache without bound.
+    """
+    content = json.dumps(data, cls=JSONEncoder, separators=(',', ':')).encode()
+    etag = quote_etag(hashlib.sha256(content).hexdigest())
+    max_bytes = settings.USER_ORDER_CACHE['MAX_BYTES']
+    if len(content) > max_bytes:
+        return etag
+
+    pages = {page_url: page for page_url, page in pages.items() if page_url != url}
+    pages[url] = (etag, data, len(content))
+    while sum(page[2] for page in pages.values()) > max_bytes:
+        pages.pop(next(iter(pages)))
+    # Stored under the version read before the query, so a write that lands meanwhile orphans it
+    cache.set(pages_key(user_id, version), pages, timeout=settings.USER_ORDER_CACHE['TIMEOUT'])
+    return etag
+
+
+def invalidate_user_orders(user_ids):
+    """Start a new cache version for each user once the current transaction commits"""
+    user_ids = {user_id for user_id in user_ids if user_id is not None}
+    if user_ids:
+        transaction.on_commit(lambda: cache.set_many(
+            {version_key(user_id): uuid4().hex for user_id in user_ids}, timeout=None
+        ))
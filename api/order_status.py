@@ -0,0 +1,133 @@
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Case, F, Value, When
+from django.utils import timezone
+from api.models import Order, OrderHistory
+from api.model_validators import BusinessLogicValidator
+from api.order_cache import invalidate_user_orders
+from api.events import order_event, publish_order_events
+from api.inventory import RELEASED_ORDER_STATUSES, release_stock
+# A module import: api.tasks imports this module for the hold reaper
+from api import tasks
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+def transition_orders(order_ids, new_status, changed_by=None, reason='', from_statuses=None):
+    """Move many orders to new_status with one conditional UPDATE.
+
+    from_statuses narrows the statuses the orders may be moved from. Orders
+    cancelled or refunded put their items back in stock in the same transaction.
+    Returns (updated, rejected): the ids that moved and a mapping of the ids
+    that did not to the reason why.
+    """
+    allowed = BusinessLogicValidator.order_statuses_leading_to(new_status)
+    if from_statuses is not None:
+        allowed = [order_status for order_status in allowed if order_status in from_statuses]
+    order_ids = list(dict.fromkeys(order_ids))
+
+    with transaction.atomic():
+        # Lock the rows so the statuses written to history are the ones replaced
+        rows = list(
+            Order.objects.select_for_update()
+            .filter(order_id__in=order_ids)
+            .values_list('order_id', 'status', 'user_id')
+        )
+        current = {order_id: order_status for order_id, order_status, _ in rows}
+        updated = [order_id for order_id in order_ids if current.get(order_id) in allowed]
+        if updated:
+            # The status check is in the SET rather than the WHERE clause so the primary key,
+            # not a status index, picks the rows
+            Order.objects.filter(order_id__in=updated).update(status=Case(
+                When(status__in=allowed, then=Value(new_status)),
+                default=F('status')
+            ))
+            OrderHistory.objects.bulk_create([
+                OrderHistory(
+                    order_id=order_id,
+                    changed_by=changed_by,
+                    old_status=current[order_id],
+                    new_status=new_status,
+                    reason=reason
+                )
+                for order_id in updated
+            ])
+            if new_status in RELEASED_ORDER_STATUSES:
+                release_stock(updated)
+            transaction.on_commit(lambda: queue_status_notifications(updated, new_status))
+            moved = set(updated)
+            invalidate_user_orders(user_id for order_id, _, user_id in rows if order_id in moved)
+            changed_at = timezone.now()
+            events = [
+                order_event(order_id, user_id, old_status, new_status, changed_at)
+                for order_id, old_status, user_id in rows if order_id in moved
+            ]
+            transaction.on_commit(lambda: publish_order_events(events))
+
+    rejected = {}
+    for order_id in order_ids:
+        if order_id not in current:
+            rejected[order_id] = 'Order not found.'
+        elif current[order_id] not in allowed:
+            rejected[order_id] = f'Invalid status transition from {current[order_id]} to {new_status}'
+
+    logger.info(f"Moved {len(updated)} orders to {new_status}, rejected {len(rejected)}")
+    return updated, rejected
+
+
+def record_status_change(order, old_status, changed_by=None, reason=''):
+    """Write history, release stock if cancelled or refunded, queue a notification and push an event for a single order update"""
+    if order.status in RELEASED_ORDER_STATUSES and old_status not in RELEASED_ORDER_STATUSES:
+        release_stock([order.order_id])
+    entry = OrderHistory.objects.create(
+        order=order,
+        changed_by=changed_by,
+        old_status=old_status,
+        new_status=order.status,
+        reason=reason
+    )
+    transaction.on_commit(lambda: queue_status_notifications([order.order_id], order.status))
+    event = order_event(order.order_id, order.user_id, old_status, order.status, entry.changed_at)
+    transaction.on_commit(lambda: publish_order_events([event]))
+
+
+def queue_status_notifications(order_ids, new_status):
+    """Hand customer notifications to the worker so the request does not wait on SMTP"""
+    tasks.send_order_status_notifications.delay([str(order_id) for order_id in order_ids], new_status)
+    if new_status == Order.StatusChoices.CONFIRMED:
+        # Confirmed orders start counting towards "frequently bought together"
+        tasks.update_related_products.delay([str(order_id) for order_id in order_ids])
+
+
+def release_expired_holds(batch_size=None, now=None):
+    """Cancel pending orders whose stock hold ran out and put their stock back.
+
+    Each batch is its own transaction. It locks its orders, skipping any a
+    request is still writing, and their products for one UPDATE, so no lock
+    outlives a batch.
+    """
+    batch_size = batch_size or settings.STOCK_HOLDS['BATCH_SIZE']
+    now = now or timezone.now()
+    released = 0
+    while True:
+        with transaction.atomic():
+            # Read off the (status, expires_at) index, oldest first
+            order_ids = list(
+                Order.objects.select_for_update(skip_locked=True)
+                .filter(status=Order.StatusChoices.PENDING, expires_at__lte=now)
+                .order_by('expires_at')
+                .values_list('order_id', flat=True)[:batch_size]
+            )
+            if not order_ids:
+                break
+            updated, _ = transition_orders(
+                order_ids,
+                Order.StatusChoices.CANCELLED,
+                reason='Stock hold expired',
+                from_statuses=[Order.StatusChoices.PENDING]
+            )
+        released += len(updated)
+    if released:
+        logger.info(f"Released the stock holds of {released} expired orders")
+    return released
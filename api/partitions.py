@@ -0,0 +1,173 @@
+import os
+import re
+import time
+import uuid
+from datetime import datetime, timezone as dt_timezone
+from django.conf import settings
+from django.db import connection as default_connection, transaction
+from django.utils import timezone
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+# Orders are range-partitioned on order_id, whose leading 48 bits are the
+# creation time in milliseconds (UUIDv7), so each month is one id range.
+# Orders created before UUIDv7 ids keep their random ids in the default partition.
+ORDER_TABLE = 'api_order'
+DEFAULT_PARTITION = f'{ORDER_TABLE}_default'
+PARTITION_NAME = re.compile(rf'^{ORDER_TABLE}_(\d{{4}})_(\d{{2}})$')
+
+
+def uuid7(timestamp_ms=None):
+    """Time-ordered UUID (RFC 9562 version 7), so new orders append to the end of the index"""
+    if timestamp_ms is None:
+        timestamp_ms = time.time_ns() // 1000000
+    random_bits = int.from_bytes(os.urandom(10), 'big')
+    value = (timestamp_ms & 0xFFFFFFFFFFFF) << 80
+    value |= 0x7 << 76 | (random_bits >> 68) << 64
+    value |= 0b10 << 62 | random_bits & 0x3FFFFFFFFFFFFFFF
+    return uuid.UUID(int=value)
+
+
+def month_start(value):
+    value = value.astimezone(dt_timezone.utc)
+    return datetime(value.year, value.month, 1, tzinfo=dt_timezone.utc)
+
+
+def add_months(month, count):
+    index = month.year * 12 + month.month - 1 + count
+    return datetime(index // 12, index % 12 + 1, 1, tzinfo=dt_timezone.utc)
+
+
+def month_id_range(month):
+    """The [lower, upper) order_id bounds of every UUIDv7 created during month"""
+    def bound(moment):
+        return uuid.UUID(int=int(moment.timestamp() * 1000) << 80)
+    return bound(month), bound(add_months(month, 1))
+
+
+def partition_name(month):
+    return f'{ORDER_TABLE}_{month:%Y_%m}'
+
+
+def is_partitioned(connection=default_connection):
+    if connection.vendor != 'postgresql':
+        return False
+    with connection.cursor() as cursor:
+        cursor.execute(
+            "SELECT EXISTS (SELECT 1 FROM pg_partitioned_table WHERE partrelid = to_regclass(%s))",
+            [ORDER_TABLE]
+        )
+        return cursor.fetchone()[0]
+
+
+def order_partitions(connection=default_connection):
+    """Months that have their own partition, oldest first"""
+    with connection.cursor() as cursor:
+        cursor.execute(
+            "SELECT child.relname FROM pg_inherits "
+            "JOIN pg_class child ON child.oid = pg_inherits.inhrelid "
+            "WHERE pg_inherits.inhparent = to_regclass(%s)",
+            [ORDER_TABLE]
+        )
+        names = [row[0] for row in cursor.fetchall()]
+    matches = [PARTITION_NAME.match(name) for name in names]
+    return sorted(
+        datetime(int(match[1]), int(match[2]), 1, tzinfo=dt_timezone.utc) for match in matches if match
+    )
+
+
+def ensure_order_partitions(months_ahead=None, connection=default_connection):
+    """Create partitions for this month and the next few; returns the months created"""
+    if not is_partitioned(connection):
+        return []
+    if months_ahead is None:
+        months_ahead = settings.ORDER_PARTITION_MONTHS_AHEAD
+
+    existing = set(order_partitions(connection))
+    current = month_start(timezone.now())
+    created = []
+    with transaction.atomic(using=connection.alias), connection.cursor() as cursor:
+        for offset in range(months_ahead + 1):
+            month = add_months(current, offset)
+            if month in existing:
+                continue
+            lower, upper = month_id_range(month)
+            name = partition_name(month)
+            # A random legacy id can fall inside the range; Postgres refuses to create the
+            # partition while the default one holds such rows, so move them across.
+            # Foreign keys to orders are deferred, so removing them for a moment is fine.
+            cursor.execute(
+                f"CREATE TEMPORARY TABLE {name}_moved ON COMMIT DROP AS "
+                f"SELECT * FROM {DEFAULT_PARTITION} WHERE order_id >= %s AND order_id < %s",
+                [lower, upper]
+            )
+            cursor.execute(
+                f"DELETE FROM {DEFAULT_PARTITION} WHERE order_id >= %s AND order_id < %s",
+                [lower, upper]
+            )
+            cursor.execute(
+                f"CREATE TABLE {name} PARTITION OF {ORDER_TABLE} FOR VALUES FROM (%s) TO (%s)",
+                [lower, upper]
+            )
+            cursor.execute(f"INSERT INTO {ORDER_TABLE} SELECT * FROM {name}_moved")
+            created.append(month)
+    if created:
+        logger.info(f"Created order partitions for {', '.join(f'{month:%Y-%m}' for month in created)}")
+    return created
+
+
+def drop_order_partition(month, connection=default_connection):
+    """Detach and drop a month's partition; its items and history must already be gone"""
+    name = partition_name(month)
+    with connection.cursor() as cursor:
+        cursor.execute(f"ALTER TABLE {ORDER_TABLE} DETACH PARTITION {name}")
+        cursor.execute(f"DROP TABLE {name}")
+
+
+def partition_order_table(connection):
+    """Turn the existing orders table into the default partition of a partitioned one"""
+    quote = connection.ops.quote_name
+    with connection.cursor() as cursor:
+        # Foreign keys have to reference the new parent table, not the old one
+        cursor.execute(
+            "SELECT conrelid::regclass::text, conname, pg_get_constraintdef(oid) FROM pg_constraint "
+            "WHERE contype = 'f' AND confrelid = to_regclass(%s)",
+            [ORDER_TABLE]
+        )
+        incoming = cursor.fetchall()
+        cursor.execute(
+            "SELECT conname, pg_get_constraintdef(oid) FROM pg_constraint "
+            "WHERE contype = 'f' AND conrelid = to_regclass(%s)",
+            [ORDER_TABLE]
+        )
+        outgoing = cursor.fetchall()
+        cursor.execute(
+            "SELECT indexname, indexdef FROM pg_indexes WHERE tablename = %s AND indexname <> %s",
+            [ORDER_TABLE, f'{ORDER_TABLE}_pkey']
+        )
+        indexes = cursor.fetchall()
+
+        for table, name, _ in incoming:
+            cursor.execute(f"ALTER TABLE {table} DROP CONSTRAINT {quote(name)}")
+        cursor.execute(f"ALTER TABLE {ORDER_TABLE} RENAME TO {DEFAULT_PARTITION}")
+        cursor.execute(
+            f"ALTER TABLE {DEFAULT_PARTITION} RENAME CONSTRAINT {ORDER_TABLE}_pkey TO {DEFAULT_PARTITION}_pkey"
+        )
+        for name, _ in indexes:
+            cursor.execute(f"ALTER INDEX {quote(name)} RENAME TO {quote(f'{name[:55]}_default')}")
+
+        cursor.execute(
+            f"CREATE TABLE {ORDER_TABLE} (LIKE {DEFAULT_PARTITION} INCLUDING DEFAULTS INCLUDING CONSTRAINTS) "
+            f"PARTITION BY RANGE (order_id)"
+        )
+        cursor.execute(f"ALTER TABLE {ORDER_TABLE} ADD CONSTRAINT {ORDER_TABLE}_pkey PRIMARY KEY (order_id)")
+        for _, definition in indexes:
+            cursor.execute(definition)
+        for name, definition in outgoing:
+            cursor.execute(f"ALTER TABLE {ORDER_TABLE} ADD CONSTRAINT {quote(name)} {definition}")
+        # Matching indexes and constraints on the old table are adopted rather than rebuilt
+        cursor.execute(f"ALTER TABLE {ORDER_TABLE} ATTACH PARTITION {DEFAULT_PARTITION} DEFAULT")
+        for table, name, definition in incoming:
+            cursor.execute(f"ALTER TABLE {table} ADD CONSTRAINT {quote(name)} {definition}")
@@ -0,0 +1,48 @@
+from collections import namedtuple
+from decimal import Decimal
+from django.conf import settings
+from django.core import signing
+from api.models import Product
+
+
+QUOTE_SALT = 'api.pricing.quote'
+
+QuoteLine = namedtuple('QuoteLine', ['product_id', 'name', 'unit_price', 'quantity', 'line_total', 'in_stock'])
+Quote = namedtuple('Quote', ['lines', 'total', 'missing'])
+
+
+def build_quote(items):
+    """Price a cart of (product_id, quantity) pairs with a single product query"""
+    product_ids = {product_id for product_id, _ in items}
+    products = {
+        product_id: (name, price, stock)
+        for product_id, name, price, stock in Product.objects.filter(id__in=product_ids)
+        .values_list('id', 'name', 'price', 'stock')
+    }
+
+    lines = []
+    missing = []
+    # Stock still available to each product after the earlier lines in this cart
+    remaining = {product_id: product[2] for product_id, product in products.items()}
+    for product_id, quantity in items:
+        if product_id not in products:
+            missing.append(product_id)
+            continue
+        name, price, _ = products[product_id]
+        remaining[product_id] -= quantity
+        lines.append(QuoteLine(
+            product_id, name, price, quantity, price * quantity, remaining[product_id] >= 0
+        ))
+    return Quote(lines, sum((line.line_total for line in lines), Decimal('0.00')), missing)
+
+
+def sign_quote(quote):
+    """Token carrying the quoted prices, so checkout does not have to read them again"""
+    payload = [[line.product_id, line.quantity, str(line.unit_price)] for line in quote.lines]
+    return signing.dumps(payload, salt=QUOTE_SALT, compress=True)
+
+
+def load_quote(token):
+    """Return [(product_id, quantity, unit_price)] from a token, or raise signing.BadSignature"""
+    payload = signing.loads(token, salt=QUOTE_SALT, max_age=settings.QUOTE_TOKEN_MAX_AGE)
+    return [(product_id, quantity, Decimal(unit_price)) for product_id, quantity, unit_price in payload]
@@ -0,0 +1,220 @@
+import pickle
+import threading
+import time
+from collections import OrderedDict
+from django.conf import settings
+from django.core.cache import cache
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+MISSING = object()
+
+
+class LRUCache:
+    """Thread-safe in-process LRU bounded by entry count and approximate bytes, with a TTL"""
+
+    def __init__(self, max_entries, max_bytes, ttl):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key):
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None or entry[0] < time.monotonic():
+                if entry is not None:
+                    self._remove(key)
+                self.misses += 1
+                return MISSING
+            self._data.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def set(self, key, value, size=None):
+        if size is None:
+            size = len(pickle.dumps(value, pickle.HIGHEST_PROTOCOL))
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            if key in self._data:
+                self._remove(key)
+            self._data[key] = (time.monotonic() + self.ttl, value, size)
+            self.bytes += size
+            while len(self._data) > self.max_entries or self.bytes > self.max_bytes:
+                self._remove(next(iter(self._data)))
+                self.evictions += 1
+
+    def delete(self, key):
+        with self._lock:
+            if key in self._data:
+                self._remove(key)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+            self.bytes = 0
+
+    def _remove(self, key):
+        self.bytes -= self._data.pop(key)[2]
+
+    def __len__(self):
+        return len(self._data)
+
+
+class ChangeFeed:
+    """Ids written under a counter in the shared cache, for every process to replay.
+
+    Each write bumps the counter and records which id changed under the new
+    value. Readers keep the last value they saw and ask what was written since.
+    """
+
+    def __init__(self, name, ttl, max_gap):
+        self.name = name
+        self.generation_key = f'{name}_generation'
+        self.ttl = ttl
+        self.max_gap = max_gap
+
+    def record(self, ids):
+        ids = list(ids)
+        if not ids:
+            return
+        cache.add(self.generation_key, 0, timeout=None)
+        try:
+            # One increment reserves a change record for every id
+            last = cache.incr(self.generation_key, delta=len(ids))
+            first = last - len(ids) + 1
+            cache.set_many(
+                {self.change_key(first + offset): changed_id for offset, changed_id in enumerate(ids)},
+                timeout=self.ttl
+            )
+        except ValueError:
+            # The counter was evicted between add() and incr(); force every reader to resync
+            cache.set(self.generation_key, 0, timeout=None)
+
+    def changes_since(self, seen):
+        """(current generation, ids written after generation `seen`).
+
+        The ids are None when they cannot be told: too many writes, or change
+        records that expired or were lost with the counter. Nothing has changed
+        since a `seen` of None.
+        """
+        generation = cache.get(self.generation_key, 0)
+        if seen is None or generation == seen:
+            return generation, []
+        if generation < seen or generation - seen > self.max_gap:
+            return generation, None
+        keys = [self.change_key(number) for number in range(seen + 1, generation + 1)]
+        changes = cache.get_many(keys)
+        if len(changes) < len(keys):
+            return generation, None
+        return generation, list(changes.values())
+
+    def current_generation(self):
+        return cache.get(self.generation_key, 0)
+
+    def change_key(self, generation):
+        return f'{self.name}_change:{generation}'
+
+
+class ProductCache:
+    """Serialized products in a per-process LRU in front of the shared cache.
+
+    Writers bump a generation counter in the shared cache and record which
+    product changed under that generation. Each process reads the counter at
+    most once per SYNC_INTERVAL and evicts only the products that changed, so
+    other workers serve stale data for at most that long.
+
+    Writes that add, remove or rename products are also recorded in the
+    separate product_names feed, which stock changes do not touch.
+    """
+
+    def __init__(self, options=None):
+        options = options or settings.PRODUCT_CACHE
+        self.shared_ttl = options['SHARED_TTL']
+        self.sync_interval = options['SYNC_INTERVAL']
+        self.changes = ChangeFeed('product_cache', self.shared_ttl, options['MAX_SYNC_GAP'])
+        self.names = ChangeFeed('product_names', self.shared_ttl, options['MAX_SYNC_GAP'])
+        self.local = LRUCache(options['MAX_ENTRIES'], options['MAX_BYTES'], options['LOCAL_TTL'])
+        self.shared_hits = 0
+        self.shared_misses = 0
+        self._seen_generation = None
+        self._next_sync = 0
+
+    def get(self, product_id, loader):
+        """Return cached data for product_id, calling loader() on a miss in both tiers"""
+        self.sync()
+        value = self.local.get(product_id)
+        if value is not MISSING:
+            return value
+
+        value = cache.get(self.shared_key(product_id), MISSING)
+        if value is MISSING:
+            self.shared_misses += 1
+            generation = self.current_generation()
+            value = loader()
+            if self.current_generation() != generation:
+                # A write landed while loading; storing the value could undo its invalidation
+                return value
+            cache.set(self.shared_key(product_id), value, timeout=self.shared_ttl)
+        else:
+            self.shared_hits += 1
+        self.local.set(product_id, value)
+        return value
+
+    def invalidate(self, product_ids, names=False):
+        """Evict the products everywhere; names=True when they were created, deleted or renamed"""
+        product_ids = list(product_ids)
+        if not product_ids:
+            return
+        cache.delete_many([self.shared_key(product_id) for product_id in product_ids])
+        self.changes.record(product_ids)
+        if names:
+            self.names.record(product_ids)
+        for product_id in product_ids:
+            self.local.delete(product_id)
+
+    def sync(self, force=False):
+        now = time.monotonic()
+        if not force and now < self._next_sync:
+            return
+        self._next_sync = now + self.sync_interval
+
+        self._seen_generation, changed = self.changes_since(self._seen_generation)
+        if changed is None:
+            self.local.clear()
+            return
+        for product_id in changed:
+            self.local.delete(product_id)
+
+    def changes_since(self, seen):
+        """(current generation, ids of the products written after generation `seen`); see ChangeFeed"""
+        return self.changes.changes_since(seen)
+
+    def current_generation(self):
+        """Counter that changes with every product write, for keying derived caches"""
+        return self.changes.current_generation()
+
+    def stats(self):
+        return {
+            'local_hits': self.local.hits,
+            'local_misses': self.local.misses,
+            'local_evictions': self.local.evictions,
+            'local_entries': len(self.local),
+            'local_bytes': self.local.bytes,
+            'shared_hits': self.shared_hits,
+            'shared_misses': self.shared_misses,
+        }
+
+    def shared_key(self, product_id):
+        return f'product:{product_id}'
+
+
+product_cache = ProductCache()
@@ -0,0 +1,121 @@
+import cProfile
+import io
+import marshal
+import pstats
+import random
+import threading
+import time
+import uuid
+from collections import deque
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.utils import timezone
+from rest_framework.exceptions import AuthenticationFailed
+from rest_framework_simplejwt.authentication import JWTAuthentication
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+class ProfileBuffer:
+    """The most recent captured profiles, oldest dropped first"""
+
+    def __init__(self, size):
+        self._profiles = deque(maxlen=size)
+        self._lock = threading.Lock()
+
+    def add(self, profile):
+        with self._lock:
+            self._profiles.append(profile)
+
+    def get(self, profile_id):
+        with self._lock:
+            return next((profile for profile in self._profiles if profile['id'] == profile_id), None)
+
+    def list(self):
+        with self._lock:
+            return [
+                {key: value for key, value in profile.items() if key not in ('stats', 'text')}
+                for profile in reversed(self._profiles)
+            ]
+
+    def clear(self):
+        with self._lock:
+            self._profiles.clear()
+
+
+profile_buffer = ProfileBuffer(settings.PROFILING['BUFFER_SIZE'])
+
+
+class ProfilingMiddleware:
+    """Runs the view under cProfile when asked to by a staff user's header, or for a sample of requests.
+
+    Must be the last middleware so that it only wraps the view. When PROFILING
+    is disabled Django drops it from the stack entirely.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        options = settings.PROFILING
+        if not options['ENABLED']:
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+        self.header = options['HEADER']
+        self.sample_rate = options['SAMPLE_RATE']
+        self.routes = set(options['ROUTES'])
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        # Under ASGI this returns the coroutine for the caller to await
+        return self.get_response(request)
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        # runcall() would only time the creation of an async view's coroutine
+        if iscoroutinefunction(view_func):
+            return None
+        route = request.resolver_match.url_name
+        sampled = route in self.routes and random.random() < self.sample_rate
+        requested = not sampled and self.header in request.headers and self._is_staff(request)
+        if not requested and not sampled:
+            return None
+
+        profiler = cProfile.Profile()
+        start = time.perf_counter()
+        response = profiler.runcall(view_func, request, *view_args, **view_kwargs)
+        duration = time.perf_counter() - start
+
+        profiler.create_stats()
+        # Serialize first: pstats.Stats takes the stats away from the profiler
+        stats = marshal.dumps(profiler.stats)
+        text = io.StringIO()
+        pstats.Stats(profiler, stream=text).sort_stats('cumulative').print_stats(50)
+        profile_id = uuid.uuid4().hex
+        profile_buffer.add({
+            'id': profile_id,
+            'method': request.method,
+            'path': request.path,
+            'route': route,
+            'status': getattr(response, 'status_code', None),
+            'duration_ms': round(duration * 1000, 3),
+            'trigger': 'header' if requested else 'sample',
+            'captured_at': timezone.now(),
+            'stats': stats,
+            'text': text.getvalue(),
+        })
+        logger.info(f"Captured profile {profile_id} for {request.method} {request.path} ({duration * 1000:.1f}ms)")
+        response['X-Profile-Id'] = profile_id
+        return response
+
+    def _is_staff(self, request):
+        """Authenticate the request up front, as DRF would inside the view, so only staff can trigger profiling"""
+        user = getattr(request, 'user', None)
+        if user is None or not user.is_authenticated:
+            try:
+                authenticated = JWTAuthentication().authenticate(request)
+            except AuthenticationFailed:
+                return False
+            user = authenticated[0] if authenticated else None
+        return user is not None and user.is_staff
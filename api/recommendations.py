@@ -0,0 +1,114 @@
+import heapq
+from collections import defaultdict
+from django.conf import settings
+from django.db import connection, transaction
+from django.db.models import Count, F, Max, Min, Q
+from api.models import Order, OrderItem, Product, RelatedProduct
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+# Orders whose items count as bought together
+COUNTED_ORDER_STATUSES = [
+    Order.StatusChoices.CONFIRMED,
+    Order.StatusChoices.PROCESSING,
+    Order.StatusChoices.SHIPPED,
+    Order.StatusChoices.DELIVERED,
+]
+
+
+def cooccurrence_counts(**filters):
+    """Rows of the product co-occurrence matrix for the products matching filters.
+
+    {product_id: {other_id: counted orders containing both}}, from one grouped
+    self-join of OrderItem. Only pairs that occur are returned, so the matrix
+    stays sparse.
+    """
+    counted = Q(order__status__in=COUNTED_ORDER_STATUSES)
+    pairs = (
+        OrderItem.objects.filter(**filters)
+        .annotate(other_id=F('order__items__product_id'))
+        .exclude(other_id=F('product_id'))
+        .values('product_id', 'other_id')
+        # Status is checked in the aggregate rather than the WHERE clause so the product
+        # lookup, not the (status, created_at) index, picks the rows to join
+        .annotate(score=Count('order_id', distinct=True, filter=counted))
+        .filter(score__gt=0)
+        .values_list('product_id', 'other_id', 'score')
+    )
+    counts = defaultdict(dict)
+    for product_id, other_id, score in pairs.iterator(chunk_size=settings.RELATED_PRODUCTS['CHUNK_SIZE'] * 10):
+        counts[product_id][other_id] = score
+    return counts
+
+
+def top_neighbours(row, k):
+    """The k highest (other_id, score) pairs of a matrix row, ties going to the lower id"""
+    return heapq.nlargest(k, row.items(), key=lambda pair: (pair[1], -pair[0]))
+
+
+def refresh_related(**filters):
+    """Recompute and replace the stored neighbours of the products matching filters (product_id lookups)"""
+    top_k = settings.RELATED_PRODUCTS['TOP_K']
+    counts = cooccurrence_counts(**filters)
+    rows = [
+        (product_id, other_id, rank, score)
+        for product_id, row in counts.items()
+        for rank, (other_id, score) in enumerate(top_neighbours(row, top_k))
+    ]
+    with transaction.atomic():
+        # Concurrent refreshes of the same products would both insert ranks 0..k and break
+        # related_product_rank_unique; locking the products in id order runs them one at a time
+        list(
+            Product.objects.select_for_update()
+            .filter(**{'id' + lookup[len('product_id'):]: value for lookup, value in filters.items()})
+            .order_by('id')
+            .values_list('id', flat=True)
+        )
+        RelatedProduct.objects.filter(**filters).delete()
+        insert_neighbours(rows)
+    return len(counts)
+
+
+def insert_neighbours(rows):
+    """INSERT (product_id, related_id, rank, score) rows as plain tuples.
+
+    A full build writes TOP_K rows per product; building that many model
+    instances for bulk_create() took longer than computing them.
+    """
+    quote = connection.ops.quote_name
+    columns = ', '.join(quote(RelatedProduct._meta.get_field(name).column) for name in ('product', 'related', 'rank', 'score'))
+    sql = f'INSERT INTO {quote(RelatedProduct._meta.db_table)} ({columns}) VALUES (%s, %s, %s, %s)'
+    with connection.cursor() as cursor:
+        for start in range(0, len(rows), 10000):
+            cursor.executemany(sql, rows[start:start + 10000])
+
+
+def rebuild_related_products(chunk_size=None):
+    """Rebuild every product's neighbours, one product id range at a time"""
+    chunk_size = chunk_size or settings.RELATED_PRODUCTS['CHUNK_SIZE']
+    bounds = Product.objects.aggregate(low=Min('id'), high=Max('id'))
+    if bounds['low'] is None:
+        return 0
+    # Rows of products deleted since the last build went with them (on_delete=CASCADE)
+    refreshed = 0
+    for start in range(bounds['low'], bounds['high'] + 1, chunk_size):
+        refreshed += refresh_related(product_id__gte=start, product_id__lt=start + chunk_size)
+    logger.info(f"Rebuilt related products for {refreshed} products")
+    return refreshed
+
+
+def update_related_products(order_ids):
+    """Bring the neighbours of every product in these newly counted orders up to date.
+
+    Affected rows are recomputed from the order history rather than
+    incremented, so an order that is counted twice changes nothing.
+    """
+    product_ids = sorted(set(
+        OrderItem.objects.filter(order_id__in=order_ids).values_list('product_id', flat=True)
+    ))
+    chunk_size = settings.RELATED_PRODUCTS['CHUNK_SIZE']
+    for start in range(0, len(product_ids), chunk_size):
+        refresh_related(product_id__in=product_ids[start:start + chunk_size])
+    return len(product_ids)
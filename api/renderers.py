@@ -0,0 +1,114 @@
+import orjson
+from django.conf import settings
+from django.http import StreamingHttpResponse
+from django.utils.cache import patch_vary_headers
+from rest_framework.renderers import BrowsableAPIRenderer, JSONRenderer
+from rest_framework.utils.encoders import JSONEncoder
+
+# orjson handles str/int/float/list/dict/UUID natively and hands everything else,
+# including datetimes, to DRF's encoder so the output matches JSONRenderer's
+_fallback = JSONEncoder()
+_OPTIONS = orjson.OPT_PASSTHROUGH_DATETIME
+
+
+def dumps(data):
+    """Compact UTF-8 JSON, byte-for-byte what JSONRenderer produces with the default settings"""
+    content = orjson.dumps(data, default=_fallback.default, option=_OPTIONS)
+    # JSONRenderer escapes these so the output stays a strict JavaScript subset
+    if b'\xe2\x80' in content:
+        content = content.replace(b'\xe2\x80\xa8', b'\\u2028').replace(b'\xe2\x80\xa9', b'\\u2029')
+    return content
+
+
+class FastJSONRenderer(JSONRenderer):
+    """JSONRenderer on top of orjson.
+
+    Indented output (the browsable API, `; indent=` media types), non-default
+    COMPACT_JSON/UNICODE_JSON settings, and data orjson rejects (integers over
+    64 bits, non-string keys) fall back to JSONRenderer. Floats are the one
+    known difference: orjson writes NaN and infinity as null and 1e16 as
+    `1e16` rather than `1e+16`.
+    """
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if data is None:
+            return b''
+        indent = self.get_indent(accepted_media_type, renderer_context or {})
+        if indent is None and self.compact and not self.ensure_ascii:
+            try:
+                return dumps(data)
+            except orjson.JSONEncodeError:
+                pass
+        return super().render(data, accepted_media_type, renderer_context)
+
+
+# Renderers for the views that opt in to orjson, e.g. `renderer_classes = FAST_RENDERER_CLASSES`
+FAST_RENDERER_CLASSES = [FastJSONRenderer, BrowsableAPIRenderer]
+
+
+class StreamedList:
+    """A list value rendered a chunk at a time, e.g. from queryset.iterator().
+
+    serialize turns a list of items into a list of representations, typically
+    `lambda batch: Serializer(batch, many=True).data`. count is the number of
+    items written so far.
+    """
+
+    def __init__(self, iterable, serialize, chunk_size=None):
+        self.iterable = iterable
+        self.serialize = serialize
+        self.chunk_size = chunk_size or settings.STREAMING_JSON['CHUNK_SIZE']
+        self.count = 0
+
+    def chunks(self):
+        batch = []
+        for item in self.iterable:
+            batch.append(item)
+            if len(batch) == self.chunk_size:
+                yield self._render(batch)
+                batch = []
+        if batch:
+            yield self._render(batch)
+
+    def _render(self, batch):
+        self.count += len(batch)
+        # Strip the brackets; stream_json() writes them once around all chunks
+        return dumps(self.serialize(batch))[1:-1]
+
+
+def stream_json(data):
+    """Yield `data` as JSON, streaming StreamedList values and calling callables when their key is reached.
+
+    The bytes match dumps() of the same object with the lists materialized, so
+    values that depend on a list (e.g. its count) can follow it.
+    """
+    yield b'{'
+    for index, (key, value) in enumerate(data.items()):
+        prefix = (b',' if index else b'') + dumps(key) + b':'
+        if isinstance(value, StreamedList):
+            yield prefix + b'['
+            separator = b''
+            for chunk in value.chunks():
+                yield separator + chunk
+                separator = b','
+            yield b']'
+        else:
+            yield prefix + dumps(value() if callable(value) else value)
+    yield b'}'
+
+
+def streams_json(request):
+    """Whether a response to this request may be streamed instead of rendered in memory"""
+    renderer = getattr(request, 'accepted_renderer', None)
+    if not settings.STREAMING_JSON['ENABLED'] or not isinstance(renderer, JSONRenderer):
+        return False
+    # Streamed output is always compact and unescaped, like FastJSONRenderer's fast path
+    return renderer.compact and not renderer.ensure_ascii and \
+        renderer.get_indent(request.accepted_media_type, {}) is None
+
+
+def streaming_json_response(data, status=200):
+    response = StreamingHttpResponse(stream_json(data), status=status, content_type='application/json')
+    # Whether the body streams depends on the negotiated renderer, so caches must key on Accept
+    patch_vary_headers(response, ['Accept'])
+    return response
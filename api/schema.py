@@ -0,0 +1,78 @@
+import hashlib
+import threading
+import yaml
+from django.conf import settings
+from django.http import HttpResponse, HttpResponseNotModified
+from django.utils.http import parse_etags, quote_etag
+from drf_spectacular.renderers import OpenApiYamlRenderer
+from drf_spectacular.settings import spectacular_settings
+from drf_spectacular.views import SpectacularAPIView
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+def generate_schema():
+    """Introspect every view and serializer, like `manage.py spectacular` does"""
+    generator = spectacular_settings.DEFAULT_GENERATOR_CLASS(urlconf=None, api_version=None)
+    return generator.get_schema(request=None, public=True)
+
+
+def render_schema_yaml(schema):
+    return OpenApiYamlRenderer().render(schema, renderer_context={})
+
+
+class SchemaCache:
+    """Holds the schema and its rendered forms for the lifetime of the process"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._schema = None
+        self._rendered = {}
+
+    def get_schema(self):
+        if self._schema is None:
+            with self._lock:
+                if self._schema is None:
+                    self._schema = self._load()
+        return self._schema
+
+    def _load(self):
+        schema_file = settings.API_SCHEMA_FILE
+        if settings.API_SCHEMA_PRECOMPILED and schema_file.exists():
+            logger.info(f"Loading precompiled API schema from {schema_file}")
+            with open(schema_file, 'rb') as f:
+                return yaml.safe_load(f)
+        logger.info("Generating API schema")
+        return generate_schema()
+
+    def get_rendered(self, renderer):
+        """Return (content, etag) for the renderer's format, rendering it at most once"""
+        key = renderer.media_type
+        if key not in self._rendered:
+            content = renderer.render(self.get_schema(), renderer_context={})
+            etag = quote_etag(hashlib.sha256(content).hexdigest())
+            self._rendered[key] = (content, etag)
+        return self._rendered[key]
+
+    def clear(self):
+        with self._lock:
+            self._schema = None
+            self._rendered = {}
+
+
+schema_cache = SchemaCache()
+
+
+class CachedSpectacularAPIView(SpectacularAPIView):
+    """Serves the schema from `schema_cache` with an ETag so pollers get 304s"""
+
+    def _get_schema_response(self, request):
+        content, etag = schema_cache.get_rendered(request.accepted_renderer)
+        if etag in parse_etags(request.headers.get('If-None-Match', '')):
+            response = HttpResponseNotModified()
+        else:
+            response = HttpResponse(content, content_type=request.accepted_media_type)
+            response['Content-Disposition'] = f'inline; filename="{self._get_filename(request, None)}"'
+        response['ETag'] = etag
+        return response
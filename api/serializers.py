@@ -1,8 +1,41 @@
+from collections import Counter
+from django.core import signing
+from django.core.exceptions import ValidationError as DjangoValidationError
+from django.db import models, transaction
+from django.db.models import prefetch_related_objects
 from rest_framework import serializers
-from .models import Product, Order, OrderItem
+from .models import Product, Order, OrderItem, RelatedProduct
+from .model_validators import BusinessLogicValidator
+from .inventory import hold_expiry, reserve_stock
+from .pricing import load_quote
+from .fieldsets import SparseFieldsetMixin
+from .cache_batch import cache_batch
+from .product_cache import product_cache
 
 
-class ProductSerializer(serializers.ModelSerializer):
+def _instances(data):
+    return list(data.all() if isinstance(data, models.manager.BaseManager) else data)
+
+
+class ProductListSerializer(serializers.ListSerializer):
+    """Renders a page of products from the shared product cache: one get_many, plus one set_many for the misses"""
+
+    def to_representation(self, data):
+        products = _instances(data)
+        if self.child.restricted:
+            # The cache holds full representations only
+            return super().to_representation(products)
+        by_key = {product_cache.shared_key(product.pk): product for product in products}
+        cached = cache_batch(self.context).get_or_load_many(
+            by_key,
+            lambda keys: {key: self.child.to_representation(by_key[key]) for key in keys},
+            timeout=product_cache.shared_ttl,
+            generation=product_cache.current_generation
+        )
+        return [cached[product_cache.shared_key(product.pk)] for product in products]
+
+
+class ProductSerializer(SparseFieldsetMixin, serializers.ModelSerializer):
     class Meta:
         model = Product
         fields = (
@@ -11,6 +44,7 @@ class ProductSerializer(serializers.ModelSerializer):
             'price',
             'stock',
         )
+        list_serializer_class = ProductListSerializer
 
     def validate_price(self, value):
         if value <= 0:
@@ -20,7 +54,111 @@ class ProductSerializer(serializers.ModelSerializer):
         return value
     
 
-class OrderItemSerializer(serializers.ModelSerializer):
+class RelatedProductSerializer(serializers.ModelSerializer):
+    id = serializers.IntegerField(source='related_id')
+    name = serializers.CharField(source='related.name')
+    price = serializers.DecimalField(max_digits=10, decimal_places=2, source='related.price')
+    in_stock = serializers.BooleanField(source='related.in_stock')
+
+    class Meta:
+        model = RelatedProduct
+        fields = (
+            'id',
+            'name',
+            'price',
+            'in_stock',
+            'score',
+        )
+
+
+class ProductAutocompleteSerializer(serializers.Serializer):
+    id = serializers.IntegerField()
+    name = serializers.CharField()
+
+
+class ProductBatchItemSerializer(ProductSerializer):
+    id = serializers.IntegerField(read_only=True)
+
+    class Meta(ProductSerializer.Meta):
+        fields = ('id',) + ProductSerializer.Meta.fields
+
+
+class ProductBatchSerializer(serializers.Serializer):
+    ids = serializers.ListField(
+        child=serializers.IntegerField(min_value=1),
+        allow_empty=False,
+        max_length=100,
+        write_only=True
+    )
+    results = ProductBatchItemSerializer(many=True, read_only=True)
+    missing = serializers.ListField(child=serializers.IntegerField(), read_only=True)
+
+
+# Order item fields that read the item's product
+PRODUCT_ITEM_FIELDS = {'product_name', 'product_price', 'item_subtotal'}
+
+
+def cached_products(product_ids, context):
+    """{product id: full representation} of the products that exist, loading the cache misses with one query"""
+    keys = {product_cache.shared_key(product_id): product_id for product_id in product_ids}
+
+    def load(missing):
+        products = Product.objects.in_bulk([keys[key] for key in missing])
+        serializer = ProductSerializer()
+        return {product_cache.shared_key(pk): serializer.to_representation(product) for pk, product in products.items()}
+
+    cached = cache_batch(context).get_or_load_many(
+        keys, load, timeout=product_cache.shared_ttl, generation=product_cache.current_generation
+    )
+    return {keys[key]: data for key, data in cached.items()}
+
+
+def attach_cached_products(items, context):
+    """Set each order item's product from the shared product cache, loading the misses with one query.
+
+    The products are built from their cached representation, so fields the
+    representation lacks are deferred and load on access as usual.
+    """
+    items = [item for item in items if not OrderItem.product.is_cached(item)]
+    if not items:
+        return
+    cached = cached_products([item.product_id for item in items], context)
+    fields = [
+        field for field in Product._meta.concrete_fields
+        if field.primary_key or field.attname in ProductSerializer.Meta.fields
+    ]
+    products = {}
+    for item in items:
+        product = products.get(item.product_id)
+        if product is None:
+            data = cached.get(item.product_id)
+            if data is None:
+                continue
+            values = [item.product_id if field.primary_key else field.to_python(data[field.attname]) for field in fields]
+            # Shared between the items of a page, as prefetch_related() would
+            product = products[item.product_id] = Product.from_db(item._state.db, [field.attname for field in fields], values)
+        OrderItem.product.field.set_cached_value(item, product)
+
+
+class OrderItemListSerializer(serializers.ListSerializer):
+    def to_representation(self, data):
+        items = _instances(data)
+        if PRODUCT_ITEM_FIELDS & set(self.child.fields):
+            attach_cached_products(items, self.context)
+        return super().to_representation(items)
+
+
+class OrderListSerializer(serializers.ListSerializer):
+    def to_representation(self, data):
+        orders = _instances(data)
+        if self.child.reads_products():
+            # Look up the products of the whole page at once rather than per order
+            prefetch_related_objects(orders, 'items')
+            attach_cached_products([item for order in orders for item in order.items.all()], self.context)
+        return super().to_representation(orders)
+
+
+class OrderItemSerializer(SparseFieldsetMixin, serializers.ModelSerializer):
     product_name = serializers.CharField(source='product.name')
     product_price = serializers.DecimalField(
         max_digits=10,
@@ -35,16 +173,82 @@ class OrderItemSerializer(serializers.ModelSerializer):
             'quantity',
             'item_subtotal'
         )
+        list_serializer_class = OrderItemListSerializer
 
 
-class OrderSerializer(serializers.ModelSerializer):
+class OrderSerializer(SparseFieldsetMixin, serializers.ModelSerializer):
     items = OrderItemSerializer(many=True, read_only=True)
     total_price = serializers.SerializerMethodField(method_name='total')
+    quote_token = serializers.CharField(write_only=True, required=False)
 
     def total(self, obj):
         order_items = obj.items.all()
         return sum(order_item.item_subtotal for order_item in order_items)
 
+    def validate_status(self, value):
+        if self.instance is None:
+            # Orders move on from Pending through transitions that take or release their stock
+            if value != Order.StatusChoices.PENDING:
+                raise serializers.ValidationError("New orders start as Pending.")
+        elif value != self.instance.status:
+            try:
+                BusinessLogicValidator.validate_order_status_transition(self.instance.status, value)
+            except DjangoValidationError as e:
+                raise serializers.ValidationError(e.messages)
+        return value
+
+    def validate_quote_token(self, value):
+        try:
+            return load_quote(value)
+        except signing.SignatureExpired:
+            raise serializers.ValidationError("Quote has expired, please request a new one.")
+        except signing.BadSignature:
+            raise serializers.ValidationError("Invalid quote token.")
+
+    @transaction.atomic
+    def create(self, validated_data):
+        quote_lines = validated_data.pop('quote_token', None)
+        # Stock taken for a new, pending order goes back if it is not confirmed in time
+        validated_data['expires_at'] = hold_expiry()
+        order = super().create(validated_data)
+        if quote_lines:
+            # Prices come from the signed quote; only stock has to be touched
+            quantities = Counter()
+            for product_id, quantity, _ in quote_lines:
+                quantities[product_id] += quantity
+            try:
+                reserve_stock(quantities)
+            except DjangoValidationError as e:
+                raise serializers.ValidationError({'quote_token': e.messages})
+            OrderItem.objects.bulk_create([
+                OrderItem(order=order, product_id=product_id, quantity=quantity, unit_price=unit_price)
+                for product_id, quantity, unit_price in quote_lines
+            ])
+        return order
+
+    def update(self, instance, validated_data):
+        validated_data.pop('quote_token', None)
+        return super().update(instance, validated_data)
+
+    def reads_products(self):
+        if 'total_price' in self.fields:
+            return True
+        return 'items' in self.fields and bool(PRODUCT_ITEM_FIELDS & set(self.fields['items'].child.fields))
+
+    def restrict_queryset(self, queryset):
+        """Load only the selected columns, and items only when a field reads them"""
+        queryset = super().restrict_queryset(queryset)
+        if 'items' in self.fields or 'total_price' in self.fields:
+            # Their products come from the product cache when the orders are rendered
+            return queryset.prefetch_related('items')
+        return queryset
+
+    def to_representation(self, instance):
+        if self.reads_products():
+            prefetch_related_objects([instance], 'items')
+            attach_cached_products(instance.items.all(), self.context)
+        return super().to_representation(instance)
+
     class Meta:
         model = Order
         fields = (
@@ -52,9 +256,122 @@ class OrderSerializer(serializers.ModelSerializer):
             'created_at',
             'user',
             'status',
+            'expires_at',
             'items',
             'total_price',
+            'quote_token',
         )
+        # The owner always comes from the authenticated request
+        read_only_fields = ('user', 'expires_at')
+        list_serializer_class = OrderListSerializer
+
+
+class OrderItemOperationSerializer(serializers.Serializer):
+    op = serializers.ChoiceField(choices=['add', 'update', 'remove'])
+    id = serializers.IntegerField(min_value=1, required=False)
+    product_id = serializers.IntegerField(min_value=1, required=False)
+    quantity = serializers.IntegerField(min_value=1, required=False)
+
+    REQUIRED_FIELDS = {
+        'add': ('product_id', 'quantity'),
+        'update': ('id', 'quantity'),
+        'remove': ('id',),
+    }
+
+    def validate(self, attrs):
+        missing = [field for field in self.REQUIRED_FIELDS[attrs['op']] if field not in attrs]
+        if missing:
+            raise serializers.ValidationError(
+                {field: f"This field is required for '{attrs['op']}'." for field in missing}
+            )
+        return attrs
+
+
+class OrderItemBatchSerializer(serializers.Serializer):
+    operations = OrderItemOperationSerializer(many=True, allow_empty=False, max_length=1000)
+
+    def validate_operations(self, value):
+        item_ids = [operation['id'] for operation in value if operation['op'] != 'add']
+        if len(item_ids) != len(set(item_ids)):
+            raise serializers.ValidationError("Each item can only be changed once per batch.")
+        return value
+
+    @transaction.atomic
+    def update(self, instance, validated_data):
+        """Apply every operation to the order's items, adjusting stock by the net change per product"""
+        operations = validated_data['operations']
+        order_status = Order.objects.select_for_update().values_list('status', flat=True).get(pk=instance.pk)
+        if order_status != Order.StatusChoices.PENDING:
+            raise serializers.ValidationError("Only pending orders can be edited.")
+
+        items = OrderItem.objects.select_for_update().in_bulk(
+            [operation['id'] for operation in operations if operation['op'] != 'add']
+        )
+        unknown = [
+            str(operation['id']) for operation in operations
+            if operation['op'] != 'add' and (operation['id'] not in items or items[operation['id']].order_id != instance.pk)
+        ]
+        if unknown:
+            raise serializers.ValidationError({'operations': f"Items not in this order: {', '.join(unknown)}"})
+        prices = dict(Product.objects.filter(
+            id__in={operation['product_id'] for operation in operations if operation['op'] == 'add'}
+        ).values_list('id', 'price'))
+
+        quantities = Counter()
+        added, changed, removed = [], [], []
+        for operation in operations:
+            if operation['op'] == 'add':
+                if operation['product_id'] not in prices:
+                    raise serializers.ValidationError(
+                        {'operations': f"Product {operation['product_id']} does not exist."}
+                    )
+                added.append(OrderItem(
+                    order=instance,
+                    product_id=operation['product_id'],
+                    quantity=operation['quantity'],
+                    unit_price=prices[operation['product_id']]
+                ))
+                quantities[operation['product_id']] += operation['quantity']
+                continue
+            item = items[operation['id']]
+            if operation['op'] == 'update':
+                quantities[item.product_id] += operation['quantity'] - item.quantity
+                item.quantity = operation['quantity']
+                changed.append(item)
+            else:
+                quantities[item.product_id] -= item.quantity
+                removed.append(item.id)
+
+        stock_changes = {product_id: quantity for product_id, quantity in quantities.items() if quantity}
+        if stock_changes:
+            try:
+                reserve_stock(stock_changes)
+            except DjangoValidationError as e:
+                raise serializers.ValidationError({'operations': e.messages})
+        OrderItem.objects.bulk_create(added)
+        OrderItem.objects.bulk_update(changed, ['quantity'])
+        OrderItem.objects.filter(id__in=removed).delete()
+        return instance
+
+
+class OrderBulkStatusSerializer(serializers.Serializer):
+    order_ids = serializers.ListField(
+        child=serializers.UUIDField(),
+        allow_empty=False,
+        max_length=10000
+    )
+    status = serializers.ChoiceField(choices=Order.StatusChoices.choices)
+    reason = serializers.CharField(required=False, allow_blank=True, default='')
+
+
+class QuoteItemSerializer(serializers.Serializer):
+    product_id = serializers.IntegerField(min_value=1)
+    quantity = serializers.IntegerField(min_value=1)
+
+
+class QuoteRequestSerializer(serializers.Serializer):
+    items = QuoteItemSerializer(many=True, allow_empty=False, max_length=1000)
+    sign = serializers.BooleanField(default=True)
 
 
 class ProductInfoSerializer(serializers.Serializer):
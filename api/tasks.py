@@ -0,0 +1,107 @@
+from celery import shared_task
+from django.core.mail import send_mail, send_mass_mail
+from django.conf import settings
+from django.db.models import F
+from django.utils import timezone
+from .models import Order, Product
+from .partitions import ensure_order_partitions
+from . import order_status, recommendations
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+ORDER_STATUS_MESSAGES = {
+    Order.StatusChoices.CONFIRMED: 'Your order has been confirmed and is being processed.',
+    Order.StatusChoices.SHIPPED: 'Your order has been shipped and is on its way.',
+    Order.StatusChoices.DELIVERED: 'Your order has been delivered successfully.',
+    Order.StatusChoices.CANCELLED: 'Your order has been cancelled.',
+}
+
+
+@shared_task
+def send_order_status_notifications(order_ids, new_status):
+    """Email customers about a status change, one SMTP connection per batch"""
+    if new_status not in ORDER_STATUS_MESSAGES:
+        return 0
+
+    recipients = Order.objects.filter(order_id__in=order_ids).values_list('order_id', 'user__email')
+    messages = [
+        (
+            f'Order {order_id} Status Update',
+            f'Your order status has been updated to: {new_status}\n\n{ORDER_STATUS_MESSAGES[new_status]}',
+            settings.DEFAULT_FROM_EMAIL,
+            [email],
+        )
+        for order_id, email in recipients
+        if email
+    ]
+    try:
+        return send_mass_mail(messages, fail_silently=True)
+    except Exception as e:
+        logger.error(f"Failed to send order status emails: {e}")
+        return 0
+
+
+@shared_task(bind=True, max_retries=3, default_retry_delay=60)
+def scan_low_stock(self, limit=500):
+    """Email admins one digest of products that newly dropped to their low-stock threshold"""
+    # Products that were restocked can alert again the next time they run low
+    Product.objects.filter(
+        low_stock_alerted_at__isnull=False,
+        stock__gt=F('low_stock_threshold')
+    ).update(low_stock_alerted_at=None)
+
+    products = list(
+        Product.objects.filter(stock__lte=F('low_stock_threshold'), low_stock_alerted_at__isnull=True)
+        .order_by('stock')
+        .values_list('id', 'name', 'stock')[:limit]
+    )
+    if not products:
+        return 0
+
+    lines = [f'- {name}: {stock} left' for _, name, stock in products]
+    try:
+        sent = send_mail(
+            'Low Stock Alert',
+            f'{len(products)} products are running low on stock:\n\n' + '\n'.join(lines),
+            settings.DEFAULT_FROM_EMAIL,
+            [settings.ADMINS[0][1] if settings.ADMINS else 'admin@example.com'],
+        )
+    except Exception as e:
+        logger.error(f"Failed to send low stock digest: {e}")
+        raise self.retry(exc=e)
+    if not sent:
+        # Stamping unsent products would silence their alert for good; the retry sends them again
+        logger.error("Low stock digest was not sent")
+        raise self.retry()
+
+    Product.objects.filter(id__in=[product_id for product_id, _, _ in products]).update(
+        low_stock_alerted_at=timezone.now()
+    )
+    logger.warning(f"Low stock digest sent for {len(products)} products")
+    return len(products)
+
+
+@shared_task
+def create_order_partitions():
+    """Keep monthly order partitions created ahead of the orders that will land in them"""
+    return len(ensure_order_partitions())
+
+
+@shared_task
+def update_related_products(order_ids):
+    """Fold newly confirmed orders into their products' "bought together" neighbours"""
+    return recommendations.update_related_products(order_ids)
+
+
+@shared_task
+def rebuild_related_products():
+    """Recompute every product's "bought together" neighbours from the full order history"""
+    return recommendations.rebuild_related_products()
+
+
+@shared_task
+def release_expired_holds():
+    """Cancel pending orders whose stock hold ran out, releasing their stock"""
+    return order_status.release_expired_holds()
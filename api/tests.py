@@ -1,14 +1,65 @@
-from django.test import TestCase
-from django.urls import reverse
+from django.test import LiveServerTestCase, RequestFactory, TestCase
+from django.urls import resolve, reverse
 from django.core.cache import cache
+from django.test import override_settings
+from django.conf import settings
+from django.test.utils import CaptureQueriesContext
+from django.db import connection
+from django.core import mail
+from django.core.management import call_command
 from rest_framework import status
-from rest_framework.test import APITestCase
+from rest_framework.test import APITestCase, APITransactionTestCase, APIClient
+from rest_framework_simplejwt.tokens import RefreshToken
 from django.contrib.auth import get_user_model
 from decimal import Decimal
+import gzip
 import json
+import marshal
+import shutil
+import tempfile
+from datetime import datetime, timezone as dt_timezone
+from pathlib import Path
+import threading
+import time
+from unittest import mock
+from celery.exceptions import Retry
+from io import StringIO
 
-from api.models import Order, User, Product, OrderItem
+from api.models import Order, User, Product, OrderItem, OrderHistory, RelatedProduct, StockMovement
 from api.auth_serializers import UserRegistrationSerializer
+from api.tasks import send_order_status_notifications, scan_low_stock, release_expired_holds as release_expired_holds_task
+from api.schema import schema_cache
+from api.pricing import build_quote
+from api.views import OrderCreateAPIView
+from api.tokens import TokenService, email_verification_tokens
+from api.product_cache import LRUCache, MISSING, ProductCache, product_cache
+from api.order_cache import get_user_order_pages, version_key
+from api.cache_batch import CacheBatch
+from api.partitions import month_id_range, uuid7
+from api.loadtest import run_worker, summarize
+from api.management.commands.loadtest import Command as LoadTestCommand
+from api.profiling import ProfileBuffer, ProfilingMiddleware, profile_buffer
+from api.events import order_event_hub, publish_order_events
+from api.order_status import release_expired_holds, transition_orders
+from api.inventory import reconcile_range, record_stock_movements, reserve_stock
+from api.recommendations import rebuild_related_products, update_related_products
+from api.autocomplete import autocomplete_index, one_edit_apart
+from api.renderers import FastJSONRenderer, streaming_json_response
+from api.metrics import MetricsMiddleware, MetricsRegistry, registry as metrics_registry
+from api.cache_backends import InstrumentedLocMemCache, ResilientRedisCache
+import os
+import socket
+import subprocess
+import sys
+from api.serializers import OrderSerializer
+from rest_framework.renderers import JSONRenderer
+from django.utils.translation import gettext_lazy
+from django.utils import timezone
+from django.db.models import F
+import uuid
+from datetime import date, time as dt_time, timedelta
+from asgiref.sync import iscoroutinefunction, sync_to_async
+import asyncio
 
 User = get_user_model()
 
@@ -38,6 +89,9 @@ class UserOrderTestCase(TestCase):
 
 class ProductTestCase(APITestCase):
     def setUp(self):
+        # Product lists cache representations by id, and ids are reused between tests
+        cache.clear()
+        product_cache.local.clear()
         self.product_data = {
             'name': 'Test Product',
             'description': 'Test Description',
@@ -122,12 +176,9 @@ class AuthenticationTestCase(APITestCase):
             recovery_answer='blue'
         )
         
-        # Mock verification code
-        cache.set('email_verification_test@example.com', '123456', timeout=300)
-        
         verification_data = {
             'email': 'test@example.com',
-            'verification_code': '123456'
+            'verification_code': email_verification_tokens.make_token(user.id, user.email)
         }
         response = self.client.post(reverse('verify-email'), verification_data)
         self.assertEqual(response.status_code, status.HTTP_200_OK)
@@ -257,3 +308,1700 @@ class ProductFilterTestCase(APITestCase):
         # Should return only products with stock > 0
         for product in response.data['results']:
             self.assertGreater(product['stock'], 0)
+
+
+class OrderAdminTestCase(TestCase):
+    def setUp(self):
+        self.admin_user = User.objects.create_superuser(
+            username='admin',
+            password='admin123',
+            email='admin@test.com'
+        )
+        self.client.force_login(self.admin_user)
+
+    def create_orders(self, count):
+        product = Product.objects.create(
+            name=f'Product {count}',
+            description='Test Description',
+            price=Decimal('9.99'),
+            stock=100
+        )
+        for i in range(count):
+            customer = User.objects.create_user(
+                username=f'customer{count}-{i}',
+                email=f'customer{count}-{i}@test.com',
+                password='test'
+            )
+            order = Order.objects.create(user=customer)
+            OrderItem.objects.create(order=order, product=product, quantity=1)
+        return order
+
+    def test_order_changelist_query_count_is_constant(self):
+        self.create_orders(2)
+        with self.assertNumQueries(4):
+            response = self.client.get(reverse('admin:api_order_changelist'))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+        self.create_orders(20)
+        with self.assertNumQueries(4):
+            response = self.client.get(reverse('admin:api_order_changelist'))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+    def test_order_change_view_shows_items_without_listing_every_product(self):
+        order = self.create_orders(3)
+        Product.objects.create(
+            name='Unrelated Product',
+            description='Not in the order',
+            price=Decimal('1.99'),
+            stock=1
+        )
+        response = self.client.get(reverse('admin:api_order_change', args=[order.pk]))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertContains(response, 'Product 3')
+        self.assertNotContains(response, 'Unrelated Product')
+
+    def change_order(self, order, **fields):
+        item = order.items.get()
+        data = {
+            'order_id': order.pk,
+            'user': order.user_id,
+            'status': order.status,
+            'expires_at_0': '',
+            'expires_at_1': '',
+            'items-TOTAL_FORMS': 1,
+            'items-INITIAL_FORMS': 1,
+            'items-MIN_NUM_FORMS': 0,
+            'items-MAX_NUM_FORMS': 1000,
+            'items-0-id': item.id,
+            'items-0-order': order.pk,
+            **fields,
+        }
+        with self.captureOnCommitCallbacks(execute=True):
+            return self.client.post(reverse('admin:api_order_change', args=[order.pk]), data)
+
+    def test_status_changes_go_through_the_order_state_machine(self):
+        order = self.create_orders(1)
+        product = order.items.get().product
+        version, _ = get_user_order_pages(order.user_id)
+
+        response = self.change_order(order, status='Cancelled', **{'items-0-quantity': 5})
+        self.assertEqual(response.status_code, status.HTTP_302_FOUND)
+        order.refresh_from_db()
+        self.assertEqual(order.status, 'Cancelled')
+        self.assertEqual(order.items.get().quantity, 1)
+        product.refresh_from_db()
+        self.assertEqual(product.stock, 101)
+        self.assertTrue(OrderHistory.objects.filter(order=order, new_status='Cancelled', changed_by=self.admin_user).exists())
+        self.assertNotEqual(cache.get(version_key(order.user_id)), version)
+
+        response = self.change_order(order, status='Pending')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(Order.objects.get(pk=order.pk).status, 'Cancelled')
+
+
+class OrderStatusTransitionTestCase(APITestCase):
+    def setUp(self):
+        self.admin_user = User.objects.create_superuser(
+            username='admin',
+            password='admin123',
+            email='admin@test.com'
+        )
+        self.customer = User.objects.create_user(
+            username='customer',
+            email='customer@test.com',
+            password='testpass123'
+        )
+        self.pending = [Order.objects.create(user=self.customer) for _ in range(3)]
+        self.cancelled = Order.objects.create(
+            user=self.customer,
+            status=Order.StatusChoices.CANCELLED
+        )
+
+    def test_bulk_transition_updates_allowed_orders_only(self):
+        self.client.force_authenticate(user=self.admin_user)
+        order_ids = [str(order.order_id) for order in self.pending + [self.cancelled]]
+        with self.captureOnCommitCallbacks() as callbacks:
+            response = self.client.post(reverse('order-bulk-status'), {
+                'order_ids': order_ids,
+                'status': Order.StatusChoices.CONFIRMED
+            }, format='json')
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertCountEqual(response.data['updated'], order_ids[:3])
+        self.assertIn(str(self.cancelled.order_id), response.data['rejected'])
+        self.assertEqual(
+            Order.objects.filter(status=Order.StatusChoices.CONFIRMED).count(), 3
+        )
+        self.assertEqual(OrderHistory.objects.filter(new_status='Confirmed').count(), 3)
+        # One notification batch, one order list cache invalidation and one event publish
+        self.assertEqual(len(callbacks), 3)
+
+    def test_bulk_transition_requires_admin(self):
+        self.client.force_authenticate(user=self.customer)
+        response = self.client.post(reverse('order-bulk-status'), {
+            'order_ids': [str(self.pending[0].order_id)],
+            'status': Order.StatusChoices.CONFIRMED
+        }, format='json')
+        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+
+    def test_order_update_rejects_invalid_transition(self):
+        self.client.force_authenticate(user=self.customer)
+        url = reverse('order-detail', kwargs={'order_id': self.pending[0].order_id})
+        response = self.client.patch(url, {'status': 'Delivered'}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+        response = self.client.patch(url, {'status': 'Cancelled'}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertTrue(OrderHistory.objects.filter(
+            order=self.pending[0], old_status='Pending', new_status='Cancelled'
+        ).exists())
+
+    def test_status_notifications_are_sent_in_one_batch(self):
+        sent = send_order_status_notifications(
+            [str(order.order_id) for order in self.pending], 'Confirmed'
+        )
+        self.assertEqual(sent, 3)
+        self.assertEqual(len(mail.outbox), 3)
+
+
+class SchemaTestCase(APITestCase):
+    def setUp(self):
+        schema_cache.clear()
+
+    def test_schema_is_served_with_etag_and_not_modified(self):
+        response = self.client.get(reverse('schema'))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        etag = response['ETag']
+
+        response = self.client.get(reverse('schema'), HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+        self.assertEqual(response['ETag'], etag)
+
+    def test_schema_file_matches_code(self):
+        call_command('check_schema', stdout=StringIO())
+
+
+class LowStockScanTestCase(TestCase):
+    def setUp(self):
+        self.low = Product.objects.create(
+            name='Low Product',
+            description='Almost gone',
+            price=Decimal('9.99'),
+            stock=2
+        )
+        Product.objects.create(
+            name='Plenty Product',
+            description='Lots left',
+            price=Decimal('9.99'),
+            stock=50
+        )
+
+    def test_scan_sends_one_digest_per_newly_low_product(self):
+        self.assertEqual(scan_low_stock(), 1)
+        self.assertEqual(len(mail.outbox), 1)
+        self.assertIn('Low Product', mail.outbox[0].body)
+
+        # Further decrements do not alert again
+        Product.objects.filter(pk=self.low.pk).update(stock=1)
+        self.assertEqual(scan_low_stock(), 0)
+        self.assertEqual(len(mail.outbox), 1)
+
+    def test_restocked_product_alerts_again(self):
+        scan_low_stock()
+        Product.objects.filter(pk=self.low.pk).update(stock=20)
+        self.assertEqual(scan_low_stock(), 0)
+
+        Product.objects.filter(pk=self.low.pk).update(stock=0)
+        self.assertEqual(scan_low_stock(), 1)
+        self.assertEqual(len(mail.outbox), 2)
+
+    def test_failed_digest_is_retried_without_stamping(self):
+        with mock.patch('api.tasks.send_mail', side_effect=OSError('SMTP down')):
+            with self.assertRaises(OSError):
+                scan_low_stock()
+        with mock.patch('api.tasks.send_mail', return_value=0):
+            with self.assertRaises(Retry):
+                scan_low_stock()
+        self.assertFalse(Product.objects.filter(low_stock_alerted_at__isnull=False).exists())
+        self.assertEqual(scan_low_stock(), 1)
+
+
+class StockReconciliationTestCase(APITestCase):
+    def setUp(self):
+        self.admin_user = User.objects.create_superuser(
+            username='admin',
+            password='admin123',
+            email='admin@test.com'
+        )
+        self.client.force_authenticate(user=self.admin_user)
+        self.client.post(reverse('product-list'), {
+            'name': 'Ledger Product',
+            'description': 'Tracked',
+            'price': '5.00',
+            'stock': 10
+        })
+        self.product = Product.objects.get(name='Ledger Product')
+        order = Order.objects.create(user=self.admin_user)
+        OrderItem.objects.create(order=order, product=self.product, quantity=3)
+        # Stock reserved by the order item above
+        Product.objects.filter(pk=self.product.pk).update(stock=7)
+
+    def reconcile(self, *args):
+        out = StringIO()
+        call_command('reconcile_stock', '--workers', '1', *args, stdout=out)
+        return out.getvalue()
+
+    def test_consistent_stock_reports_no_drift(self):
+        self.assertIn('Found stock drift on 0 products', self.reconcile())
+
+    def test_api_stock_edits_are_recorded_in_ledger(self):
+        response = self.client.patch(
+            reverse('product-detail', kwargs={'product_id': self.product.id}),
+            {'stock': 12}
+        )
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(
+            list(StockMovement.objects.values_list('kind', 'quantity')),
+            [('Opening', 10), ('Adjustment', 5)]
+        )
+        self.assertIn('Found stock drift on 0 products', self.reconcile())
+
+    def test_drift_is_reported_and_fixed(self):
+        Product.objects.filter(pk=self.product.pk).update(stock=9)
+        output = self.reconcile()
+        self.assertIn(f'product {self.product.id}: stock 9, expected 7 (+2)', output)
+
+        self.assertIn('Corrected stock drift on 1 products', self.reconcile('--fix'))
+        self.product.refresh_from_db()
+        self.assertEqual(self.product.stock, 7)
+
+    def test_fix_corrects_a_range_with_one_update(self):
+        other = Product.objects.create(name='Unledgered', description='x', price=Decimal('1.00'), stock=4)
+        Product.objects.filter(pk=self.product.pk).update(stock=9)
+        with CaptureQueriesContext(connection) as queries:
+            drift = reconcile_range(self.product.id, other.id + 1, fix=True)
+        self.assertEqual(len(drift), 2)
+        self.assertEqual(sum(query['sql'].startswith('UPDATE') for query in queries.captured_queries), 1)
+        self.assertEqual(
+            dict(Product.objects.filter(pk__in=[self.product.pk, other.pk]).values_list('pk', 'stock')),
+            {self.product.pk: 7, other.pk: 0}
+        )
+
+
+class QuoteTestCase(APITestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(
+            username='buyer',
+            email='buyer@test.com',
+            password='testpass123'
+        )
+        self.products = [
+            Product.objects.create(
+                name=f'Quote Product {i}',
+                description='Quoted',
+                price=Decimal('2.50') * (i + 1),
+                stock=5
+            )
+            for i in range(3)
+        ]
+
+    def test_quote_loads_all_prices_in_one_query(self):
+        items = [(product.id, 2) for product in self.products]
+        with self.assertNumQueries(1):
+            quote = build_quote(items)
+        self.assertEqual(quote.total, Decimal('30.00'))
+
+    def test_quote_endpoint_reports_totals_and_missing_products(self):
+        response = self.client.post(reverse('quote'), {'items': [
+            {'product_id': self.products[0].id, 'quantity': 2},
+            {'product_id': self.products[1].id, 'quantity': 6},
+            {'product_id': 999999, 'quantity': 1},
+        ]}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['total'], '35.00')
+        self.assertEqual(response.data['missing'], [999999])
+        self.assertFalse(response.data['items'][1]['in_stock'])
+        self.assertNotIn('quote_token', response.data)
+
+    def test_checkout_with_quote_token_locks_prices(self):
+        response = self.client.post(reverse('quote'), {'items': [
+            {'product_id': self.products[0].id, 'quantity': 2},
+            {'product_id': self.products[2].id, 'quantity': 1},
+        ]}, format='json')
+        token = response.data['quote_token']
+
+        Product.objects.filter(pk=self.products[0].pk).update(price=Decimal('99.00'))
+        self.client.force_authenticate(user=self.user)
+        response = self.client.post(reverse('order-create'), {'quote_token': token}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+
+        order = Order.objects.get(user=self.user)
+        self.assertEqual(sum(item.item_subtotal for item in order.items.all()), Decimal('12.50'))
+        self.products[0].refresh_from_db()
+        self.assertEqual(self.products[0].stock, 3)
+
+    def test_checkout_rejects_tampered_quote_token(self):
+        self.client.force_authenticate(user=self.user)
+        response = self.client.post(reverse('order-create'), {'quote_token': 'not-a-token'}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertFalse(Order.objects.exists())
+
+
+class IdempotencyTestCase(APITransactionTestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(
+            username='mobile',
+            email='mobile@test.com',
+            password='testpass123'
+        )
+
+    def create_order(self, key, data=None, client=None):
+        client = client or self.client
+        client.force_authenticate(user=self.user)
+        return client.post(reverse('order-create'), data or {}, format='json', HTTP_IDEMPOTENCY_KEY=key)
+
+    def test_retry_replays_stored_response(self):
+        first = self.create_order('retry-1')
+        second = self.create_order('retry-1')
+        self.assertEqual(first.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(second.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(second['Idempotent-Replayed'], 'true')
+        self.assertEqual(first.data['order_id'], second.data['order_id'])
+        self.assertEqual(Order.objects.count(), 1)
+
+        self.create_order('retry-2')
+        self.assertEqual(Order.objects.count(), 2)
+
+    def test_key_reused_with_different_body_is_rejected(self):
+        self.create_order('reused')
+        response = self.create_order('reused', {'status': 'Confirmed'})
+        self.assertEqual(response.status_code, status.HTTP_422_UNPROCESSABLE_ENTITY)
+
+    def test_duplicates_of_an_in_flight_request_are_turned_away(self):
+        started = threading.Event()
+        release = threading.Event()
+        original = OrderCreateAPIView.perform_create
+
+        def slow_perform_create(view, serializer):
+            started.set()
+            release.wait(5)
+            original(view, serializer)
+
+        responses = []
+
+        def send():
+            responses.append(self.create_order('concurrent', client=APIClient()))
+
+        with mock.patch.object(OrderCreateAPIView, 'perform_create', slow_perform_create):
+            first = threading.Thread(target=send)
+            first.start()
+            self.assertTrue(started.wait(5))
+            start = time.monotonic()
+            duplicate = self.create_order('concurrent', client=APIClient())
+            self.assertLess(time.monotonic() - start, settings.IDEMPOTENCY_LOCK_TIMEOUT / 2)
+            release.set()
+            first.join(10)
+
+        self.assertEqual(duplicate.status_code, status.HTTP_409_CONFLICT)
+        self.assertEqual(duplicate['Retry-After'], '1')
+        self.assertEqual(responses[0].status_code, status.HTTP_201_CREATED)
+        retry = self.create_order('concurrent', client=APIClient())
+        self.assertEqual(retry.data['order_id'], responses[0].data['order_id'])
+        self.assertEqual(Order.objects.count(), 1)
+
+    def test_unhandled_error_releases_the_key(self):
+        with mock.patch.object(OrderCreateAPIView, 'perform_create', side_effect=RuntimeError('boom')):
+            with self.assertRaises(RuntimeError):
+                self.create_order('crashed')
+        response = self.create_order('crashed')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+
+
+class AuthTokenTestCase(APITestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(
+            username='tokenuser',
+            email='token@example.com',
+            password='testpass123',
+            recovery_question='What is your favorite color?',
+            recovery_answer='blue'
+        )
+
+    def test_token_is_bound_to_state_and_expiry(self):
+        service = TokenService('test', max_age=60)
+        token = service.make_token(self.user.id, 'token@example.com')
+        with self.assertNumQueries(0):
+            self.assertEqual(service.check_token(token, 'token@example.com'), self.user.id)
+        self.assertIsNone(service.check_token(token, 'other@example.com'))
+        tampered = token[:-1] + ('1' if token[-1] == '0' else '0')
+        self.assertIsNone(service.check_token(tampered, 'token@example.com'))
+        self.assertIsNone(TokenService('other', max_age=60).check_token(token, 'token@example.com'))
+        self.assertIsNone(TokenService('test', max_age=-1).check_token(
+            TokenService('test', max_age=-1).make_token(self.user.id), ''
+        ))
+
+    def test_revoked_token_is_rejected_when_revocation_is_enabled(self):
+        service = TokenService('test', max_age=60)
+        token = service.make_token(self.user.id)
+        service.revoke(token)
+        self.assertEqual(service.check_token(token), self.user.id)
+        with self.settings(AUTH_TOKEN_REVOCATION=True):
+            service.revoke(token)
+            self.assertIsNone(service.check_token(token))
+        self.assertEqual(service.check_token(token), self.user.id)
+
+    @override_settings(AUTH_TOKEN_REVOCATION=True)
+    def test_verification_token_is_revoked_once_used(self):
+        data = {
+            'email': 'token@example.com',
+            'verification_code': email_verification_tokens.make_token(self.user.id, 'token@example.com')
+        }
+        self.assertEqual(self.client.post(reverse('verify-email'), data).status_code, status.HTTP_200_OK)
+        self.assertEqual(self.client.post(reverse('verify-email'), data).status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_password_reset_with_emailed_token(self):
+        response = self.client.post(reverse('password-reset-request'), {
+            'email': 'token@example.com',
+            'recovery_answer': 'blue'
+        })
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        token = mail.outbox[-1].body.split('token is: ')[1].split()[0]
+
+        reset_data = {
+            'token': token,
+            'new_password': 'N3w-passw0rd!',
+            'new_password_confirm': 'N3w-passw0rd!'
+        }
+        response = self.client.post(reverse('password-reset-confirm'), reset_data)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.user.refresh_from_db()
+        self.assertTrue(self.user.check_password('N3w-passw0rd!'))
+
+        # The token is bound to the old password hash, so it cannot be used twice
+        response = self.client.post(reverse('password-reset-confirm'), reset_data)
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_verify_email_rejects_token_for_other_email(self):
+        token = email_verification_tokens.make_token(self.user.id, 'someone@example.com')
+        response = self.client.post(reverse('verify-email'), {
+            'email': 'token@example.com',
+            'verification_code': token
+        })
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+
+class ProductCacheTestCase(APITestCase):
+    def setUp(self):
+        cache.clear()
+        product_cache.local.clear()
+        self.product = Product.objects.create(
+            name='Cached Product',
+            description='Hot',
+            price=Decimal('19.99'),
+            stock=10
+        )
+        self.admin_user = User.objects.create_superuser(
+            username='admin',
+            password='admin123',
+            email='admin@test.com'
+        )
+        self.url = reverse('product-detail', kwargs={'product_id': self.product.id})
+
+    def tearDown(self):
+        # Primary keys are reused after each test's rollback
+        cache.clear()
+        product_cache.local.clear()
+
+    def test_lru_evicts_by_count_and_size(self):
+        lru = LRUCache(max_entries=2, max_bytes=100, ttl=60)
+        lru.set('a', 1, size=10)
+        lru.set('b', 2, size=10)
+        lru.get('a')
+        lru.set('c', 3, size=10)
+        self.assertIs(lru.get('b'), MISSING)
+        self.assertEqual(lru.get('a'), 1)
+        lru.set('d', 4, size=95)
+        self.assertEqual(len(lru), 1)
+        self.assertEqual(lru.bytes, 95)
+        self.assertEqual(lru.evictions, 3)
+
+    def test_repeated_lookups_skip_the_database(self):
+        self.client.get(self.url)
+        with self.assertNumQueries(0):
+            response = self.client.get(self.url)
+        self.assertEqual(response.data['name'], 'Cached Product')
+
+    def test_update_invalidates_cached_product(self):
+        self.client.get(self.url)
+        self.client.force_authenticate(user=self.admin_user)
+        self.client.patch(self.url, {'price': '24.99'})
+        response = self.client.get(self.url)
+        self.assertEqual(response.data['price'], '24.99')
+
+    def test_other_processes_evict_changed_products_on_sync(self):
+        other_process = ProductCache()
+        loader = mock.Mock(return_value={'name': 'Cached Product'})
+        other_process.get(self.product.id, loader)
+        other_process.get(self.product.id, loader)
+        self.assertEqual(loader.call_count, 1)
+
+        product_cache.invalidate([self.product.id])
+        other_process.sync(force=True)
+        other_process.get(self.product.id, loader)
+        self.assertEqual(loader.call_count, 2)
+
+    def test_invalidating_many_products_records_each_change(self):
+        seen = product_cache.current_generation()
+        with mock.patch.object(cache, 'incr', wraps=cache.incr) as incr:
+            product_cache.invalidate([3, 1, 2])
+        incr.assert_called_once_with(product_cache.changes.generation_key, delta=3)
+        self.assertEqual(product_cache.changes_since(seen), (seen + 3, [3, 1, 2]))
+
+    def test_load_racing_an_invalidation_is_not_stored(self):
+        def stale_loader():
+            # The product is written and invalidated while its old row is being serialized
+            product_cache.invalidate([self.product.id])
+            return {'name': 'Stale'}
+
+        self.assertEqual(product_cache.get(self.product.id, stale_loader), {'name': 'Stale'})
+        self.assertIsNone(cache.get(product_cache.shared_key(self.product.id)))
+        self.assertIs(product_cache.local.get(self.product.id), MISSING)
+
+
+class UserOrderCacheTestCase(APITestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(username='poller', password='test', email='poller@example.com')
+        self.other_user = User.objects.create_user(username='other', password='test', email='other@example.com')
+        self.product = Product.objects.create(name='Polled', price=Decimal('5.00'), stock=10)
+        self.order = Order.objects.create(user=self.user)
+        OrderItem.objects.create(order=self.order, product=self.product, quantity=2)
+        Order.objects.create(user=self.other_user)
+        self.url = reverse('user-orders')
+
+    def tearDown(self):
+        cache.clear()
+
+    def get_orders(self, user, **headers):
+        self.client.force_authenticate(user=user)
+        return self.client.get(self.url, headers=headers)
+
+    def test_repeated_polls_are_served_from_cache_with_conditional_get(self):
+        first = self.get_orders(self.user)
+        with self.assertNumQueries(0):
+            second = self.get_orders(self.user)
+        self.assertEqual(second.data, first.data)
+        self.assertEqual(second['ETag'], first['ETag'])
+
+        not_modified = self.get_orders(self.user, **{'If-None-Match': first['ETag']})
+        self.assertEqual(not_modified.status_code, status.HTTP_304_NOT_MODIFIED)
+        self.assertEqual(not_modified.content, b'')
+
+    def test_status_change_invalidates_only_the_owner(self):
+        etag = self.get_orders(self.user)['ETag']
+        other_etag = self.get_orders(self.other_user)['ETag']
+
+        self.client.force_authenticate(user=self.user)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.patch(
+                reverse('order-detail', kwargs={'order_id': self.order.order_id}),
+                {'status': Order.StatusChoices.CANCELLED}
+            )
+
+        response = self.get_orders(self.user, **{'If-None-Match': etag})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['results'][0]['status'], Order.StatusChoices.CANCELLED)
+        with self.assertNumQueries(0):
+            self.assertEqual(self.get_orders(self.other_user)['ETag'], other_etag)
+
+    def test_catalog_changes_do_not_invalidate(self):
+        etag = self.get_orders(self.user)['ETag']
+        self.client.force_authenticate(user=User.objects.create_superuser(username='admin', password='admin', email='admin@example.com'))
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.patch(reverse('product-detail', kwargs={'product_id': self.product.id}), {'price': '6.00'})
+        self.assertEqual(self.get_orders(self.user)['ETag'], etag)
+
+    def test_cached_pages_are_capped_per_user(self):
+        for _ in range(4):
+            Order.objects.create(user=self.user)
+        first_url = self.get_orders(self.user).wsgi_request.build_absolute_uri()
+        _, pages = get_user_order_pages(self.user.id)
+        page_size = pages[first_url][2]
+        with self.settings(USER_ORDER_CACHE={'MAX_BYTES': page_size * 2, 'TIMEOUT': 60}):
+            for page in (2, 3):
+                self.client.get(self.url, {'page': page})
+        _, pages = get_user_order_pages(self.user.id)
+        self.assertEqual(len(pages), 2)
+        self.assertNotIn(first_url, pages)
+
+
+class OrderItemBatchTestCase(APITestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='editor', password='test', email='editor@example.com')
+        self.client.force_authenticate(user=self.user)
+        self.keep, self.drop, self.extra = [
+            Product.objects.create(name=name, price=Decimal('2.50'), stock=10)
+            for name in ('Keep', 'Drop', 'Extra')
+        ]
+        self.order = Order.objects.create(user=self.user)
+        self.kept_item = OrderItem.objects.create(order=self.order, product=self.keep, quantity=2)
+        self.dropped_item = OrderItem.objects.create(order=self.order, product=self.drop, quantity=3)
+        self.url = reverse('order-item-create', kwargs={'order_id': self.order.order_id})
+
+    def test_batch_applies_all_operations_and_adjusts_stock(self):
+        response = self.client.patch(self.url, {'operations': [
+            {'op': 'add', 'product_id': self.extra.id, 'quantity': 4},
+            {'op': 'update', 'id': self.kept_item.id, 'quantity': 5},
+            {'op': 'remove', 'id': self.dropped_item.id},
+        ]}, format='json')
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(
+            sorted((item['product_name'], item['quantity']) for item in response.data['items']),
+            [('Extra', 4), ('Keep', 5)]
+        )
+        self.assertEqual(response.data['total_price'], Decimal('22.50'))
+        self.assertEqual(
+            dict(Product.objects.values_list('name', 'stock')),
+            {'Keep': 7, 'Drop': 13, 'Extra': 6}
+        )
+
+    def test_failed_operation_rolls_back_the_whole_batch(self):
+        other_order = Order.objects.create(user=self.user)
+        foreign_item = OrderItem.objects.create(order=other_order, product=self.keep, quantity=1)
+        response = self.client.patch(self.url, {'operations': [
+            {'op': 'add', 'product_id': self.extra.id, 'quantity': 1},
+            {'op': 'remove', 'id': foreign_item.id},
+        ]}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+        response = self.client.patch(self.url, {'operations': [
+            {'op': 'remove', 'id': self.dropped_item.id},
+            {'op': 'add', 'product_id': self.extra.id, 'quantity': 11},
+        ]}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(self.order.items.count(), 2)
+        self.assertEqual(Product.objects.get(pk=self.extra.id).stock, 10)
+
+    def test_only_pending_orders_can_be_edited(self):
+        Order.objects.filter(pk=self.order.pk).update(status=Order.StatusChoices.SHIPPED)
+        response = self.client.patch(self.url, {'operations': [
+            {'op': 'remove', 'id': self.dropped_item.id},
+        ]}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertTrue(OrderItem.objects.filter(pk=self.dropped_item.pk).exists())
+
+    def test_single_item_edits_adjust_stock_of_pending_orders_only(self):
+        url = reverse('order-item-detail', kwargs={'pk': self.kept_item.pk})
+        response = self.client.patch(url, {'quantity': 6}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['quantity'], 6)
+        response = self.client.delete(reverse('order-item-detail', kwargs={'pk': self.dropped_item.pk}))
+        self.assertEqual(response.status_code, status.HTTP_204_NO_CONTENT)
+        self.assertEqual(dict(Product.objects.values_list('name', 'stock')), {'Keep': 6, 'Drop': 13, 'Extra': 10})
+
+        Order.objects.filter(pk=self.order.pk).update(status=Order.StatusChoices.SHIPPED)
+        self.assertEqual(self.client.patch(url, {'quantity': 1}, format='json').status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(self.client.delete(url).status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(OrderItem.objects.get(pk=self.kept_item.pk).quantity, 6)
+
+    def test_single_item_quantity_is_validated(self):
+        url = reverse('order-item-detail', kwargs={'pk': self.kept_item.pk})
+        for quantity in (0, -1):
+            response = self.client.patch(url, {'quantity': quantity}, format='json')
+            self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(OrderItem.objects.get(pk=self.kept_item.pk).quantity, 2)
+        self.assertEqual(Product.objects.get(pk=self.keep.pk).stock, 10)
+
+
+class OrderArchiveTestCase(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='archived', password='test', email='archived@example.com')
+        self.product = Product.objects.create(name='Archived', price=Decimal('3.00'), stock=5)
+        self.old_order = Order.objects.create(user=self.user)
+        OrderItem.objects.create(order=self.old_order, product=self.product, quantity=2, unit_price=Decimal('3.00'))
+        Order.objects.filter(pk=self.old_order.pk).update(created_at=datetime(2024, 3, 15, tzinfo=dt_timezone.utc))
+        self.new_order = Order.objects.create(user=self.user)
+        self.output_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.output_dir)
+
+    def test_order_ids_are_time_ordered_uuid7(self):
+        march = datetime(2024, 3, 1, tzinfo=dt_timezone.utc)
+        order_id = uuid7(int(datetime(2024, 3, 15, tzinfo=dt_timezone.utc).timestamp() * 1000))
+        lower, upper = month_id_range(march)
+        self.assertEqual(order_id.version, 7)
+        self.assertTrue(lower <= order_id < upper)
+        self.assertLess(uuid7(1000), uuid7(1001))
+        self.assertEqual(self.new_order.order_id.version, 7)
+
+    def test_archive_exports_and_removes_old_months(self):
+        out = StringIO()
+        call_command('archive_orders', before='2024-04', output_dir=self.output_dir, stdout=out)
+
+        self.assertIn('Archived 1 orders from 2024-03', out.getvalue())
+        with gzip.open(Path(self.output_dir) / 'orders-2024-03.jsonl.gz', 'rt') as archive:
+            rows = [json.loads(line) for line in archive]
+        self.assertEqual(rows[0]['order_id'], str(self.old_order.order_id))
+        self.assertEqual(rows[0]['items'], [{'product_id': self.product.id, 'quantity': 2, 'unit_price': '3.00'}])
+        self.assertFalse(Order.objects.filter(pk=self.old_order.pk).exists())
+        self.assertFalse(OrderItem.objects.filter(order_id=self.old_order.pk).exists())
+        self.assertTrue(Order.objects.filter(pk=self.new_order.pk).exists())
+
+    def test_archived_items_keep_the_ledger_reconciled(self):
+        cancelled = Order.objects.create(user=self.user, status=Order.StatusChoices.CANCELLED)
+        OrderItem.objects.create(order=cancelled, product=self.product, quantity=4, unit_price=Decimal('3.00'))
+        Order.objects.filter(pk=cancelled.pk).update(created_at=datetime(2024, 3, 20, tzinfo=dt_timezone.utc))
+        record_stock_movements([(self.product.id, 7)], StockMovement.KindChoices.OPENING)
+        self.assertEqual(reconcile_range(self.product.id, self.product.id + 1), [])
+
+        call_command('archive_orders', before='2024-04', output_dir=self.output_dir, stdout=StringIO())
+
+        self.assertEqual(reconcile_range(self.product.id, self.product.id + 1), [])
+        self.assertEqual(
+            list(StockMovement.objects.filter(kind=StockMovement.KindChoices.ARCHIVED).values_list('product_id', 'quantity')),
+            [(self.product.id, -2)]
+        )
+
+    def test_dry_run_keeps_orders(self):
+        call_command('archive_orders', before='2024-04', output_dir=self.output_dir, dry_run=True, stdout=StringIO())
+        self.assertTrue(Order.objects.filter(pk=self.old_order.pk).exists())
+        self.assertTrue((Path(self.output_dir) / 'orders-2024-03.jsonl.gz').exists())
+
+
+class LoadTestHarnessTestCase(LiveServerTestCase):
+    def setUp(self):
+        User.objects.create_user(username='load', password='load-password', email='load@example.com')
+        self.product_ids = [
+            Product.objects.create(name=f'Loadtest product {i}', price=Decimal('1.00'), stock=1000).id
+            for i in range(5)
+        ]
+
+    def run_worker(self, seed):
+        return run_worker(
+            self.live_server_url, 0, seed, [('load', 'load-password')], self.product_ids, 30,
+            {'browse_products': 1, 'search_products': 1, 'list_orders': 1, 'create_order': 1, 'add_items': 1}
+        )
+
+    def test_worker_replays_the_same_mix_for_a_seed(self):
+        samples = self.run_worker(seed=1)
+        self.assertEqual(samples[0][0], 'login')
+        self.assertEqual(len(samples), 31)
+        self.assertTrue(all(200 <= status < 300 for _, _, status in samples))
+        self.assertEqual([name for name, _, _ in self.run_worker(seed=1)], [name for name, _, _ in samples])
+
+        report = summarize(samples, elapsed=1.0)
+        self.assertEqual(report['requests'], 31)
+        self.assertEqual(report['error_rate'], 0)
+        self.assertEqual(sum(scenario['requests'] for scenario in report['scenarios'].values()), 31)
+
+    def test_seeded_products_have_opening_ledger_rows(self):
+        product_ids = LoadTestCommand().seed_products(8)
+        self.assertEqual(product_ids[:5], self.product_ids)
+        self.assertEqual(reconcile_range(min(product_ids[5:]), max(product_ids) + 1), [])
+        self.assertEqual(StockMovement.objects.filter(product_id__in=product_ids[5:]).count(), 3)
+
+    def test_seeded_data_is_removed_after_the_run(self):
+        command = LoadTestCommand()
+        command.seed_users(2)
+        product_ids = command.seed_products(8)
+        order = Order.objects.create(user=User.objects.get(username='loadtest-0'))
+        OrderItem.objects.create(order=order, product_id=product_ids[0], quantity=1)
+
+        command.remove_seeded_data()
+
+        self.assertFalse(User.objects.filter(username__startswith='loadtest-').exists())
+        self.assertFalse(Product.objects.filter(id__in=product_ids).exists())
+        self.assertFalse(StockMovement.objects.filter(product_id__in=product_ids).exists())
+        self.assertFalse(Order.objects.filter(pk=order.pk).exists())
+        self.assertTrue(User.objects.filter(username='load').exists())
+
+
+PROFILING_ENABLED = {
+    'ENABLED': True,
+    'HEADER': 'X-Profile',
+    'SAMPLE_RATE': 0.0,
+    'ROUTES': ['order-list'],
+    'BUFFER_SIZE': 50,
+}
+
+
+@override_settings(PROFILING=PROFILING_ENABLED)
+class ProfilingTestCase(APITestCase):
+    def setUp(self):
+        profile_buffer.clear()
+        self.admin_user = User.objects.create_superuser(
+            username='admin', password='admin123', email='admin@test.com'
+        )
+        self.customer = User.objects.create_user(username='customer', password='test', email='customer@test.com')
+
+    def test_staff_header_captures_a_downloadable_profile(self):
+        token = RefreshToken.for_user(self.admin_user).access_token
+        response = self.client.get(
+            reverse('order-list'), headers={'X-Profile': '1', 'Authorization': f'Bearer {token}'}
+        )
+        profile_id = response['X-Profile-Id']
+        self.client.force_authenticate(user=self.admin_user)
+
+        listed = self.client.get(reverse('profile-list')).data
+        self.assertEqual([profile['id'] for profile in listed], [profile_id])
+        self.assertEqual(listed[0]['trigger'], 'header')
+
+        download = self.client.get(reverse('profile-detail', kwargs={'profile_id': profile_id}))
+        self.assertEqual(download['Content-Disposition'], f'attachment; filename="{profile_id}.prof"')
+        stats = marshal.loads(download.content)
+        self.assertTrue(any(function == 'list' for _, _, function in stats))
+        text = self.client.get(reverse('profile-detail', kwargs={'profile_id': profile_id}), {'output': 'text'})
+        self.assertIn(b'cumulative', text.content)
+
+    def test_header_from_non_staff_is_ignored(self):
+        token = RefreshToken.for_user(self.customer).access_token
+        with mock.patch('api.profiling.cProfile.Profile') as profiler:
+            response = self.client.get(
+                reverse('user-orders'), headers={'X-Profile': '1', 'Authorization': f'Bearer {token}'}
+            )
+            self.client.get(reverse('user-orders'), headers={'X-Profile': '1', 'Authorization': 'Bearer invalid'})
+        profiler.assert_not_called()
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertNotIn('X-Profile-Id', response)
+        self.assertEqual(profile_buffer.list(), [])
+
+    def test_sampled_routes_are_profiled(self):
+        with self.settings(PROFILING=dict(PROFILING_ENABLED, SAMPLE_RATE=1.0)):
+            self.client.get(reverse('order-list'))
+            self.client.get(reverse('product-list'))
+        self.assertEqual([profile['route'] for profile in profile_buffer.list()], ['order-list'])
+
+    def test_async_views_are_not_profiled(self):
+        with self.settings(PROFILING=dict(PROFILING_ENABLED, SAMPLE_RATE=1.0)):
+            middleware = ProfilingMiddleware(lambda request: None)
+        request = RequestFactory().get(reverse('order-list'))
+        request.resolver_match = resolve(reverse('order-list'))
+
+        async def view(request):
+            return None
+
+        self.assertIsNone(middleware.process_view(request, view, (), {}))
+        self.assertEqual(profile_buffer.list(), [])
+
+    def test_buffer_keeps_only_the_newest_profiles(self):
+        buffer = ProfileBuffer(2)
+        for profile_id in 'abc':
+            buffer.add({'id': profile_id, 'stats': b'', 'text': ''})
+        self.assertEqual([profile['id'] for profile in buffer.list()], ['c', 'b'])
+        self.assertIsNone(buffer.get('a'))
+
+    def test_no_profiler_runs_unless_triggered_or_enabled(self):
+        with mock.patch('api.profiling.cProfile.Profile') as profiler:
+            self.client.get(reverse('order-list'))
+            with self.settings(PROFILING=dict(PROFILING_ENABLED, ENABLED=False)):
+                self.client_class().get(reverse('order-list'), headers={'X-Profile': '1'})
+        profiler.assert_not_called()
+
+
+class OrderEventStreamTestCase(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='streamer', password='test', email='streamer@example.com')
+        self.order = Order.objects.create(user=self.user)
+        self.url = reverse('order-events')
+
+    async def test_events_reach_only_the_owners_streams(self):
+        queue = order_event_hub.subscribe(self.user.id)
+        other_queue = order_event_hub.subscribe(self.user.id + 1)
+        try:
+            await asyncio.to_thread(publish_order_events, [
+                {'order_id': 'a', 'user_id': self.user.id, 'new_status': 'Shipped'}
+            ])
+            event = await asyncio.wait_for(queue.get(), timeout=1)
+            self.assertEqual(event['new_status'], 'Shipped')
+            self.assertTrue(other_queue.empty())
+        finally:
+            order_event_hub.unsubscribe(self.user.id, queue)
+            order_event_hub.unsubscribe(self.user.id + 1, other_queue)
+
+    async def test_stream_emits_status_transitions(self):
+        await self.async_client.aforce_login(self.user)
+        response = await self.async_client.get(self.url)
+        self.assertEqual(response['Content-Type'], 'text/event-stream')
+        chunks = aiter(response.streaming_content)
+        self.assertEqual(await anext(chunks), b'retry: 5000\n\n')
+
+        def confirm():
+            with self.captureOnCommitCallbacks(execute=True):
+                transition_orders([self.order.order_id], Order.StatusChoices.CONFIRMED)
+        await sync_to_async(confirm)()
+
+        message = (await asyncio.wait_for(anext(chunks), timeout=1)).decode()
+        self.assertTrue(message.startswith('event: order_status\n'))
+        payload = json.loads(message.split('data: ', 1)[1])
+        self.assertEqual(payload['order_id'], str(self.order.order_id))
+        self.assertEqual((payload['old_status'], payload['new_status']), ('Pending', 'Confirmed'))
+
+    async def test_stream_reads_events_with_a_bearer_token_through_async_middleware(self):
+        metrics_registry.clear()
+        token = await sync_to_async(lambda: str(RefreshToken.for_user(self.user).access_token))()
+        with self.settings(PROFILING=PROFILING_ENABLED):
+            response = await self.async_client.get(
+                self.url, headers={'Authorization': f'Bearer {token}', 'X-Profile': '1'}
+            )
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertNotIn('X-Profile-Id', response)
+        chunks = aiter(response.streaming_content)
+        await anext(chunks)
+
+        await asyncio.to_thread(publish_order_events, [
+            {'order_id': 'a', 'user_id': self.user.id, 'old_status': 'Pending', 'new_status': 'Shipped'}
+        ])
+        message = (await asyncio.wait_for(anext(chunks), timeout=1)).decode()
+        self.assertEqual(json.loads(message.split('data: ', 1)[1])['new_status'], 'Shipped')
+        self.assertIn(
+            'http_requests_total{route="order-events",method="GET",status="200"} 1\n', metrics_registry.render()
+        )
+
+    async def test_stream_requires_authentication(self):
+        response = await self.async_client.get(self.url)
+        self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+
+    def test_stream_is_refused_under_wsgi(self):
+        self.client.force_login(self.user)
+        self.assertEqual(self.client.get(self.url).status_code, status.HTTP_501_NOT_IMPLEMENTED)
+        self.assertEqual(order_event_hub.connection_count(), 0)
+
+    def test_middleware_runs_natively_in_async_stacks(self):
+        async def get_response(request):
+            return None
+
+        with self.settings(PROFILING=PROFILING_ENABLED):
+            for middleware_class in (MetricsMiddleware, ProfilingMiddleware):
+                self.assertTrue(iscoroutinefunction(middleware_class(get_response)))
+                self.assertFalse(iscoroutinefunction(middleware_class(lambda request: None)))
+
+
+class ProductFacetTestCase(APITestCase):
+    def setUp(self):
+        cache.clear()
+        for name, price, stock in [
+            ('Cheap', '5.00', 10),
+            ('Cheap low', '8.00', 2),
+            ('Mid', '30.00', 20),
+            ('Pricey', '600.00', 1),
+            ('Sold out', '20.00', 0),
+        ]:
+            Product.objects.create(name=name, description=name, price=Decimal(price), stock=stock)
+        self.url = reverse('product-list')
+
+    def tearDown(self):
+        cache.clear()
+
+    def test_facets_are_counted_in_one_query_alongside_the_page(self):
+        # One aggregate for the facets and one for the page, with no separate COUNT(*)
+        with self.assertNumQueries(2):
+            response = self.client.get(self.url, {'facets': 'true', 'price_buckets': '0,10,100', 'limit': 2})
+
+        self.assertEqual(response.data['count'], 4)
+        self.assertEqual(len(response.data['results']), 2)
+        facets = response.data['facets']
+        self.assertEqual(facets['availability'], {'in_stock': 4, 'out_of_stock': 1})
+        self.assertEqual(facets['stock_status'], {'normal': 2, 'low': 2, 'out': 1})
+        self.assertEqual([bucket['count'] for bucket in facets['price']], [2, 1, 1])
+        self.assertEqual(facets['price'][-1], {'min': '100', 'max': None, 'count': 1})
+
+    def test_facets_follow_filters_and_are_cached_per_signature(self):
+        params = {'facets': 'true', 'price__lt': '50'}
+        self.client.get(self.url, params)
+        with self.assertNumQueries(1):
+            response = self.client.get(self.url, dict(params, offset=2))
+        self.assertEqual(response.data['facets']['availability'], {'in_stock': 3, 'out_of_stock': 1})
+
+        admin = User.objects.create_superuser(username='admin', password='admin123', email='admin@test.com')
+        self.client.force_authenticate(user=admin)
+        self.client.post(self.url, {'name': 'New', 'description': 'New', 'price': '12.00', 'stock': 3})
+        response = self.client.get(self.url, params)
+        self.assertEqual(response.data['facets']['availability']['in_stock'], 4)
+
+    def test_invalid_price_buckets_are_rejected(self):
+        for price_buckets in ('50,10', '1,NaN', 'sNaN,1', 'NaN', '0,Infinity', 'ten'):
+            response = self.client.get(self.url, {'facets': 'true', 'price_buckets': price_buckets})
+            self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST, price_buckets)
+
+
+class SparseFieldsetTestCase(APITestCase):
+    def setUp(self):
+        cache.clear()
+        product_cache.local.clear()
+        self.user = User.objects.create_user(username='sparse', password='test', email='sparse@example.com')
+        self.client.force_authenticate(user=self.user)
+        self.product = Product.objects.create(name='Sparse', description='A long description', price=Decimal('4.00'), stock=5)
+        for _ in range(3):
+            order = Order.objects.create(user=self.user)
+            OrderItem.objects.create(order=order, product=self.product, quantity=2, unit_price=Decimal('4.00'))
+
+    def tearDown(self):
+        cache.clear()
+        product_cache.local.clear()
+
+    def test_product_list_selects_only_requested_columns(self):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(reverse('product-list'), {'fields': 'name,price'})
+        self.assertEqual(response.data['results'], [{'name': 'Sparse', 'price': '4.00'}])
+        self.assertNotIn('description', queries.captured_queries[-1]['sql'])
+
+        response = self.client.get(reverse('product-list'), {'omit': 'description'})
+        self.assertNotIn('description', response.data['results'][0])
+        self.assertEqual(response.data['results'][0]['name'], 'Sparse')
+
+    def test_cached_product_detail_is_trimmed_per_request(self):
+        url = reverse('product-detail', kwargs={'product_id': self.product.id})
+        response = self.client.get(url, {'fields': 'name'})
+        self.assertEqual(response.data, {'name': 'Sparse'})
+        # The trimmed response must not have been what went into the cache
+        response = self.client.get(url)
+        self.assertEqual(response.data['description'], 'A long description')
+
+    def test_omitting_items_skips_the_prefetch(self):
+        with self.assertNumQueries(2):
+            response = self.client.get(reverse('user-orders'), {'omit': 'items,total_price'})
+        self.assertNotIn('items', response.data['results'][0])
+
+        with self.assertNumQueries(4):
+            response = self.client.get(reverse('user-orders'))
+        self.assertEqual(response.data['results'][0]['total_price'], Decimal('8.00'))
+
+    def test_nested_fields_reach_order_items(self):
+        with self.assertNumQueries(3):
+            response = self.client.get(reverse('user-orders'), {'fields': 'order_id,items.quantity'})
+        self.assertEqual(set(response.data['results'][0]), {'order_id', 'items'})
+        self.assertEqual(response.data['results'][0]['items'], [{'quantity': 2}])
+
+
+STREAMING_SMALL_CHUNKS = dict(settings.STREAMING_JSON, ENABLED=True, MIN_ITEMS=3, CHUNK_SIZE=2)
+STREAMING_DISABLED = dict(settings.STREAMING_JSON, ENABLED=False)
+
+
+class JSONRenderingTestCase(APITestCase):
+    def setUp(self):
+        for index in range(5):
+            Product.objects.create(name=f'Item {index} \u2028 caf\u00e9', description='x', price=Decimal(f'{index + 1}.50'), stock=index)
+
+    def test_fast_renderer_matches_json_renderer(self):
+        user = User.objects.create_user(username='render', password='test', email='render@example.com')
+        order = Order.objects.create(user=user)
+        OrderItem.objects.create(order=order, product=Product.objects.first(), quantity=2, unit_price=Decimal('1.50'))
+        data = {
+            'order': OrderSerializer(order).data,
+            'values': [
+                Decimal('12.30'), uuid.uuid4(), datetime(2024, 3, 15, 12, 30, 1, 123456, tzinfo=dt_timezone.utc),
+                datetime(2024, 3, 15, 12, 30), date(2024, 3, 15), dt_time(9, 5), timedelta(hours=1),
+                gettext_lazy('Pending'), 'caf\u00e9 \u2028 \u2029', None, True, 1.5, (1, 2), 2 ** 70,
+            ],
+            1: 'non-string key',
+        }
+        for media_type in (None, 'application/json; indent=4'):
+            self.assertEqual(
+                FastJSONRenderer().render(data, media_type),
+                JSONRenderer().render(data, media_type)
+            )
+        del data[1]
+        data['values'].remove(2 ** 70)
+        self.assertEqual(FastJSONRenderer().render(data), JSONRenderer().render(data))
+
+    def test_product_info_stream_matches_rendered_response(self):
+        url = reverse('product-info')
+        with override_settings(STREAMING_JSON=STREAMING_DISABLED):
+            expected = self.client.get(url).content
+        with override_settings(STREAMING_JSON=STREAMING_SMALL_CHUNKS):
+            response = self.client.get(url)
+        self.assertTrue(response.streaming)
+        self.assertEqual(b''.join(response.streaming_content), expected)
+        self.assertEqual(json.loads(expected)['count'], 5)
+
+    def test_streamed_responses_vary_on_accept(self):
+        # The views add Vary themselves only when they have more than one renderer
+        self.assertEqual(streaming_json_response({'items': []})['Vary'], 'Accept')
+
+    def test_large_product_pages_stream_the_same_bytes(self):
+        url = reverse('product-list')
+        for params in ({'limit': 3}, {'limit': 3, 'offset': 3}, {'limit': 4, 'fields': 'name,price'}, {'limit': 3, 'offset': 9}):
+            with override_settings(STREAMING_JSON=STREAMING_DISABLED):
+                expected = self.client.get(url, params).content
+            with override_settings(STREAMING_JSON=STREAMING_SMALL_CHUNKS):
+                response = self.client.get(url, params)
+            self.assertTrue(response.streaming)
+            self.assertEqual(b''.join(response.streaming_content), expected)
+            self.assertEqual(response['Content-Type'], 'application/json')
+            self.assertIn('Accept', response['Vary'])
+
+        with override_settings(STREAMING_JSON=STREAMING_SMALL_CHUNKS):
+            self.assertFalse(self.client.get(url, {'limit': 2}).streaming)
+            self.assertFalse(self.client.get(url, {'limit': 3}, HTTP_ACCEPT='text/html').streaming)
+
+
+class MetricsTestCase(APITestCase):
+    def setUp(self):
+        metrics_registry.clear()
+        # Keep snapshots of other processes sharing METRICS['DIRECTORY'] out of the counts
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        patcher = mock.patch.object(metrics_registry, 'directory', directory)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_requests_and_queries_are_exposed_per_route(self):
+        Product.objects.create(name='Metered', description='x', price=Decimal('1.00'), stock=1)
+        self.client.get(reverse('product-list'))
+        self.client.get('/no-such-page/')
+
+        response = self.client.get(reverse('metrics'))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertTrue(response['Content-Type'].startswith('text/plain; version=0.0.4'))
+        body = response.content.decode()
+        self.assertIn('http_requests_total{route="product-list",method="GET",status="200"} 1\n', body)
+        self.assertIn('http_requests_total{route="unmatched",method="GET",status="404"} 1\n', body)
+        self.assertIn('http_request_duration_seconds_count{route="product-list",method="GET"} 1\n', body)
+        self.assertIn('http_request_duration_seconds_bucket{route="product-list",method="GET",le="+Inf"} 1\n', body)
+        self.assertIn('db_queries_total{scope="product-list"} 2\n', body)
+
+    def test_snapshots_from_other_processes_are_merged(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        worker, scraper = MetricsRegistry(directory, 60), MetricsRegistry(directory, 60)
+        for registry in (worker, scraper):
+            registry.inc('emails_sent_total', amount=2)
+            registry.observe('email_send_duration_seconds', 0.02, ('sent',))
+        worker.observe('email_send_duration_seconds', 20, ('sent',))
+        worker.flush()
+
+        body = scraper.render()
+        self.assertIn('emails_sent_total 4\n', body)
+        self.assertIn('email_send_duration_seconds_bucket{result="sent",le="0.01"} 0\n', body)
+        self.assertIn('email_send_duration_seconds_bucket{result="sent",le="0.05"} 2\n', body)
+        self.assertIn('email_send_duration_seconds_bucket{result="sent",le="30"} 3\n', body)
+        self.assertIn('email_send_duration_seconds_count{result="sent"} 3\n', body)
+
+    def test_snapshots_of_gone_processes_are_pruned(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        exited = subprocess.run([sys.executable, '-c', 'import os; print(os.getpid())'], capture_output=True, text=True)
+        snapshot = {
+            'counters': [['emails_sent_total', [], 1]],
+            'gauges': [['cache_circuit_state', ['1'], 1]],
+            'histograms': [],
+        }
+        files = {
+            'dead': f'{socket.gethostname()}-{int(exited.stdout)}-dead.json',
+            'idle': f'{socket.gethostname()}-{os.getpid()}-idle.json',
+            'expired': 'other-host-1-expired.json',
+        }
+        for name in files.values():
+            with open(os.path.join(directory, name), 'w') as file:
+                json.dump(snapshot, file)
+        idle = time.time() - 60
+        os.utime(os.path.join(directory, files['idle']), (idle, idle))
+        expired = time.time() - 7200
+        os.utime(os.path.join(directory, files['expired']), (expired, expired))
+
+        counters, _ = MetricsRegistry(directory, flush_interval=5, max_age=3600).collect()
+
+        self.assertEqual(sorted(os.listdir(directory)), [files['idle']])
+        # The idle process keeps its counters; its circuit state is no longer known
+        self.assertEqual(counters['emails_sent_total', ()], 1)
+        self.assertNotIn(('cache_circuit_state', ('1',)), counters)
+
+    def test_cache_hits_and_misses_are_counted(self):
+        backend = InstrumentedLocMemCache('metrics-test', {})
+        self.assertIsNone(backend.get('missing'))
+        backend.set('present', 0)
+        self.assertEqual(backend.get('present', 'default'), 0)
+        self.assertEqual(backend.get_many(['present', 'missing']), {'present': 0})
+
+        counters, _ = metrics_registry.collect()
+        self.assertEqual(counters['cache_requests_total', ('hit',)], 2)
+        self.assertEqual(counters['cache_requests_total', ('miss',)], 2)
+
+    def test_task_durations_and_email_sends_are_recorded(self):
+        user = User.objects.create_user(username='metrics', password='test', email='metrics@example.com')
+        order = Order.objects.create(user=user)
+        metrics_options = dict(settings.METRICS, EMAIL_BACKEND='django.core.mail.backends.locmem.EmailBackend')
+        with override_settings(EMAIL_BACKEND='api.metrics.TimedEmailBackend', METRICS=metrics_options):
+            send_order_status_notifications.delay([str(order.order_id)], Order.StatusChoices.SHIPPED)
+
+        self.assertEqual(len(mail.outbox), 1)
+        counters, histograms = metrics_registry.collect()
+        self.assertEqual(counters['emails_sent_total', ()], 1)
+        self.assertEqual(histograms['email_send_duration_seconds', ('sent',)][-1], 1)
+        task = ('api.tasks.send_order_status_notifications', 'SUCCESS')
+        self.assertEqual(histograms['celery_task_duration_seconds', task][-1], 1)
+        self.assertEqual(counters['db_queries_total', ('api.tasks.send_order_status_notifications',)], 1)
+
+
+class StandInRedis:
+    """Just enough of the Redis protocol on a local socket to answer GET and SET, or to stall"""
+
+    def __init__(self):
+        self.data = {}
+        self.stalled = threading.Event()
+        self.server = socket.create_server(('127.0.0.1', 0))
+        self.url = f'redis://127.0.0.1:{self.server.getsockname()[1]}/0'
+        threading.Thread(target=self._accept, daemon=True).start()
+
+    def close(self):
+        self.stalled.clear()
+        self.server.close()
+
+    def _accept(self):
+        while True:
+            try:
+                connection, _ = self.server.accept()
+            except OSError:
+                return
+            threading.Thread(target=self._serve, args=(connection,), daemon=True).start()
+
+    def _serve(self, connection):
+        reader = connection.makefile('rb')
+        try:
+            while line := reader.readline():
+                args = [reader.read(int(reader.readline()[1:]) + 2)[:-2] for _ in range(int(line[1:]))]
+                while self.stalled.is_set():
+                    time.sleep(0.005)
+                command = args[0].upper()
+                if command == b'GET':
+                    value = self.data.get(args[1])
+                    reply = b'$-1\r\n' if value is None else b'$%d\r\n%s\r\n' % (len(value), value)
+                else:
+                    if command == b'SET':
+                        self.data[args[1]] = args[2]
+                    reply = b'+OK\r\n'
+                connection.sendall(reply)
+        except OSError:
+            pass
+        finally:
+            connection.close()
+
+
+class ResilientCacheTestCase(TestCase):
+    def setUp(self):
+        self.redis = StandInRedis()
+        self.addCleanup(self.redis.close)
+        self.cache = ResilientRedisCache(self.redis.url, {
+            'OPTIONS': {'socket_connect_timeout': 0.05, 'socket_timeout': 0.05},
+            'CIRCUIT_BREAKER': {'FAILURE_THRESHOLD': 3, 'RESET_TIMEOUT': 0.3},
+        })
+        metrics_registry.clear()
+
+    def test_outage_is_answered_locally_with_bounded_latency(self):
+        self.cache.set('hot', 7)
+        self.assertEqual(self.cache.get('hot'), 7)
+
+        self.redis.stalled.set()
+        latencies = []
+        outage_start = time.perf_counter()
+        for index in range(400):
+            start = time.perf_counter()
+            hot, cold = self.cache.get('hot'), self.cache.get(f'cold-{index}', 'default')
+            latencies.append(time.perf_counter() - start)
+            self.assertEqual((hot, cold), (7, 'default'))
+        outage = time.perf_counter() - outage_start
+        self.cache.set('ignored', 1)
+        self.assertTrue(self.cache.add('lock', 1))
+
+        # Only the calls that open the breaker, and one half-open trial per RESET_TIMEOUT
+        # the loop lasted, wait for the socket timeout; every other call is answered locally
+        socket_timeout, breaker = 0.05, self.cache.breaker
+        trials = int(outage / breaker.reset_timeout) + 1
+        waited = [latency for latency in latencies if latency >= socket_timeout]
+        self.assertLessEqual(len(waited), breaker.failure_threshold + trials)
+        # One iteration makes two calls, so it waits for at most two timeouts, plus scheduling slack
+        self.assertLess(max(latencies), 10 * socket_timeout)
+        self.assertEqual(self.cache.breaker.state, 'open')
+        self.assertIn(f'cache_circuit_state{{pid="{os.getpid()}"}} 1\n', metrics_registry.render())
+
+        self.redis.stalled.clear()
+        time.sleep(0.35)
+        self.assertIsNone(self.cache.get('ignored'))
+        self.assertEqual(self.cache.breaker.state, 'closed')
+        counters, _ = metrics_registry.collect()
+        self.assertEqual(counters['cache_circuit_transitions_total', ('closed',)], 1)
+        self.assertGreater(counters['cache_degraded_total', ('get', 'open')], 0)
+
+    def test_local_copy_is_sized_from_redis_bytes_and_only_rewritten_on_change(self):
+        self.cache.set('hot', {'name': 'x' * 100})
+        with mock.patch.object(self.cache.fallback, 'set', wraps=self.cache.fallback.set) as mirror:
+            for _ in range(3):
+                self.assertEqual(self.cache.get('hot'), {'name': 'x' * 100})
+            self.assertEqual(mirror.call_count, 1)
+            self.cache.set('hot', {'name': 'y'})
+            self.cache.get('hot')
+            self.assertEqual(mirror.call_count, 2)
+        raw = self.redis.data[self.cache.make_key('hot').encode()]
+        self.assertEqual(self.cache.fallback.bytes, len(raw))
+
+        self.redis.stalled.set()
+        self.assertEqual(self.cache.get('hot'), {'name': 'y'})
+
+    def test_failed_half_open_trial_reopens_the_breaker(self):
+        self.redis.stalled.set()
+        for _ in range(3):
+            self.cache.get('key')
+        self.assertEqual(self.cache.breaker.state, 'open')
+        time.sleep(0.35)
+        self.cache.get('key')
+        self.assertEqual(self.cache.breaker.state, 'open')
+        with self.assertRaises(ValueError):
+            self.cache.incr('counter')
+
+
+class CacheBatchTestCase(APITestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(username='batched', password='test', email='batched@example.com')
+        self.client.force_authenticate(user=self.user)
+        self.products = [
+            Product.objects.create(name=f'Batched {index}', description='x', price=Decimal('2.00'), stock=50)
+            for index in range(3)
+        ]
+        for _ in range(3):
+            order = Order.objects.create(user=self.user)
+            for product in self.products:
+                OrderItem.objects.create(order=order, product=product, quantity=1)
+
+    def tearDown(self):
+        cache.clear()
+
+    def test_memo_answers_repeated_keys_and_misses(self):
+        cache.set_many({'a': 1, 'b': 2})
+        batch = CacheBatch()
+        self.assertEqual(batch.get_many(['a', 'b', 'c']), {'a': 1, 'b': 2})
+        self.assertEqual(batch.get_many(['b', 'c']), {'b': 2})
+        self.assertEqual(batch.round_trips, 1)
+
+        loaded = batch.get_or_load_many(['a', 'd'], lambda keys: {key: key.upper() for key in keys})
+        self.assertEqual(loaded, {'a': 1, 'd': 'D'})
+        self.assertEqual(cache.get('d'), 'D')
+        self.assertEqual(batch.round_trips, 3)
+
+    def test_loads_racing_a_write_are_returned_but_not_stored(self):
+        generations = iter([1, 2])
+        loaded = CacheBatch().get_or_load_many(['e'], lambda keys: {'e': 'stale'}, generation=lambda: next(generations))
+        self.assertEqual(loaded, {'e': 'stale'})
+        self.assertIsNone(cache.get('e'))
+
+    def test_order_page_reads_its_products_in_one_round_trip(self):
+        url = reverse('user-orders')
+        self.client.get(url)
+        # Drop the cached page so it is rendered again
+        cache.delete(version_key(self.user.id))
+
+        with mock.patch.object(cache, 'get_many', wraps=cache.get_many) as get_many:
+            # COUNT, orders and items; the products come from the cache
+            with self.assertNumQueries(3):
+                response = self.client.get(url)
+        product_lookups = [call for call in get_many.call_args_list if any(key.startswith('product:') for key in call.args[0])]
+        self.assertEqual(len(product_lookups), 1)
+        self.assertEqual(response.data['results'][0]['total_price'], Decimal('6.00'))
+        self.assertEqual(response.data['results'][0]['items'][0]['product_name'], 'Batched 0')
+
+    def test_product_changes_reach_cached_order_pages(self):
+        url = reverse('user-orders')
+        self.client.get(url)
+        admin = User.objects.create_superuser(username='batch-admin', password='test', email='batch-admin@example.com')
+        self.client.force_authenticate(user=admin)
+        self.client.patch(reverse('product-detail', kwargs={'product_id': self.products[0].id}), {'price': '5.00'})
+
+        self.client.force_authenticate(user=self.user)
+        cache.delete(version_key(self.user.id))
+        response = self.client.get(url)
+        self.assertEqual(response.data['results'][0]['items'][0]['product_price'], '5.00')
+        self.assertEqual(response.data['results'][0]['total_price'], Decimal('9.00'))
+
+
+class RelatedProductTestCase(APITestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='shopper', password='test', email='shopper@example.com')
+        self.camera, self.lens, self.bag, self.tripod = [
+            Product.objects.create(name=name, description='x', price=Decimal('10.00'), stock=10)
+            for name in ('Camera', 'Lens', 'Bag', 'Tripod')
+        ]
+        self.order_with(self.camera, self.lens, self.bag)
+        self.order_with(self.camera, self.lens)
+        # Pending and cancelled orders are not counted
+        self.order_with(self.camera, self.tripod, status=Order.StatusChoices.PENDING)
+        self.order_with(self.camera, self.tripod, status=Order.StatusChoices.CANCELLED)
+
+    def order_with(self, *products, status=Order.StatusChoices.CONFIRMED):
+        order = Order.objects.create(user=self.user, status=status)
+        for product in products:
+            OrderItem.objects.create(order=order, product=product, quantity=1)
+        return order
+
+    def related(self, product):
+        return self.client.get(reverse('product-related', kwargs={'product_id': product.id}))
+
+    @override_settings(RELATED_PRODUCTS={'TOP_K': 10, 'CHUNK_SIZE': 2})
+    def test_rebuild_ranks_neighbours_by_orders_together(self):
+        self.assertEqual(rebuild_related_products(), 3)
+
+        with self.assertNumQueries(1):
+            response = self.related(self.camera)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(
+            [(item['name'], item['score']) for item in response.data],
+            [('Lens', 2), ('Bag', 1)]
+        )
+        self.assertEqual([item['name'] for item in self.related(self.bag).data], ['Camera', 'Lens'])
+        self.assertEqual(self.related(self.tripod).data, [])
+        self.assertEqual(self.client.get(reverse('product-related', kwargs={'product_id': 999999})).status_code, 404)
+
+    @override_settings(RELATED_PRODUCTS={'TOP_K': 1, 'CHUNK_SIZE': 1000})
+    def test_only_top_k_neighbours_are_kept(self):
+        rebuild_related_products()
+        self.assertEqual(
+            list(RelatedProduct.objects.filter(product=self.camera).values_list('related__name', 'rank', 'score')),
+            [('Lens', 0, 2)]
+        )
+
+    def test_confirmed_orders_update_their_products_incrementally(self):
+        rebuild_related_products()
+        order = self.order_with(self.bag, self.tripod, status=Order.StatusChoices.PENDING)
+        self.assertEqual(update_related_products([order.order_id]), 2)
+        self.assertEqual(self.related(self.tripod).data, [])
+
+        order.status = Order.StatusChoices.CONFIRMED
+        order.save()
+        update_related_products([order.order_id])
+        # Counting the same order again changes nothing
+        update_related_products([order.order_id])
+        self.assertEqual([(item['name'], item['score']) for item in self.related(self.tripod).data], [('Bag', 1)])
+        self.assertEqual([item['name'] for item in self.related(self.bag).data], ['Camera', 'Lens', 'Tripod'])
+        self.assertEqual([item['score'] for item in self.related(self.camera).data], [2, 1])
+
+    def test_confirming_orders_queues_an_update(self):
+        order = self.order_with(self.lens, self.tripod, status=Order.StatusChoices.PENDING)
+        with self.captureOnCommitCallbacks(execute=True):
+            transition_orders([order.order_id], Order.StatusChoices.CONFIRMED)
+        self.assertEqual([item['name'] for item in self.related(self.tripod).data], ['Lens'])
+
+
+class ProductAutocompleteTestCase(APITestCase):
+    def setUp(self):
+        cache.clear()
+        autocomplete_index.clear()
+        self.headphones, self.headset, self.phone, self.stand = [
+            Product.objects.create(name=name, description='x', price=Decimal('10.00'), stock=10)
+            for name in ('Wireless Headphones', 'Wired Headset', 'Apple iPhone 15', 'Headphone Stand')
+        ]
+        self.url = reverse('product-autocomplete')
+
+    def tearDown(self):
+        autocomplete_index.clear()
+
+    def suggest(self, query, **params):
+        response = self.client.get(self.url, {'q': query, **params})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return [item['name'] for item in response.data]
+
+    def test_last_word_matches_as_a_prefix(self):
+        self.assertEqual(self.suggest('hea'), ['Wireless Headphones', 'Wired Headset', 'Headphone Stand'])
+        # Words before the last one match whole
+        self.assertEqual(self.suggest('wireless head'), ['Wireless Headphones'])
+        self.assertEqual(self.suggest('wire head'), ['Wired Headset'])
+        self.assertEqual(self.suggest('apple ip'), ['Apple iPhone 15'])
+        self.assertEqual(self.suggest('hea', limit=1), ['Wireless Headphones'])
+        self.assertEqual(self.suggest('h'), [])
+
+    def test_typos_match_after_exact_matches(self):
+        self.assertEqual(self.suggest('wirless'), ['Wireless Headphones'])
+        self.assertEqual(self.suggest('hedphones'), ['Wireless Headphones'])
+        self.assertEqual(self.suggest('headphone '), ['Headphone Stand', 'Wireless Headphones'])
+        self.assertEqual(self.suggest('iphno'), ['Apple iPhone 15'])
+        self.assertTrue(one_edit_apart('form', 'from'))
+        self.assertFalse(one_edit_apart('abc', 'bca'))
+
+    def test_swapped_letters_match(self):
+        keyboard = Product.objects.create(name='Wireless Keyboard', description='x', price=Decimal('30.00'), stock=5)
+        Product.objects.create(name='Gaming Monitor', description='x', price=Decimal('200.00'), stock=5)
+        # A swap in the middle of a word breaks four of its trigrams
+        self.assertEqual(self.suggest('keybaord'), ['Wireless Keyboard'])
+        self.assertEqual(self.suggest('moniotr '), ['Gaming Monitor'])
+        self.assertEqual(self.suggest('wirelses '), ['Wireless Headphones', 'Wireless Keyboard'])
+        self.assertEqual(self.suggest('wirelses keybaord'), [keyboard.name])
+
+    def test_product_writes_reach_the_index_without_a_rebuild(self):
+        self.assertEqual(self.suggest('stand'), ['Headphone Stand'])
+        admin = User.objects.create_superuser(username='autocomplete-admin', password='test', email='autocomplete-admin@example.com')
+        self.client.force_authenticate(user=admin)
+        self.client.patch(reverse('product-detail', kwargs={'product_id': self.stand.id}), {'name': 'Headphone Hanger'})
+        self.client.delete(reverse('product-detail', kwargs={'product_id': self.headset.id}))
+        self.client.post(reverse('product-list'), {'name': 'Studio Headphones', 'description': 'x', 'price': '20.00', 'stock': 3})
+
+        with mock.patch.object(autocomplete_index, '_build', wraps=autocomplete_index._build) as build:
+            autocomplete_index._next_sync = 0
+            self.assertEqual(self.suggest('stand'), [])
+            self.assertEqual(self.suggest('head'), ['Wireless Headphones', 'Headphone Hanger', 'Studio Headphones'])
+        build.assert_not_called()
+
+    def test_stock_changes_leave_the_index_alone(self):
+        self.suggest('stand')
+        generation = product_cache.names.current_generation()
+        with self.captureOnCommitCallbacks(execute=True):
+            reserve_stock({self.stand.id: 2, self.phone.id: 1})
+        self.assertEqual(product_cache.names.current_generation(), generation)
+        autocomplete_index._next_sync = 0
+        with self.assertNumQueries(0):
+            self.assertEqual(self.suggest('stand'), ['Headphone Stand'])
+
+    def test_lost_changes_are_rebuilt_in_the_background_while_the_old_index_serves(self):
+        self.suggest('stand')
+        Product.objects.filter(pk=self.stand.pk).update(name='Headphone Hanger')
+        product_cache.invalidate([self.stand.id], names=True)
+        cache.delete(product_cache.names.change_key(product_cache.names.current_generation()))
+
+        with mock.patch('api.autocomplete.threading.Thread') as thread:
+            for _ in range(2):
+                autocomplete_index._next_sync = 0
+                self.assertEqual(self.suggest('stand'), ['Headphone Stand'])
+        thread.assert_called_once()
+        self.assertEqual(thread.call_args.kwargs['target'], autocomplete_index._rebuild_in_background)
+
+        # What the thread runs, short of closing its database connection
+        autocomplete_index._rebuild()
+        self.assertEqual(self.suggest('stand'), [])
+        self.assertEqual(self.suggest('hanger'), ['Headphone Hanger'])
+
+
+class ProductBatchTestCase(APITestCase):
+    def setUp(self):
+        cache.clear()
+        self.products = [
+            Product.objects.create(name=f'Batch {index}', description='x', price=Decimal('3.00'), stock=index)
+            for index in range(3)
+        ]
+        self.url = reverse('product-batch')
+
+    def tearDown(self):
+        cache.clear()
+
+    def test_products_come_back_in_request_order_with_missing_ids(self):
+        first, second, third = (product.id for product in self.products)
+        ids = f'{third},999999,{first},{third}'
+        with self.assertNumQueries(1):
+            response = self.client.get(self.url, {'ids': ids})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual([item['id'] for item in response.data['results']], [third, first])
+        self.assertEqual(response.data['results'][0]['name'], 'Batch 2')
+        self.assertEqual(response.data['missing'], [999999])
+
+        # Cached products cost no query; only the missing id is looked up again
+        with self.assertNumQueries(1):
+            response = self.client.post(self.url, {'ids': [first, second, 999999]}, format='json')
+        self.assertEqual([item['id'] for item in response.data['results']], [first, second])
+
+        response = self.client.get(self.url, {'ids': f'{second},{first}', 'fields': 'id,stock'})
+        self.assertEqual(response.data['results'], [{'id': second, 'stock': 1}, {'id': first, 'stock': 0}])
+
+    def test_batch_size_and_ids_are_validated(self):
+        too_many = ','.join(str(product_id) for product_id in range(1, 102))
+        self.assertEqual(self.client.get(self.url, {'ids': too_many}).status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(self.client.get(self.url, {'ids': '1,abc'}).status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(self.client.get(self.url).status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_product_writes_reach_the_batch(self):
+        self.client.get(self.url, {'ids': self.products[0].id})
+        admin = User.objects.create_superuser(username='batch-fetch-admin', password='test', email='batch-fetch-admin@example.com')
+        self.client.force_authenticate(user=admin)
+        self.client.patch(reverse('product-detail', kwargs={'product_id': self.products[0].id}), {'price': '4.50'})
+        response = self.client.get(self.url, {'ids': self.products[0].id})
+        self.assertEqual(response.data['results'][0]['price'], '4.50')
+
+
+class StockHoldTestCase(APITestCase):
+    def setUp(self):
+        cache.clear()
+        self.customer = User.objects.create_user(username='holder', password='test', email='holder@example.com')
+        self.product = Product.objects.create(name='Held', description='x', price=Decimal('5.00'), stock=10)
+        record_stock_movements([(self.product.id, 10)], StockMovement.KindChoices.OPENING)
+
+    def tearDown(self):
+        cache.clear()
+
+    def hold(self, quantity, expires_in, **fields):
+        """A pending order whose items already came out of stock"""
+        order = Order.objects.create(user=self.customer, expires_at=timezone.now() + timedelta(seconds=expires_in), **fields)
+        OrderItem.objects.create(order=order, product=self.product, quantity=quantity)
+        Product.objects.filter(pk=self.product.pk).update(stock=F('stock') - quantity)
+        return order
+
+    def test_pending_orders_get_a_hold(self):
+        self.client.force_authenticate(user=self.customer)
+        before = timezone.now()
+        response = self.client.post(reverse('order-create'), {}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        order = Order.objects.get(pk=response.data['order_id'])
+        self.assertGreaterEqual(order.expires_at, before + timedelta(seconds=settings.STOCK_HOLDS['TTL']))
+
+        # Skipping the hold by creating the order as confirmed is refused
+        response = self.client.post(reverse('order-create'), {'status': 'Confirmed'}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(Order.objects.count(), 1)
+
+    def test_expired_holds_are_cancelled_and_released(self):
+        expired = [self.hold(2, -60), self.hold(3, -30)]
+        live = self.hold(1, 600)
+        confirmed = self.hold(4, -60, status=Order.StatusChoices.CONFIRMED)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.assertEqual(release_expired_holds(batch_size=1), 2)
+
+        statuses = dict(Order.objects.values_list('order_id', 'status'))
+        self.assertEqual([statuses[order.order_id] for order in expired], ['Cancelled', 'Cancelled'])
+        self.assertEqual(statuses[live.order_id], 'Pending')
+        self.assertEqual(statuses[confirmed.order_id], 'Confirmed')
+        self.product.refresh_from_db()
+        self.assertEqual(self.product.stock, 10 - 1 - 4)
+        self.assertEqual(OrderHistory.objects.filter(reason='Stock hold expired').count(), 2)
+        # The reaper's stock change agrees with the ledger reconciliation
+        self.assertEqual(reconcile_range(self.product.id, self.product.id + 1), [])
+
+        self.assertEqual(release_expired_holds_task.delay().get(), 0)
+
+    def test_every_cancellation_releases_stock_once(self):
+        patched, bulk = self.hold(2, 600), self.hold(3, 600)
+        confirmed = self.hold(4, 600, status=Order.StatusChoices.CONFIRMED)
+        self.client.force_authenticate(user=self.customer)
+        url = reverse('order-detail', kwargs={'order_id': patched.order_id})
+        response = self.client.patch(url, {'status': 'Cancelled'}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(self.client.patch(url, {'status': 'Cancelled'}, format='json').status_code, status.HTTP_200_OK)
+        self.assertEqual(self.client.patch(url, {'status': 'Pending'}, format='json').status_code, status.HTTP_400_BAD_REQUEST)
+
+        admin = User.objects.create_superuser(username='hold-admin', password='test', email='hold-admin@example.com')
+        self.client.force_authenticate(user=admin)
+        response = self.client.post(reverse('order-bulk-status'), {
+            'order_ids': [str(bulk.order_id), str(confirmed.order_id)], 'status': 'Cancelled'
+        }, format='json')
+        self.assertEqual(len(response.data['updated']), 2)
+
+        self.product.refresh_from_db()
+        self.assertEqual(self.product.stock, 10)
+        self.assertEqual(reconcile_range(self.product.id, self.product.id + 1), [])
+
+    def test_deleting_orders_releases_the_stock_they_hold(self):
+        deleted, selected, confirmed = self.hold(2, 600), self.hold(3, 600), self.hold(4, 600, status=Order.StatusChoices.CONFIRMED)
+        # Cancelled orders gave their stock back already
+        cancelled = Order.objects.create(user=self.customer, status=Order.StatusChoices.CANCELLED)
+        OrderItem.objects.create(order=cancelled, product=self.product, quantity=5)
+
+        self.client.force_authenticate(user=self.customer)
+        response = self.client.delete(reverse('order-detail', kwargs={'order_id': deleted.order_id}))
+        self.assertEqual(response.status_code, status.HTTP_204_NO_CONTENT)
+
+        admin = User.objects.create_superuser(username='delete-admin', password='test', email='delete-admin@example.com')
+        self.client.force_login(admin)
+        self.client.post(reverse('admin:api_order_delete', args=[confirmed.pk]), {'post': 'yes'})
+        self.client.post(reverse('admin:api_order_changelist'), {
+            'action': 'delete_selected', '_selected_action': [selected.pk, cancelled.pk], 'post': 'yes'
+        })
+
+        self.assertFalse(Order.objects.exists())
+        self.product.refresh_from_db()
+        self.assertEqual(self.product.stock, 10)
+        self.assertEqual(reconcile_range(self.product.id, self.product.id + 1), [])
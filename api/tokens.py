@@ -0,0 +1,69 @@
+import time
+from django.conf import settings
+from django.core.cache import cache
+from django.utils.crypto import constant_time_compare, salted_hmac
+from django.utils.http import base36_to_int, int_to_base36
+
+
+class TokenService:
+    """Stateless HMAC tokens of the form `<user id>-<expiry>-<signature>`.
+
+    A token is checked against the secret key and an optional piece of state
+    (e.g. the user's email or password hash), so verifying it needs neither a
+    cache nor a database lookup. Revoked tokens are kept in the cache until
+    they would have expired anyway, and only consulted when revocation is on.
+    """
+
+    def __init__(self, purpose, max_age):
+        self.key_salt = f'api.tokens.{purpose}'
+        self.max_age = max_age
+
+    def make_token(self, user_id, state=''):
+        payload = f'{int_to_base36(user_id)}-{int_to_base36(int(time.time()) + self.max_age)}'
+        return f'{payload}-{self._signature(payload, state)}'
+
+    def check_token(self, token, state=''):
+        """Return the user id the token was issued for, or None"""
+        parsed = self._parse(token)
+        if parsed is None:
+            return None
+        user_id, expires, payload, signature = parsed
+        if expires < time.time():
+            return None
+        if not constant_time_compare(signature, self._signature(payload, state)):
+            return None
+        if settings.AUTH_TOKEN_REVOCATION and cache.get(self._revocation_key(signature)):
+            return None
+        return user_id
+
+    def get_user_id(self, token):
+        """Read the user id without checking the signature, to look up the state to check against"""
+        parsed = self._parse(token)
+        return parsed[0] if parsed else None
+
+    def revoke(self, token):
+        """Reject the token from now on; a no-op unless AUTH_TOKEN_REVOCATION is on"""
+        if not settings.AUTH_TOKEN_REVOCATION:
+            return
+        parsed = self._parse(token)
+        if parsed is not None:
+            remaining = int(parsed[1] - time.time())
+            if remaining > 0:
+                cache.set(self._revocation_key(parsed[3]), True, timeout=remaining)
+
+    def _parse(self, token):
+        try:
+            user_b36, expires_b36, signature = token.split('-')
+            return base36_to_int(user_b36), base36_to_int(expires_b36), f'{user_b36}-{expires_b36}', signature
+        except (AttributeError, ValueError):
+            return None
+
+    def _signature(self, payload, state):
+        return salted_hmac(self.key_salt, f'{payload}:{state}', algorithm='sha256').hexdigest()[::2]
+
+    def _revocation_key(self, signature):
+        return f'revoked_token_{self.key_salt}_{signature}'
+
+
+email_verification_tokens = TokenService('email-verification', settings.EMAIL_VERIFICATION_TOKEN_MAX_AGE)
+password_reset_tokens = TokenService('password-reset', settings.PASSWORD_RESET_TOKEN_MAX_AGE)
@@ -4,17 +4,31 @@ from . import auth_views
 
 urlpatterns = [
     # Product endpoints
-    path('products/', views.ProductListCreateAPIView.as_view()),
-    path('products/info/', views.ProductInfoAPIView.as_view()),
-    path('products/<int:product_id>/', views.ProductDetailAPIView.as_view()),
+    path('products/', views.ProductListCreateAPIView.as_view(), name='product-list'),
+    path('products/info/', views.ProductInfoAPIView.as_view(), name='product-info'),
+    path('products/autocomplete/', views.ProductAutocompleteAPIView.as_view(), name='product-autocomplete'),
+    path('products/batch/', views.ProductBatchAPIView.as_view(), name='product-batch'),
+    path('products/cache-stats/', views.ProductCacheStatsAPIView.as_view(), name='product-cache-stats'),
+    path('products/<int:product_id>/', views.ProductDetailAPIView.as_view(), name='product-detail'),
+    path('products/<int:product_id>/related/', views.ProductRelatedAPIView.as_view(), name='product-related'),
     
     # Order endpoints
-    path('orders/', views.OrderListAPIView.as_view()),
+    path('orders/', views.OrderListAPIView.as_view(), name='order-list'),
     path('orders/create/', views.OrderCreateAPIView.as_view(), name='order-create'),
+    path('orders/bulk-status/', views.OrderBulkStatusAPIView.as_view(), name='order-bulk-status'),
+    path('orders/events/', views.order_event_stream, name='order-events'),
     path('orders/<uuid:order_id>/', views.OrderDetailAPIView.as_view(), name='order-detail'),
     path('orders/<uuid:order_id>/items/', views.OrderItemCreateAPIView.as_view(), name='order-item-create'),
+    path('quote/', views.QuoteAPIView.as_view(), name='quote'),
     path('order-items/<int:pk>/', views.OrderItemDetailAPIView.as_view(), name='order-item-detail'),
     path('user-orders/', views.UserOrderListAPIView.as_view(), name='user-orders'),
+
+    # Monitoring endpoints
+    path('metrics', views.metrics, name='metrics'),
+
+    # Profiling endpoints
+    path('profiles/', views.ProfileListAPIView.as_view(), name='profile-list'),
+    path('profiles/<str:profile_id>/', views.ProfileDetailAPIView.as_view(), name='profile-detail'),
     
     # Authentication endpoints
     path('auth/register/', auth_views.UserRegistrationView.as_view(), name='register'),
@@ -1,8 +1,26 @@
+from django.core.exceptions import ValidationError as DjangoValidationError
+from django.db import transaction
 from django.db.models import Max
-from api.serializers import ProductSerializer, OrderSerializer, ProductInfoSerializer, OrderItemSerializer
-from api.models import Product, Order, OrderItem
+from api.serializers import (
+    ProductSerializer,
+    OrderSerializer,
+    ProductInfoSerializer,
+    OrderItemSerializer,
+    OrderBulkStatusSerializer,
+    OrderItemBatchSerializer,
+    QuoteRequestSerializer,
+    RelatedProductSerializer,
+    ProductAutocompleteSerializer,
+    ProductBatchSerializer,
+    ProductBatchItemSerializer,
+    cached_products
+)
+from api.models import Product, Order, OrderItem, RelatedProduct, StockMovement
+from api.model_validators import BusinessLogicValidator
 from rest_framework.response import Response
-from rest_framework import generics
+from rest_framework import generics, serializers
+from django.shortcuts import get_object_or_404
+from drf_spectacular.utils import OpenApiParameter, extend_schema
 from rest_framework.permissions import (
     IsAuthenticated,
     IsAdminUser,
@@ -10,14 +28,37 @@ from rest_framework.permissions import (
 )
 from rest_framework.views import APIView
 from api.filters import ProductFilter, InStockFilterBackend
+from api.order_status import transition_orders, record_status_change
+from api.inventory import delete_orders, record_stock_movements
+from api.pricing import build_quote, sign_quote
+from api.idempotency import IdempotentMixin
+from api.product_cache import product_cache
+from api.autocomplete import autocomplete_index
+from api.profiling import profile_buffer
+from django.core.handlers.asgi import ASGIRequest
+from django.http import Http404, HttpResponse, JsonResponse, StreamingHttpResponse
+from django.conf import settings
+from asgiref.sync import sync_to_async
+from rest_framework_simplejwt.authentication import JWTAuthentication
+from rest_framework.exceptions import AuthenticationFailed
+from api.events import order_event_hub
+from api.fieldsets import SparseFieldsetViewMixin
+from api.renderers import FAST_RENDERER_CLASSES, StreamedList, streaming_json_response, streams_json
+from api.metrics import registry as metrics_registry
+from api.facets import FacetedLimitOffsetPagination, parse_price_buckets, product_facets
+import asyncio
+import json
+from api.order_cache import get_user_order_pages, store_user_order_page, invalidate_user_orders
+from django.utils.http import parse_etags
+from rest_framework import status
 from rest_framework import filters
 from django_filters.rest_framework import DjangoFilterBackend
-from rest_framework.pagination import PageNumberPagination, LimitOffsetPagination
 
 
-class ProductListCreateAPIView(generics.ListCreateAPIView):
+class ProductListCreateAPIView(SparseFieldsetViewMixin, generics.ListCreateAPIView):
     queryset = Product.objects.order_by('pk')
     serializer_class = ProductSerializer
+    renderer_classes = FAST_RENDERER_CLASSES
     filterset_class = ProductFilter
     filter_backends = [
         DjangoFilterBackend,
@@ -27,7 +68,7 @@ class ProductListCreateAPIView(generics.ListCreateAPIView):
     ]
     search_fields = ['=name', 'description']
     ordering_fields = ['name', 'price', 'stock']
-    pagination_class = LimitOffsetPagination
+    pagination_class = FacetedLimitOffsetPagination
     # pagination_class.page_size = 2
     # pagination_class.page_query_param = 'pagenum'
     # pagination_class.page_size_query_param = 'size'
@@ -39,6 +80,59 @@ class ProductListCreateAPIView(generics.ListCreateAPIView):
             self.permission_classes = [IsAdminUser]
         return super().get_permissions()
 
+    def perform_create(self, serializer):
+        product = serializer.save()
+        record_stock_movements([(product.id, product.stock)], StockMovement.KindChoices.OPENING)
+        # Moves the catalog generation so cached facet counts include the new product
+        product_cache.invalidate([product.id], names=True)
+
+    @extend_schema(parameters=[
+        OpenApiParameter('facets', bool, description='Add availability, stock status and price facet counts'),
+        OpenApiParameter('price_buckets', str, description='Comma-separated lower edges of the price buckets'),
+    ])
+    def get(self, request, *args, **kwargs):
+        return super().get(request, *args, **kwargs)
+
+    def list(self, request, *args, **kwargs):
+        if request.query_params.get('facets') not in ('1', 'true'):
+            limit = self.paginator.get_limit(request)
+            if limit is not None and limit >= settings.STREAMING_JSON['MIN_ITEMS'] and streams_json(request):
+                return self.stream_list(request)
+            return super().list(request, *args, **kwargs)
+
+        price_buckets = parse_price_buckets(request.query_params.get('price_buckets'))
+        queryset = self.get_queryset()
+        for backend in self.filter_backends:
+            # Availability is counted both ways, so the in-stock filter is applied after the facets
+            if backend is not InStockFilterBackend:
+                queryset = backend().filter_queryset(request, queryset, self)
+        signature = sorted(
+            (key, value) for key, value in request.query_params.lists()
+            if key not in ('limit', 'offset', 'ordering', 'facets', 'price_buckets')
+        )
+        facets = product_facets(queryset, price_buckets, signature)
+
+        self.paginator.known_count = facets['total']
+        page = self.paginate_queryset(InStockFilterBackend().filter_queryset(request, queryset, self))
+        response = self.get_paginated_response(self.get_serializer(page, many=True).data)
+        response.data['facets'] = facets
+        return response
+
+    def stream_list(self, request):
+        # Large pages are serialized a chunk at a time rather than all at once
+        self.paginator.lazy = True
+        page = self.paginate_queryset(self.filter_queryset(self.get_queryset()))
+        paginator = self.paginator
+        return streaming_json_response({
+            'count': paginator.count,
+            'next': paginator.get_next_link(),
+            'previous': paginator.get_previous_link(),
+            'results': StreamedList(
+                page.iterator(chunk_size=settings.STREAMING_JSON['CHUNK_SIZE']),
+                lambda batch: self.get_serializer(batch, many=True).data
+            ),
+        })
+
 
 class ProductDetailAPIView(generics.RetrieveUpdateDestroyAPIView):
     queryset = Product.objects.all()
@@ -49,16 +143,147 @@ class ProductDetailAPIView(generics.RetrieveUpdateDestroyAPIView):
         self.permission_classes = [AllowAny]
         if self.request.method in ['PUT', 'PATCH', 'DELETE']:
             self.permission_classes = [IsAdminUser]
-        return super().get_permissions()    
+        return super().get_permissions()
+
+    def retrieve(self, request, *args, **kwargs):
+        # The cache holds the full representation; ?fields= and ?omit= are applied on the way out
+        data = product_cache.get(
+            self.kwargs['product_id'],
+            lambda: ProductSerializer(self.get_object()).data
+        )
+        fields = self.get_serializer().fields
+        return Response({name: value for name, value in data.items() if name in fields})
+
+    def perform_update(self, serializer):
+        old_stock = serializer.instance.stock
+        product = serializer.save()
+        record_stock_movements([(product.id, product.stock - old_stock)], StockMovement.KindChoices.ADJUSTMENT)
+        product_cache.invalidate([product.id], names='name' in serializer.validated_data)
+
+    def perform_destroy(self, instance):
+        product_id = instance.id
+        instance.delete()
+        product_cache.invalidate([product_id], names=True)
+
+
+class ProductRelatedAPIView(generics.ListAPIView):
+    """Products most often bought together with this one, best first"""
+    serializer_class = RelatedProductSerializer
+    permission_classes = [AllowAny]
+    pagination_class = None
+
+    def get_queryset(self):
+        # One lookup on the (product, rank) index, joined to the neighbours
+        return (
+            RelatedProduct.objects.filter(product_id=self.kwargs['product_id'])
+            .select_related('related')
+            .order_by('rank')
+        )
+
+    def list(self, request, *args, **kwargs):
+        response = super().list(request, *args, **kwargs)
+        if not response.data and not Product.objects.filter(pk=self.kwargs['product_id']).exists():
+            raise Http404
+        return response
+
+
+class ProductAutocompleteAPIView(APIView):
+    permission_classes = [AllowAny]
+
+    @extend_schema(
+        parameters=[
+            OpenApiParameter('q', str, description='What has been typed so far; the last word matches as a prefix'),
+            OpenApiParameter('limit', int, description='Number of suggestions'),
+        ],
+        responses=ProductAutocompleteSerializer(many=True)
+    )
+    def get(self, request):
+        """Product names matching every word typed so far, allowing a typo in words of four or more letters"""
+        options = settings.AUTOCOMPLETE
+        query = request.query_params.get('q', '')
+        try:
+            limit = int(request.query_params.get('limit', options['LIMIT']))
+        except ValueError:
+            raise serializers.ValidationError({'limit': 'A valid integer is required.'})
+        limit = max(1, min(limit, options['MAX_LIMIT']))
+        if len(query.strip()) < options['MIN_LENGTH']:
+            return Response([])
+        return Response([{'id': product_id, 'name': name} for product_id, name in autocomplete_index.search(query, limit)])
+
+
+class ProductBatchAPIView(APIView):
+    serializer_class = ProductBatchSerializer
+    permission_classes = [AllowAny]
+
+    @extend_schema(
+        parameters=[OpenApiParameter('ids', str, required=True, description='Comma-separated product ids, at most 100')],
+        responses=ProductBatchSerializer
+    )
+    def get(self, request):
+        """Many products in the order of their ids, plus the ids that match no product"""
+        ids = [part for value in request.query_params.getlist('ids') for part in value.split(',') if part.strip()]
+        return self.batch(request, {'ids': ids})
+
+    def post(self, request):
+        """Many products in the order of their ids, plus the ids that match no product"""
+        return self.batch(request, request.data)
+
+    def batch(self, request, data):
+        serializer = self.serializer_class(data=data)
+        serializer.is_valid(raise_exception=True)
+        product_ids = list(dict.fromkeys(serializer.validated_data['ids']))
+        found = cached_products(product_ids, {'request': request})
+        # The cache holds full representations; ?fields= and ?omit= are applied on the way out
+        fields = ProductBatchItemSerializer(context={'request': request}).fields
+        results = []
+        for product_id in product_ids:
+            if product_id in found:
+                data = {'id': product_id, **found[product_id]}
+                results.append({name: value for name, value in data.items() if name in fields})
+        return Response({
+            'results': results,
+            'missing': [product_id for product_id in product_ids if product_id not in found],
+        })
+
+
+class ProductCacheStatsAPIView(APIView):
+    permission_classes = [IsAdminUser]
+
+    def get(self, request):
+        return Response(product_cache.stats())
     
 
-class OrderListAPIView(generics.ListAPIView):
-    queryset = Order.objects.prefetch_related('items__product')
+class ProfileListAPIView(APIView):
+    permission_classes = [IsAdminUser]
+
+    @extend_schema(operation_id='profiles_list')
+    def get(self, request):
+        return Response(profile_buffer.list())
+
+
+class ProfileDetailAPIView(APIView):
+    permission_classes = [IsAdminUser]
+
+    def get(self, request, profile_id):
+        """Download a captured profile as pstats data (snakeviz, flameprof), or ?output=text"""
+        profile = profile_buffer.get(profile_id)
+        if profile is None:
+            raise Http404
+        if request.query_params.get('output') == 'text':
+            return HttpResponse(profile['text'], content_type='text/plain')
+        response = HttpResponse(profile['stats'], content_type='application/octet-stream')
+        response['Content-Disposition'] = f'attachment; filename="{profile_id}.prof"'
+        return response
+
+
+class OrderListAPIView(SparseFieldsetViewMixin, generics.ListAPIView):
+    queryset = Order.objects.all()
     serializer_class = OrderSerializer
 
 
-class UserOrderListAPIView(generics.ListAPIView):
-    queryset = Order.objects.prefetch_related('items__product')
+class UserOrderListAPIView(SparseFieldsetViewMixin, generics.ListAPIView):
+    # A stable order keeps each cached page's contents well defined
+    queryset = Order.objects.order_by('-created_at', 'pk')
     serializer_class = OrderSerializer
     permission_classes = [IsAuthenticated]
 
@@ -66,37 +291,104 @@ class UserOrderListAPIView(generics.ListAPIView):
         qs = super().get_queryset()
         return qs.filter(user=self.request.user)
 
+    def list(self, request, *args, **kwargs):
+        url = request.build_absolute_uri()
+        version, pages = get_user_order_pages(request.user.id)
+        if url in pages:
+            etag, data, _ = pages[url]
+            response = Response(data)
+        else:
+            response = super().list(request, *args, **kwargs)
+            etag = store_user_order_page(request.user.id, version, pages, url, response.data)
+
+        if etag in parse_etags(request.headers.get('If-None-Match', '')):
+            response = Response(status=status.HTTP_304_NOT_MODIFIED)
+        response['ETag'] = etag
+        response['Cache-Control'] = 'private, no-cache'
+        return response
+
 
 class ProductInfoAPIView(APIView):
+    renderer_classes = FAST_RENDERER_CLASSES
+
     def get(self, request):
         products = Product.objects.all()
+        max_price = products.aggregate(max_price=Max('price'))['max_price']
+        if streams_json(request):
+            # Same body as below, but products are written in chunks and counted on the way
+            listing = StreamedList(
+                products.iterator(chunk_size=settings.STREAMING_JSON['CHUNK_SIZE']),
+                lambda batch: ProductSerializer(batch, many=True).data
+            )
+            data = ProductInfoSerializer({'products': [], 'count': 0, 'max_price': max_price}).data
+            return streaming_json_response(dict(data, products=listing, count=lambda: listing.count))
+
         serializer = ProductInfoSerializer({
             'products': products,
             'count': len(products),
-            'max_price': products.aggregate(max_price=Max('price'))['max_price']
+            'max_price': max_price
         })
         return Response(serializer.data)
 
 
-class OrderCreateAPIView(generics.CreateAPIView):
+class OrderCreateAPIView(IdempotentMixin, generics.CreateAPIView):
     serializer_class = OrderSerializer
     permission_classes = [IsAuthenticated]
 
     def perform_create(self, serializer):
         serializer.save(user=self.request.user)
+        invalidate_user_orders([self.request.user.id])
 
 
-class OrderDetailAPIView(generics.RetrieveUpdateDestroyAPIView):
+class OrderDetailAPIView(IdempotentMixin, SparseFieldsetViewMixin, generics.RetrieveUpdateDestroyAPIView):
     queryset = Order.objects.all()
     serializer_class = OrderSerializer
     permission_classes = [IsAuthenticated]
     lookup_field = 'order_id'
 
     def get_queryset(self):
-        return Order.objects.filter(user=self.request.user)
+        return super().get_queryset().filter(user=self.request.user)
+
+    @transaction.atomic
+    def perform_update(self, serializer):
+        # Lock the order so that two concurrent cancellations cannot both release its stock
+        old_status = Order.objects.select_for_update().values_list('status', flat=True).get(pk=serializer.instance.pk)
+        new_status = serializer.validated_data.get('status', old_status)
+        if new_status != old_status:
+            try:
+                BusinessLogicValidator.validate_order_status_transition(old_status, new_status)
+            except DjangoValidationError as e:
+                raise serializers.ValidationError({'status': e.messages})
+        order = serializer.save()
+        if order.status != old_status:
+            record_status_change(order, old_status, changed_by=self.request.user)
+        invalidate_user_orders([order.user_id])
+
+    def perform_destroy(self, instance):
+        delete_orders(Order.objects.filter(pk=instance.pk))
+        invalidate_user_orders([instance.user_id])
+
+
+class OrderBulkStatusAPIView(IdempotentMixin, APIView):
+    serializer_class = OrderBulkStatusSerializer
+    permission_classes = [IsAdminUser]
+
+    def post(self, request):
+        serializer = self.serializer_class(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        updated, rejected = transition_orders(
+            serializer.validated_data['order_ids'],
+            serializer.validated_data['status'],
+            changed_by=request.user,
+            reason=serializer.validated_data['reason']
+        )
+        return Response({
+            'updated': [str(order_id) for order_id in updated],
+            'rejected': {str(order_id): error for order_id, error in rejected.items()}
+        })
 
 
-class OrderItemCreateAPIView(generics.CreateAPIView):
+class OrderItemCreateAPIView(IdempotentMixin, generics.CreateAPIView):
     serializer_class = OrderItemSerializer
     permission_classes = [IsAuthenticated]
 
@@ -107,11 +399,117 @@ class OrderItemCreateAPIView(generics.CreateAPIView):
             serializer.save(order=order)
         except Order.DoesNotExist:
             raise serializers.ValidationError("Order not found or you don't have permission to add items to this order.")
+        invalidate_user_orders([self.request.user.id])
+
+    @extend_schema(request=OrderItemBatchSerializer, responses=OrderSerializer)
+    def patch(self, request, order_id):
+        """Add, update and remove many items of the order in one transaction"""
+        order = get_object_or_404(Order, order_id=order_id, user=request.user)
+        serializer = OrderItemBatchSerializer(order, data=request.data)
+        serializer.is_valid(raise_exception=True)
+        serializer.save()
+        invalidate_user_orders([request.user.id])
+        order = Order.objects.prefetch_related('items__product').get(pk=order.pk)
+        return Response(OrderSerializer(order).data)
 
 
-class OrderItemDetailAPIView(generics.RetrieveUpdateDestroyAPIView):
+class OrderItemDetailAPIView(IdempotentMixin, generics.RetrieveUpdateDestroyAPIView):
     serializer_class = OrderItemSerializer
     permission_classes = [IsAuthenticated]
 
     def get_queryset(self):
         return OrderItem.objects.filter(order__user=self.request.user)
+
+    # Single-item edits go through the batch logic, so they adjust stock and only touch pending orders
+    def perform_update(self, serializer):
+        item = serializer.instance
+        quantity = serializer.validated_data.get('quantity', item.quantity)
+        batch = OrderItemBatchSerializer(item.order, data={
+            'operations': [{'op': 'update', 'id': item.id, 'quantity': quantity}]
+        })
+        batch.is_valid(raise_exception=True)
+        batch.save()
+        item.quantity = quantity
+        invalidate_user_orders([self.request.user.id])
+
+    def perform_destroy(self, instance):
+        OrderItemBatchSerializer().update(instance.order, {'operations': [{'op': 'remove', 'id': instance.id}]})
+        invalidate_user_orders([self.request.user.id])
+
+
+class QuoteAPIView(APIView):
+    serializer_class = QuoteRequestSerializer
+    permission_classes = [AllowAny]
+
+    def post(self, request):
+        serializer = self.serializer_class(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        quote = build_quote([
+            (item['product_id'], item['quantity']) for item in serializer.validated_data['items']
+        ])
+        data = {
+            'items': [
+                {
+                    'product_id': line.product_id,
+                    'name': line.name,
+                    'unit_price': str(line.unit_price),
+                    'quantity': line.quantity,
+                    'line_total': str(line.line_total),
+                    'in_stock': line.in_stock,
+                }
+                for line in quote.lines
+            ],
+            'total': str(quote.total),
+            'missing': quote.missing,
+        }
+        if serializer.validated_data['sign'] and quote.lines and not quote.missing:
+            data['quote_token'] = sign_quote(quote)
+        return Response(data)
+
+
+async def order_event_stream(request):
+    """Server-sent events for the user's order status changes; only served under ASGI"""
+    if not isinstance(request, ASGIRequest):
+        # A WSGI server would buffer the endless stream and hold a worker thread forever
+        return JsonResponse(
+            {'detail': 'Order event streams need the ASGI server (drf_project.asgi).'},
+            status=501
+        )
+    user = await request.auser()
+    if not user.is_authenticated:
+        try:
+            authenticated = await sync_to_async(JWTAuthentication().authenticate)(request)
+        except AuthenticationFailed:
+            authenticated = None
+        if authenticated is None:
+            return JsonResponse({'detail': 'Authentication credentials were not provided.'}, status=401)
+        user = authenticated[0]
+
+    keepalive = settings.ORDER_EVENTS['KEEPALIVE']
+
+    async def events():
+        # Subscribed from the loop that reads the stream, which the queue is bound to
+        queue = order_event_hub.subscribe(user.id)
+        try:
+            yield 'retry: 5000\n\n'
+            while True:
+                try:
+                    event = await asyncio.wait_for(queue.get(), timeout=keepalive)
+                except asyncio.TimeoutError:
+                    yield ': keep-alive\n\n'
+                    continue
+                event = {key: value for key, value in event.items() if key != 'user_id'}
+                yield f'event: order_status\ndata: {json.dumps(event)}\n\n'
+        finally:
+            order_event_hub.unsubscribe(user.id, queue)
+
+    response = StreamingHttpResponse(events(), content_type='text/event-stream')
+    response['Cache-Control'] = 'no-cache'
+    # Stop nginx from buffering the stream
+    response['X-Accel-Buffering'] = 'no'
+    return response
+
+
+def metrics(request):
+    """Prometheus scrape endpoint, merged across every process writing to METRICS['DIRECTORY']"""
+    return HttpResponse(metrics_registry.render(), content_type='text/plain; version=0.0.4; charset=utf-8')
@@ -1,5 +1,6 @@
 import os
 from celery import Celery
+from celery.signals import task_postrun, task_prerun
 
 # Set the default Django settings module for the 'celery' program.
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'drf_project.settings')
@@ -14,6 +15,18 @@ app.config_from_object('django.conf:settings', namespace='CELERY')
 app.autodiscover_tasks()
 
 
+@task_prerun.connect
+def start_task_timer(**kwargs):
+    from api.metrics import task_started
+    task_started(**kwargs)
+
+
+@task_postrun.connect
+def record_task_duration(**kwargs):
+    from api.metrics import task_finished
+    task_finished(**kwargs)
+
+
 @app.task(bind=True)
 def debug_task(self):
     print(f'Request: {self.request!r}')
@@ -33,6 +33,8 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    # Must stay first: it times everything below it
+    'api.metrics.MetricsMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -40,6 +42,8 @@ MIDDLEWARE = [
     'django.contrib.auth.middleware.AuthenticationMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
+    # Must stay last: it wraps only the view
+    'api.profiling.ProfilingMiddleware',
 ]
 
 ROOT_URLCONF = 'drf_project.urls'
@@ -139,8 +143,116 @@ SPECTACULAR_SETTINGS = {
     # OTHER SETTINGS
 }
 
+# Precompiled OpenAPI schema, regenerated with `manage.py check_schema --write`
+API_SCHEMA_FILE = BASE_DIR / 'schema.yml'
+API_SCHEMA_PRECOMPILED = not DEBUG
+
+# Seconds a signed /quote/ token can be used at checkout
+QUOTE_TOKEN_MAX_AGE = 15 * 60
+
+# Stored responses for requests sent with an Idempotency-Key header
+IDEMPOTENCY_KEY_TTL = 24 * 60 * 60
+IDEMPOTENCY_LOCK_TIMEOUT = 30
+
+# Signed email verification and password reset tokens (see api/tokens.py)
+EMAIL_VERIFICATION_TOKEN_MAX_AGE = 5 * 60
+PASSWORD_RESET_TOKEN_MAX_AGE = 10 * 60
+AUTH_TOKEN_REVOCATION = False
+
+# Per-process LRU in front of the shared cache for product lookups (see api/product_cache.py)
+PRODUCT_CACHE = {
+    'MAX_ENTRIES': 20000,
+    'MAX_BYTES': 32 * 1024 * 1024,
+    'LOCAL_TTL': 60,
+    'SHARED_TTL': 300,
+    'SYNC_INTERVAL': 1.0,
+    'MAX_SYNC_GAP': 1000,
+}
+
+# Opt-in view profiling: a staff request with HEADER, or SAMPLE_RATE of requests to ROUTES (url names)
+PROFILING = {
+    'ENABLED': False,
+    'HEADER': 'X-Profile',
+    'SAMPLE_RATE': 0.0,
+    'ROUTES': ['order-list', 'user-orders'],
+    'BUFFER_SIZE': 50,
+}
+
+# Prometheus metrics at /metrics. DIRECTORY is shared by every web and Celery process (the
+# metrics_data volume in docker-compose) to aggregate across them; each process writes a snapshot
+# there at most every FLUSH_INTERVAL seconds. Snapshots not written for MAX_SNAPSHOT_AGE seconds
+# are deleted. With DIRECTORY None a scrape only sees the serving process.
+METRICS = {
+    'ENABLED': True,
+    'DIRECTORY': BASE_DIR / 'metrics',
+    'FLUSH_INTERVAL': 5.0,
+    'MAX_SNAPSHOT_AGE': 60 * 60,
+    'EMAIL_BACKEND': 'django.core.mail.backends.smtp.EmailBackend',
+}
+
+# Server-sent order status events; the local broker only reaches streams in the publishing process
+ORDER_EVENTS = {
+    'BROKER': 'local' if DEBUG else 'redis',
+    'REDIS_URL': 'redis://redis:6379/2',
+    'CHANNEL_PREFIX': 'order-events:',
+    'KEEPALIVE': 15,
+    'QUEUE_SIZE': 100,
+}
+
+# Monthly order partitions (PostgreSQL) and `manage.py archive_orders`
+ORDER_PARTITION_MONTHS_AHEAD = 3
+ORDER_RETENTION_MONTHS = 24
+ORDER_ARCHIVE_DIR = BASE_DIR / 'archive'
+
+# `/products/?facets=true` counts; PRICE_BUCKETS are the default lower edges of the price histogram
+PRODUCT_FACETS = {
+    'PRICE_BUCKETS': [0, 10, 25, 50, 100, 250, 500],
+    'MAX_PRICE_BUCKETS': 20,
+    'TIMEOUT': 5 * 60,
+}
+
+# Large JSON lists (/products/info/, /products/?limit= of at least MIN_ITEMS) are written CHUNK_SIZE items at a time
+# when ENABLED; off by default, as streamed responses bypass the renderer
+STREAMING_JSON = {
+    'ENABLED': False,
+    'MIN_ITEMS': 500,
+    'CHUNK_SIZE': 500,
+}
+
+# "Frequently bought together" neighbours (see api/recommendations.py): TOP_K kept per product,
+# computed CHUNK_SIZE product ids at a time
+RELATED_PRODUCTS = {
+    'TOP_K': 10,
+    'CHUNK_SIZE': 1000,
+}
+
+# /products/autocomplete/ (see api/autocomplete.py): each process indexes product names on first use,
+# reading CHUNK_SIZE rows at a time, and replays product writes at most every SYNC_INTERVAL seconds
+AUTOCOMPLETE = {
+    'MIN_LENGTH': 2,
+    'LIMIT': 10,
+    'MAX_LIMIT': 50,
+    'TYPO_MIN_LENGTH': 4,
+    'SYNC_INTERVAL': 1.0,
+    'CHUNK_SIZE': 5000,
+}
+
+# Stock held by a pending order is released, and the order cancelled, TTL seconds after checkout.
+# The reaper cancels BATCH_SIZE orders per transaction.
+STOCK_HOLDS = {
+    'TTL': 30 * 60,
+    'BATCH_SIZE': 500,
+}
+
+# Cached /user-orders/ pages, bounded per user and dropped on any write to their orders
+USER_ORDER_CACHE = {
+    'MAX_BYTES': 256 * 1024,
+    'TIMEOUT': 10 * 60,
+}
+
 # Email settings
-EMAIL_BACKEND = 'django.core.mail.backends.smtp.EmailBackend'
+# Times METRICS['EMAIL_BACKEND'], which does the actual sending
+EMAIL_BACKEND = 'api.metrics.TimedEmailBackend'
 EMAIL_HOST = 'smtp.gmail.com'
 EMAIL_PORT = 587
 EMAIL_USE_TLS = True
@@ -151,8 +263,22 @@ DEFAULT_FROM_EMAIL = 'your-email@gmail.com'
 # Cache settings
 CACHES = {
     'default': {
-        'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+        'BACKEND': 'api.cache_backends.ResilientRedisCache',
         'LOCATION': 'redis://redis:6379/1',
+        # A stalled Redis costs a request at most these many seconds, and only until the breaker opens
+        'OPTIONS': {
+            'socket_connect_timeout': 0.25,
+            'socket_timeout': 0.25,
+        },
+        # Open after FAILURE_THRESHOLD consecutive errors, retry after RESET_TIMEOUT seconds;
+        # meanwhile reads are served from a per-process copy of recently read values
+        'CIRCUIT_BREAKER': {
+            'FAILURE_THRESHOLD': 5,
+            'RESET_TIMEOUT': 10,
+            'FALLBACK_MAX_ENTRIES': 1000,
+            'FALLBACK_MAX_BYTES': 8 * 1024 * 1024,
+            'FALLBACK_TTL': 300,
+        },
     }
 }
 
@@ -162,4 +288,24 @@ CELERY_RESULT_BACKEND = 'redis://redis:6379/0'
 CELERY_ACCEPT_CONTENT = ['json']
 CELERY_TASK_SERIALIZER = 'json'
 CELERY_RESULT_SERIALIZER = 'json'
-CELERY_TIMEZONE = TIME_ZONE
\ No newline at end of file
+CELERY_TIMEZONE = TIME_ZONE
+CELERY_BEAT_SCHEDULE = {
+    'scan-low-stock': {
+        'task': 'api.tasks.scan_low_stock',
+        'schedule': 15 * 60,
+    },
+    'create-order-partitions': {
+        'task': 'api.tasks.create_order_partitions',
+        'schedule': 24 * 60 * 60,
+    },
+    # Confirmed orders update their products as they come in; the nightly rebuild also
+    # drops orders that were cancelled or refunded since
+    'rebuild-related-products': {
+        'task': 'api.tasks.rebuild_related_products',
+        'schedule': 24 * 60 * 60,
+    },
+    'release-expired-holds': {
+        'task': 'api.tasks.release_expired_holds',
+        'schedule': 60,
+    },
+}
\ No newline at end of file